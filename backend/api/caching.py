@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+from typing import Callable
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+
+from core.config import settings
+from db import crud
+from db.database import AsyncReadSessionLocal
+from services.response_cache import CachedResponse, response_cache
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+class CachedRoute(APIRoute):
+    """
+    Route class for per-user GET endpoints (those with a 'user_id' path parameter).
+    Reads the user's data version, then answers If-None-Match with 304 and serves
+    repeated requests from the response cache, both without running the endpoint.
+    Streamed responses get an ETag but are not stored.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def cached_handler(request: Request) -> Response:
+            user_id = request.path_params.get("user_id")
+            if not settings.RESPONSE_CACHE_ENABLED or request.method != "GET" or user_id is None:
+                return await handler(request)
+            try:
+                user_id = int(user_id)
+            except ValueError:
+                return await handler(request)
+            async with AsyncReadSessionLocal() as db:
+                data_version = await crud.get_data_version(db, user_id)
+            if data_version is None:
+                # Unknown user: left to the endpoint
+                return await handler(request)
+
+            # Keyed on today's (UTC) date too, as some responses are relative to today
+            today = datetime.now(timezone.utc).date()
+            key = response_cache.key(user_id, data_version, today, request.url.path, request.url.query)
+            etag = response_cache.etag(key)
+            cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+            if _etag_matches(request.headers.get("if-none-match", ""), etag):
+                return Response(status_code=304, headers=cache_headers)
+
+            cached = response_cache.get(key)
+            if cached:
+                response = Response(content=cached.body, status_code=cached.status_code)
+                response.raw_headers = list(cached.headers)
+                return response
+
+            response = await handler(request)
+            if response.status_code != 200:
+                return response
+            response.headers.update(cache_headers)
+            if not isinstance(response, StreamingResponse):
+                response_cache.put(key, CachedResponse(response.status_code, list(response.raw_headers), response.body))
+            return response
+
+        return cached_handler
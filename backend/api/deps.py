@@ -1,8 +1,10 @@
-from db.database import SessionLocal
+from db.database import AsyncSessionLocal, AsyncReadSessionLocal
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_read_db():
+    """Read-only session for the data and export endpoints: the read replica if configured, else the primary."""
+    async with AsyncReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -0,0 +1,91 @@
+import time
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from core import metrics
+from services.credential_cache import credential_cache
+from services.google_api import google_api
+from services.response_cache import response_cache
+from services.sync_jobs import sync_jobs
+from services.sync_scheduler import scheduler
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency of every HTTP request by route template
+    (e.g. /users/{user_id}/data/steps, so user ids do not become labels), and the time
+    the request spent in SQL statements. The duration covers the whole response,
+    streamed bodies included.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        sql_seconds = [0.0]
+        token = metrics.request_sql_seconds.set(sql_seconds)
+        metrics.HTTP_REQUESTS_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.HTTP_REQUESTS_IN_PROGRESS.dec()
+            metrics.request_sql_seconds.reset(token)
+            route = scope.get("route")
+            # Unmatched paths (404s) share one label
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            metrics.HTTP_REQUEST_SECONDS.labels(method=method, route=route_path, status=status).observe(elapsed)
+            metrics.HTTP_REQUEST_SQL_SECONDS.labels(method=method, route=route_path).observe(sql_seconds[0])
+
+# --- Stats of the caches, clients and background workers, read on scrape ---
+def _labelled(family, values: dict):
+    for label, value in values.items():
+        family.add_metric([label], value)
+    return family
+
+class StatsCollector(Collector):
+    """Collects the stats() of the caches, clients and background workers when /metrics is scraped."""
+
+    def collect(self):
+        cache = response_cache.stats()
+        yield GaugeMetricFamily("healthsync_response_cache_entries", "Responses in the response cache.", value=cache["entries"])
+        yield GaugeMetricFamily("healthsync_response_cache_bytes", "Size of the responses in the response cache.", value=cache["size_bytes"])
+        yield _labelled(
+            CounterMetricFamily("healthsync_response_cache_lookups", "Response cache lookups by result.", labels=["result"]),
+            {"hit": cache["hits"], "miss": cache["misses"]}
+        )
+
+        credentials = credential_cache.stats()
+        yield GaugeMetricFamily("healthsync_credential_cache_users", "Users with cached OAuth tokens.", value=credentials["cached_users"])
+        yield GaugeMetricFamily("healthsync_credential_cache_pending_writes", "Refreshed tokens not yet written to the database.", value=credentials["pending_writes"])
+        yield _labelled(
+            CounterMetricFamily("healthsync_token_refreshes", "OAuth token refreshes by result.", labels=["result"]),
+            {"refreshed": credentials["refreshed"], "failed": credentials["failed"]}
+        )
+
+        google = google_api.stats()
+        yield CounterMetricFamily("healthsync_google_api_requests", "Requests sent to Google APIs, retries included.", value=google["requests"])
+        yield CounterMetricFamily("healthsync_google_api_retries", "Retried requests to Google APIs.", value=google["retries"])
+        yield CounterMetricFamily("healthsync_google_api_throttled", "429 responses from Google APIs.", value=google["throttled"])
+
+        yield GaugeMetricFamily("healthsync_sync_jobs_active", "Sync jobs queued or running in this process.", value=sync_jobs.stats()["active"])
+        scheduler_stats = scheduler.stats()
+        yield _labelled(
+            GaugeMetricFamily("healthsync_scheduler_users", "Users known to the background sync scheduler, by state.", labels=["state"]),
+            {state: scheduler_stats[state] for state in ("backlog", "queued", "in_progress", "waiting_for_retry")}
+        )
+
+metrics.registry.register(StatsCollector())
@@ -1,10 +1,13 @@
-import httpx
+import asyncio
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import RedirectResponse, JSONResponse 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from api.deps import get_db
+from api.deps import get_async_db
 from services import google_fit_service
+from services.credential_cache import credential_cache
+from services.google_api import google_api
+from core.config import settings
 from db import crud
 
 router = APIRouter(
@@ -12,40 +15,61 @@ router = APIRouter(
     tags=["Authentication"]
 )
 
+# The state and PKCE code verifier of a login travel to its callback in the browser's cookies,
+# so concurrent logins never share a flow
+STATE_COOKIE = "google_oauth_state"
+VERIFIER_COOKIE = "google_oauth_verifier"
+LOGIN_COOKIE_MAX_AGE_SECONDS = 600
+
 @router.get("/login")
 def auth_google_login():
-    authorization_url, state = google_fit_service.get_google_auth_url()
-    return RedirectResponse(authorization_url)
+    authorization_url, state, code_verifier = google_fit_service.get_google_auth_url()
+    response = RedirectResponse(authorization_url)
+    for name, value in ((STATE_COOKIE, state), (VERIFIER_COOKIE, code_verifier)):
+        response.set_cookie(
+            name, value, max_age=LOGIN_COOKIE_MAX_AGE_SECONDS, path=router.prefix, httponly=True,
+            secure=settings.REDIRECT_URI.startswith("https://"), samesite="lax"
+        )
+    return response
 
 @router.get("/callback")
-async def auth_google_callback(request: Request, db: Session = Depends(get_db)):
+async def auth_google_callback(request: Request, db: AsyncSession = Depends(get_async_db)):
     if 'error' in request.query_params:
         error_details = request.query_params['error']
         return JSONResponse(status_code=400, content={"message": f"Authorization error: {error_details}"})
         
+    state, code_verifier = request.cookies.get(STATE_COOKIE), request.cookies.get(VERIFIER_COOKIE)
+    if not state or not code_verifier:
+        return JSONResponse(status_code=400, content={"message": "Login session expired or missing, please log in again."})
+
     try:
-        credentials = google_fit_service.fetch_google_token(str(request.url))
+        # The token exchange is a blocking HTTP call, so it runs in a worker thread
+        credentials = await asyncio.to_thread(google_fit_service.fetch_google_token, str(request.url), state, code_verifier)
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": f"Error fetching token: {e}"})
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            "https://www.googleapis.com/oauth2/v3/userinfo",
-            headers={"Authorization": f"Bearer {credentials.token}"}
-        )
-    
+    response = await google_api.get(
+        "https://www.googleapis.com/oauth2/v3/userinfo",
+        headers={"Authorization": f"Bearer {credentials.token}"}
+    )
+
     if response.status_code != 200:
         return JSONResponse(status_code=response.status_code, content={"message": "Failed to fetch user data."})
         
     user_info = response.json()
-    db_user = crud.create_or_update_user(
+    db_user = await crud.create_or_update_user(
         db=db,
         google_id=user_info.get("sub"),
         email=user_info.get("email"),
         access_token=credentials.token,
-        refresh_token=credentials.refresh_token
+        refresh_token=credentials.refresh_token,
+        token_expiry=credentials.expiry
     )
+    credential_cache.store(db_user.id, db_user.access_token, db_user.refresh_token, db_user.token_expiry)
     
     frontend_url = "http://localhost:3000"
     redirect_url = f"{frontend_url}?user_id={db_user.id}&email={db_user.email}"
-    return RedirectResponse(url=redirect_url)
\ No newline at end of file
+    response = RedirectResponse(url=redirect_url)
+    for name in (STATE_COOKIE, VERIFIER_COOKIE):
+        response.delete_cookie(name, path=router.prefix)
+    return response
\ No newline at end of file
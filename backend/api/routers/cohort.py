@@ -0,0 +1,148 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Literal
+from pydantic import BaseModel, Field
+from datetime import date, datetime as dt, timedelta, timezone
+
+from api.deps import get_read_db
+
+router = APIRouter(
+    prefix="/cohort",
+    tags=["Cohort Analytics"]
+)
+
+# See services.cohort_analytics.COHORT_METRICS
+CohortMetric = Literal[
+    "steps", "heart_rate", "resting_heart_rate", "oxygen_saturation", "lowest_oxygen_saturation",
+    "blood_pressure_systolic", "blood_pressure_diastolic", "sleep_minutes"
+]
+DEFAULT_WINDOW_DAYS = 30
+MAX_RESULTS = 1000
+
+# --- Pydantic Schemas (API response models) ---
+class Histogram(BaseModel):
+    edges: list[float]
+    counts: list[int]
+
+class CohortDistribution(BaseModel):
+    metric: str
+    start: date
+    end: date
+    rows: int # daily values read
+    users: int # users with data
+    mean: float | None
+    std: float | None
+    min: float | None
+    max: float | None
+    percentiles: dict[str, float]
+    histogram: Histogram
+
+class RankedUser(BaseModel):
+    rank: int
+    user_id: int
+    value: float
+    days: int
+    percentile_rank: float
+
+class CohortRanking(BaseModel):
+    metric: str
+    start: date
+    end: date
+    users: int
+    ranking: list[RankedUser]
+
+class Outlier(BaseModel):
+    user_id: int
+    value: float
+    z_score: float
+    direction: Literal["low", "high"]
+
+class CohortOutliers(BaseModel):
+    metric: str
+    start: date
+    end: date
+    users: int
+    lower_fence: float | None
+    upper_fence: float | None
+    outliers: list[Outlier]
+
+# --- Helpers ---
+def window(start: date | None, end: date | None) -> tuple[date, date]:
+    """The requested days, by default the last 30 days up to today (UTC)."""
+    end = end or dt.now(timezone.utc).date()
+    return start or end - timedelta(days=DEFAULT_WINDOW_DAYS - 1), end
+
+async def load(db: AsyncSession, metric: str, user_id: list[int] | None, start: date, end: date):
+    # NumPy is imported with the first cohort request, not with the app
+    from services import cohort_analytics
+    try:
+        return await cohort_analytics.load_user_values(db, metric, user_id, start, end)
+    except cohort_analytics.CohortTooLarge as e:
+        return JSONResponse(status_code=413, content={"message": str(e)})
+
+# --- Endpoints ---
+@router.get("/{metric}/distribution", response_model=CohortDistribution)
+async def get_cohort_distribution(
+    metric: CohortMetric,
+    user_id: Annotated[list[int] | None, Query()] = None,
+    start: date | None = None,
+    end: date | None = None,
+    percentile: Annotated[list[Annotated[float, Field(ge=0, le=100)]], Query()] = [5, 25, 50, 75, 95],
+    bins: Annotated[int, Query(ge=1, le=200)] = 20,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Distribution of a metric across the cohort (all users, or those given with
+    ?user_id=1&user_id=2): each user's mean daily value between 'start' and 'end'
+    (the last 30 days by default), summarised by percentiles and a histogram.
+    """
+    from services import cohort_analytics
+    start, end = window(start, end)
+    user_values = await load(db, metric, user_id, start, end)
+    if isinstance(user_values, JSONResponse):
+        return user_values
+    return {"metric": metric, "start": start, "end": end, "rows": user_values.rows, **cohort_analytics.distribution(user_values.mean, percentile, bins)}
+
+@router.get("/{metric}/ranking", response_model=CohortRanking)
+async def get_cohort_ranking(
+    metric: CohortMetric,
+    user_id: Annotated[list[int] | None, Query()] = None,
+    start: date | None = None,
+    end: date | None = None,
+    order: Literal["desc", "asc"] = "desc",
+    limit: Annotated[int, Query(ge=1, le=MAX_RESULTS)] = 10,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    The users with the highest (order=desc) or lowest (order=asc) mean daily value of a
+    metric, with their percentile rank in the cohort.
+    """
+    from services import cohort_analytics
+    start, end = window(start, end)
+    user_values = await load(db, metric, user_id, start, end)
+    if isinstance(user_values, JSONResponse):
+        return user_values
+    ranking = cohort_analytics.ranking(user_values, limit, descending=order == "desc")
+    return {"metric": metric, "start": start, "end": end, "users": len(user_values.user_ids), "ranking": ranking}
+
+@router.get("/{metric}/outliers", response_model=CohortOutliers)
+async def get_cohort_outliers(
+    metric: CohortMetric,
+    user_id: Annotated[list[int] | None, Query()] = None,
+    start: date | None = None,
+    end: date | None = None,
+    k: Annotated[float, Query(gt=0)] = 1.5,
+    limit: Annotated[int, Query(ge=1, le=MAX_RESULTS)] = 100,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Users whose mean daily value lies outside the cohort's Tukey fences (k times the
+    interquartile range below Q1 or above Q3), e.g. unusually low SpO2, farthest first.
+    """
+    from services import cohort_analytics
+    start, end = window(start, end)
+    user_values = await load(db, metric, user_id, start, end)
+    if isinstance(user_values, JSONResponse):
+        return user_values
+    return {"metric": metric, "start": start, "end": end, **cohort_analytics.outliers(user_values, k, limit)}
@@ -1,16 +1,20 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, AsyncIterator, List, Literal
 from pydantic import BaseModel, ConfigDict
-from datetime import datetime as dt, timedelta, timezone
-from collections import defaultdict
+from datetime import date, datetime as dt, timedelta, timezone
 
-from api.deps import get_db
-from db import models
+from api.caching import CachedRoute
+from api.deps import get_read_db
+from db import crud, models, rollups, timeseries
+from db.database import AsyncReadSessionLocal
 
 router = APIRouter(
     prefix="/users/{user_id}/data",
-    tags=["Data Retrieval"]
+    tags=["Data Retrieval"],
+    route_class=CachedRoute
 )
 
 # --- Pydantic Schemas (API response models) ---
@@ -32,89 +36,242 @@ class DailySleepData(BaseModel):
     date: str
     total_duration_minutes: int
 
+class DailyRollupData(BaseModel):
+    day: date
+    metric: str
+    count: int
+    sum: float
+    min: float
+    max: float
+    mean: float
+    model_config = ConfigDict(from_attributes=True)
+
+class DerivedMetricsDay(BaseModel):
+    day: date
+    # Metric name -> value, e.g. {"resting_heart_rate": 58.0, "steps_avg_7d": 8120.5}
+    values: dict[str, float]
+
+class LatestDerivedMetric(BaseModel):
+    day: date
+    value: float
+
+class AggregatedBucket(BaseModel):
+    bucket: dt
+    count: int
+    # '<value>_<statistic>', e.g. 'value_avg' or 'systolic_max'
+    values: dict[str, float | None]
+
+# --- Raw series helpers ---
+SeriesFormat = Literal["json", "ndjson", "csv"]
+MAX_PAGE_SIZE = 10000
+STREAM_CHUNK_SIZE = 5000
+
+def series_query(model, user_id: int, start: dt | None = None, end: dt | None = None, after: dt | None = None, limit: int | None = None):
+    """
+    Builds the (timestamp, value) query of a series: optionally bounded by [start, end),
+    continuing after the keyset cursor 'after' and limited to 'limit' rows.
+    """
+    query = select(model.timestamp, model.value).where(model.user_id == user_id)
+    if start:
+        query = query.where(model.timestamp >= crud.to_utc_naive(start))
+    if end:
+        query = query.where(model.timestamp < crud.to_utc_naive(end))
+    if after:
+        query = query.where(model.timestamp > crud.to_utc_naive(after))
+    query = query.order_by(model.timestamp)
+    if limit:
+        query = query.limit(limit)
+    return query
+
+async def stream_series(query, fmt: SeriesFormat) -> AsyncIterator[str]:
+    """
+    Streams a series as NDJSON or CSV, reading it from the DB in chunks.
+    Uses its own session, since the response outlives the request's dependencies.
+    """
+    async with AsyncReadSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=STREAM_CHUNK_SIZE))
+        if fmt == "csv":
+            yield "timestamp,value\n"
+            async for rows in result.partitions():
+                yield "".join(f"{timestamp.isoformat()},{value}\n" for timestamp, value in rows)
+        else:
+            async for rows in result.partitions():
+                yield "".join(f'{{"timestamp":"{timestamp.isoformat()}","value":{value}}}\n' for timestamp, value in rows)
+
+async def read_series(db: AsyncSession, model, user_id: int, response: Response, fmt: SeriesFormat, start: dt | None, end: dt | None, after: dt | None, limit: int | None):
+    query = series_query(model, user_id, start=start, end=end, after=after, limit=limit)
+    if fmt != "json":
+        media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+        return StreamingResponse(stream_series(query, fmt), media_type=media_type)
+
+    rows = (await db.execute(query)).all()
+    if limit and len(rows) == limit:
+        # Full page: pass the last timestamp as 'after' to get the next one
+        response.headers["X-Next-Cursor"] = rows[-1].timestamp.isoformat()
+    return rows
+
 # --- Endpoints ---
 @router.get("/steps", response_model=List[StepData])
-def get_steps_data(user_id: int, db: Session = Depends(get_db)):
+async def get_steps_data(
+    user_id: int,
+    response: Response,
+    start: dt | None = None,
+    end: dt | None = None,
+    after: dt | None = None,
+    limit: Annotated[int | None, Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    fmt: Annotated[SeriesFormat, Query(alias="format")] = "json",
+    db: AsyncSession = Depends(get_read_db)
+):
     """
     Retrieves step data saved in the database for the given user, sorted by time.
+    Optional 'start'/'end' bound the range; with 'limit', pages are continued by passing
+    the X-Next-Cursor header as 'after'. format=ndjson or format=csv streams the rows.
     """
-    return db.query(models.Steps).filter(models.Steps.user_id == user_id).order_by(models.Steps.timestamp).all()
+    return await read_series(db, models.Steps, user_id, response, fmt, start, end, after, limit)
 
 @router.get("/heart_rate", response_model=List[HeartRateData])
-def get_heart_rate_data(user_id: int, db: Session = Depends(get_db)):
+async def get_heart_rate_data(
+    user_id: int,
+    response: Response,
+    start: dt | None = None,
+    end: dt | None = None,
+    after: dt | None = None,
+    limit: Annotated[int | None, Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    fmt: Annotated[SeriesFormat, Query(alias="format")] = "json",
+    db: AsyncSession = Depends(get_read_db)
+):
     """
     Retrieves heart rate data saved in the database for the given user, sorted by time.
+    Supports the same range, pagination and streaming options as /steps.
     """
-    return db.query(models.HeartRate).filter(models.HeartRate.user_id == user_id).order_by(models.HeartRate.timestamp).all()
+    return await read_series(db, models.HeartRate, user_id, response, fmt, start, end, after, limit)
 
 @router.get("/sleep/summary", response_model=SleepSummary)
-def get_sleep_summary(user_id: int, db: Session = Depends(get_db)):
+async def get_sleep_summary(user_id: int, db: AsyncSession = Depends(get_read_db)):
     """
-    Returns a summary of the last night's sleep.
-    Finds the last recorded segment and reconstructs the entire last session based on it.
+    Returns a summary of the last night's sleep, i.e. the most recent sleep session.
     """
-    latest_segment = db.query(models.Sleep).filter(models.Sleep.user_id == user_id).order_by(models.Sleep.end_time.desc()).first()
-    if not latest_segment:
-        return SleepSummary(data_available=False)
-
-    session_end_time = latest_segment.end_time
-    session_start_threshold = session_end_time - timedelta(hours=16)
-
-    session_segments = db.query(models.Sleep).filter(
-        models.Sleep.user_id == user_id,
-        models.Sleep.start_time >= session_start_threshold,
-        models.Sleep.end_time <= session_end_time
-    ).all()
-    
-    if not session_segments:
-        return SleepSummary(data_available=False)
-
-    total_sleep_duration = timedelta()
-    sleep_phase_codes = [4, 5, 6]  # 4:light, 5:deep, 6:REM
-
-    for segment in session_segments:
-        if segment.value in sleep_phase_codes:
-            duration = segment.end_time - segment.start_time
-            total_sleep_duration += duration
-    
-    if total_sleep_duration.total_seconds() == 0:
+    session = await crud.get_last_sleep_session(db, user_id)
+    if not session or session.total_sleep_minutes <= 0:
         return SleepSummary(data_available=False)
 
     return SleepSummary(
         data_available=True,
-        total_duration_minutes=int(total_sleep_duration.total_seconds() / 60)
+        total_duration_minutes=int(round(session.total_sleep_minutes, 6))
     )
 
 @router.get("/sleep", response_model=List[DailySleepData])
-def get_daily_sleep_data(user_id: int, db: Session = Depends(get_db)):
+async def get_daily_sleep_data(user_id: int, db: AsyncSession = Depends(get_read_db)):
     """
     Returns a list of daily sleep summaries from the last 30 days for charting purposes.
+    Read from the daily sleep rollups.
+    """
+    first_day = (dt.now(timezone.utc) - timedelta(days=30)).date()
+    result = await db.execute(select(models.DailySleepRollup.day, models.DailySleepRollup.total_sleep_minutes).where(
+        models.DailySleepRollup.user_id == user_id,
+        models.DailySleepRollup.day >= first_day,
+        models.DailySleepRollup.total_sleep_minutes > 0
+    ).order_by(models.DailySleepRollup.day))
+    # Rounded first, so float sums such as 59.9999999 are not truncated to a minute less
+    return [
+        DailySleepData(date=day.isoformat(), total_duration_minutes=int(round(total_minutes, 6)))
+        for day, total_minutes in result
+    ]
+
+@router.get("/{series}/daily", response_model=List[DailyRollupData])
+async def get_daily_rollups(
+    user_id: int,
+    series: str,
+    start: date | None = None,
+    end: date | None = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Returns the daily count, sum, min, max and mean of a series (steps, heart_rate,
+    oxygen_saturation or blood_pressure) between the 'start' and 'end' dates, inclusive.
+    Read from the daily rollups, so the cost depends only on the number of days.
+    """
+    if series not in timeseries.SERIES or series == "sleep":
+        return JSONResponse(status_code=404, content={"message": f"Unknown series '{series}'."})
+    metrics = [rollups.rollup_metric(series, value_name) for value_name in timeseries.SERIES[series]["values"]]
+    query = select(models.DailyRollup).where(models.DailyRollup.user_id == user_id, models.DailyRollup.metric.in_(metrics))
+    if start:
+        query = query.where(models.DailyRollup.day >= start)
+    if end:
+        query = query.where(models.DailyRollup.day <= end)
+    result = await db.execute(query.order_by(models.DailyRollup.day, models.DailyRollup.metric))
+    return result.scalars().all()
+
+@router.get("/derived", response_model=List[DerivedMetricsDay])
+async def get_derived_metrics(
+    user_id: int,
+    metric: Annotated[list[str] | None, Query()] = None,
+    start: date | None = None,
+    end: date | None = None,
+    db: AsyncSession = Depends(get_read_db)
+):
     """
-    time_threshold = dt.now(timezone.utc) - timedelta(days=30)
-    all_segments = db.query(models.Sleep).filter(models.Sleep.user_id == user_id, models.Sleep.end_time > time_threshold).order_by(models.Sleep.start_time).all()
-    if not all_segments:
-        return []
-
-    daily_segments = defaultdict(list)
-    for segment in all_segments:
-        day_key = segment.end_time.date().isoformat()
-        daily_segments[day_key].append(segment)
-
-    daily_summaries = []
-    sleep_phase_codes = [4, 5, 6]
-    for day, segments in daily_segments.items():
-        total_sleep_duration = timedelta()
-        for segment in segments:
-            if segment.value in sleep_phase_codes:
-                duration = segment.end_time - segment.start_time
-                total_sleep_duration += duration
-        
-        if total_sleep_duration.total_seconds() > 0:
-            daily_summaries.append(
-                DailySleepData(
-                    date=day,
-                    total_duration_minutes=int(total_sleep_duration.total_seconds() / 60)
-                )
-            )
-    
-    return sorted(daily_summaries, key=lambda x: x.date)
\ No newline at end of file
+    Returns the derived metrics per day between the 'start' and 'end' dates, inclusive:
+    resting_heart_rate, the 7- and 30-day averages ('<base>_avg_7d', '<base>_avg_30d') and
+    the 30-day blood pressure trends in mmHg per day ('blood_pressure_systolic_trend_30d').
+    ?metric=... selects metrics. Computed at ingest (see db/derived_metrics.py).
+    """
+    query = select(models.DerivedMetric.day, models.DerivedMetric.metric, models.DerivedMetric.value).where(models.DerivedMetric.user_id == user_id)
+    if metric:
+        query = query.where(models.DerivedMetric.metric.in_(metric))
+    if start:
+        query = query.where(models.DerivedMetric.day >= start)
+    if end:
+        query = query.where(models.DerivedMetric.day <= end)
+    days: dict[date, dict[str, float]] = {}
+    for day, name, value in await db.execute(query.order_by(models.DerivedMetric.day, models.DerivedMetric.metric)):
+        days.setdefault(day, {})[name] = value
+    return [DerivedMetricsDay(day=day, values=values) for day, values in days.items()]
+
+@router.get("/derived/latest", response_model=dict[str, LatestDerivedMetric])
+async def get_latest_derived_metrics(user_id: int, db: AsyncSession = Depends(get_read_db)):
+    """Returns the most recent value of every derived metric of the user, with its day."""
+    latest = (
+        select(models.DerivedMetric.metric, func.max(models.DerivedMetric.day).label("day"))
+        .where(models.DerivedMetric.user_id == user_id)
+        .group_by(models.DerivedMetric.metric)
+        .subquery()
+    )
+    result = await db.execute(
+        select(models.DerivedMetric.metric, models.DerivedMetric.day, models.DerivedMetric.value)
+        .join(latest, (models.DerivedMetric.metric == latest.c.metric) & (models.DerivedMetric.day == latest.c.day))
+        .where(models.DerivedMetric.user_id == user_id)
+    )
+    return {name: LatestDerivedMetric(day=day, value=value) for name, day, value in result}
+
+@router.get("/{series}/aggregate", response_model=List[AggregatedBucket])
+async def get_aggregated_data(
+    user_id: int,
+    series: str,
+    bucket: str = "1h",
+    start: dt | None = None,
+    end: dt | None = None,
+    stats: Annotated[list[Literal["min", "max", "avg", "sum"]], Query()] = ["min", "avg", "max"],
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Returns a downsampled series (steps, heart_rate, oxygen_saturation, blood_pressure or sleep)
+    with the requested statistics per time bucket, e.g. ?bucket=1h&stats=min&stats=max.
+    Bucket sizes are given in minutes, hours or days ('15m', '1h', '1d'). The work is done in SQL
+    (time_bucket on TimescaleDB). For sleep the value is the minutes asleep per segment.
+    """
+    if series not in timeseries.SERIES:
+        return JSONResponse(status_code=404, content={"message": f"Unknown series '{series}'."})
+    bucket_seconds = timeseries.parse_bucket(bucket)
+    if not bucket_seconds:
+        return JSONResponse(status_code=400, content={"message": f"Invalid bucket size '{bucket}'."})
+
+    rows = await timeseries.aggregate_series(db, series, user_id, bucket_seconds, stats, start=start, end=end)
+    return [
+        AggregatedBucket(
+            bucket=row["bucket"],
+            count=row["count"],
+            values={key: value for key, value in row.items() if key not in ("bucket", "count")}
+        )
+        for row in rows
+    ]
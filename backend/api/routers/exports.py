@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Annotated, Literal
+from datetime import datetime as dt
+
+from services import columnar_export
+
+router = APIRouter(
+    prefix="/export",
+    tags=["Export"]
+)
+
+ExportSeries = Literal["steps", "heart_rate", "oxygen_saturation", "blood_pressure", "sleep", "sleep_sessions"]
+
+@router.get("/series")
+async def export_series(
+    series: Annotated[list[ExportSeries], Query()],
+    user_id: Annotated[list[int] | None, Query()] = None,
+    start: dt | None = None,
+    end: dt | None = None,
+    fmt: Annotated[Literal["arrow", "parquet", "csv"], Query(alias="format")] = "arrow",
+):
+    """
+    Streams the raw rows of the chosen series (e.g. ?series=steps&series=heart_rate) for
+    the given users (all users if none are given) between 'start' and 'end', as an Arrow
+    IPC stream, a Parquet file or CSV. The tables share one schema: a 'series' column
+    followed by the union of their columns.
+    """
+    if fmt != "csv" and columnar_export.pyarrow() is None:
+        return JSONResponse(status_code=501, content={"message": f"The {fmt} format requires pyarrow; use format=csv."})
+    series_names = list(dict.fromkeys(series))
+    extension = {"arrow": "arrows", "parquet": "parquet", "csv": "csv"}[fmt]
+    return StreamingResponse(
+        columnar_export.stream_columnar_export(series_names, fmt, user_ids=user_id, start=start, end=end),
+        media_type=columnar_export.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="healthsync-export.{extension}"'}
+    )
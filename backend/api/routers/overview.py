@@ -0,0 +1,123 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy import Float, cast, literal, null, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel
+from datetime import date, datetime as dt, timedelta, timezone
+
+from api.caching import CachedRoute
+from api.deps import get_read_db
+from db import crud, models, rollups
+
+router = APIRouter(
+    prefix="/users/{user_id}",
+    tags=["Data Retrieval"],
+    route_class=CachedRoute
+)
+
+TREND_DAYS = 7
+
+# Series of the overview: model, its value columns, and the daily statistic of its rollups
+# (steps add up over a day, measurements are averaged)
+OVERVIEW_SERIES = {
+    "steps": (models.Steps, ["value"], "sum"),
+    "heart_rate": (models.HeartRate, ["value"], "mean"),
+    "oxygen_saturation": (models.OxygenSaturation, ["value"], "mean"),
+    "blood_pressure": (models.BloodPressure, ["systolic", "diastolic"], "mean"),
+}
+SLEEP_VALUES = ["total_sleep_minutes", "light_minutes", "deep_minutes", "rem_minutes", "awake_minutes"]
+
+# --- Pydantic Schemas (API response models) ---
+class OverviewPoint(BaseModel):
+    time: dt
+    values: dict[str, float]
+
+class OverviewDay(BaseModel):
+    day: date
+    values: dict[str, float]
+
+class SeriesOverview(BaseModel):
+    """
+    One data type: its latest point (for sleep, the last night's session), today's value
+    and the daily values of the last 7 days, today included (days without data are left out).
+    A day's value is the total for steps and sleep minutes, the mean for measurements.
+    """
+    latest: OverviewPoint | None = None
+    today: dict[str, float] = {}
+    trend: list[OverviewDay] = []
+    trend_average: dict[str, float] = {}
+
+class Overview(BaseModel):
+    day: date # today (UTC)
+    series: dict[str, SeriesOverview]
+
+# --- Queries ---
+def daily_values_query(user_id: int, first_day: date, last_day: date):
+    """(series, value name, day, value) of the daily rollups of all data types from 'first_day' to 'last_day'."""
+    queries = []
+    for series_name, (_, value_names, statistic) in OVERVIEW_SERIES.items():
+        for value_name in value_names:
+            queries.append(
+                select(literal(series_name), literal(value_name), models.DailyRollup.day, getattr(models.DailyRollup, statistic))
+                .where(
+                    models.DailyRollup.user_id == user_id,
+                    models.DailyRollup.metric == rollups.rollup_metric(series_name, value_name),
+                    models.DailyRollup.day.between(first_day, last_day)
+                )
+            )
+    for value_name in SLEEP_VALUES:
+        queries.append(
+            select(literal("sleep"), literal(value_name), models.DailySleepRollup.day, getattr(models.DailySleepRollup, value_name))
+            .where(models.DailySleepRollup.user_id == user_id, models.DailySleepRollup.day.between(first_day, last_day))
+        )
+    return union_all(*queries)
+
+def latest_points_query(user_id: int, until: dt):
+    """(series, time, first value, second value) of each series' latest point up to 'until', one index lookup each."""
+    queries = []
+    for series_name, (model, value_names, _) in OVERVIEW_SERIES.items():
+        values = [cast(getattr(model, name), Float) for name in value_names]
+        values += [cast(null(), Float)] * (2 - len(values))
+        latest = (
+            select(literal(series_name).label("series"), model.timestamp.label("time"), values[0].label("value_1"), values[1].label("value_2"))
+            .where(model.user_id == user_id, model.timestamp <= until)
+            .order_by(model.timestamp.desc())
+            .limit(1)
+            .subquery()
+        )
+        # Wrapped in a subquery, as compound SELECTs cannot order and limit their members
+        queries.append(select(latest))
+    return union_all(*queries)
+
+# --- Endpoints ---
+@router.get("/overview", response_model=Overview)
+async def get_overview(user_id: int, db: AsyncSession = Depends(get_read_db)):
+    """
+    Returns the dashboard overview of all data types in one response: the latest values,
+    today's totals, the 7-day trends and the last night's sleep. Read with three queries
+    (daily rollups, latest points, last sleep session) on one session.
+    """
+    now = dt.now(timezone.utc).replace(tzinfo=None)
+    today = now.date()
+    first_day = today - timedelta(days=TREND_DAYS - 1)
+    overview = {series_name: SeriesOverview() for series_name in [*OVERVIEW_SERIES, "sleep"]}
+
+    trends: dict[str, dict[date, dict[str, float]]] = {series_name: {} for series_name in overview}
+    for series_name, value_name, day, value in await db.execute(daily_values_query(user_id, first_day, today)):
+        trends[series_name].setdefault(day, {})[value_name] = value
+    for series_name, days in trends.items():
+        series = overview[series_name]
+        series.trend = [OverviewDay(day=day, values=values) for day, values in sorted(days.items())]
+        series.today = days.get(today, {})
+        for name in dict.fromkeys(name for values in days.values() for name in values):
+            daily = [values[name] for values in days.values() if name in values]
+            series.trend_average[name] = sum(daily) / len(daily)
+
+    for series_name, time, value_1, value_2 in await db.execute(latest_points_query(user_id, now)):
+        value_names = OVERVIEW_SERIES[series_name][1]
+        overview[series_name].latest = OverviewPoint(time=time, values=dict(zip(value_names, (value_1, value_2))))
+
+    session = await crud.get_last_sleep_session(db, user_id)
+    if session:
+        overview["sleep"].latest = OverviewPoint(time=session.end_time, values={name: getattr(session, name) for name in SLEEP_VALUES})
+
+    return Overview(day=today, series=overview)
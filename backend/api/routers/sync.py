@@ -1,196 +1,108 @@
-import httpx
-import uuid
-from fastapi import APIRouter, Depends, Query
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from datetime import datetime as dt, timedelta, timezone
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, List, Literal, Optional
+from datetime import datetime as dt
 from dateutil.parser import isoparse
-from api.deps import get_db
-from db import models, crud
-from api.routers.data import get_steps_data, get_heart_rate_data, get_sleep_summary
-from services.google_fit_service import get_and_refresh_credentials
+from api.caching import CachedRoute
+from api.deps import get_async_db, get_read_db
+from db import crud
+from services import hl7_export
+from services.sync_jobs import sync_jobs
+from services.sync_scheduler import scheduler
 
 router = APIRouter(
-    tags=["Synchronization & Export"]
+    tags=["Synchronization & Export"],
+    route_class=CachedRoute
 )
 
-DATA_TYPE_CONFIG = {
-    "AGGREGATE": {
-        "steps": {
-            "dataTypeName": "com.google.step_count.delta",
-            "model": models.Steps,
-            "crud_function": crud.add_steps_data,
-            "parser": lambda p: {"value": p["value"][0].get("intVal")}
-        },
-        "heart_rate": {
-            "dataTypeName": "com.google.heart_rate.bpm",
-            "model": models.HeartRate,
-            "crud_function": crud.add_heart_rate_data,
-            "parser": lambda p: {"value": p["value"][0].get("fpVal")}
-        },
-    },
-    "LIST": {
-        "oxygen_saturation": {
-            "dataTypeName": "com.google.oxygen_saturation",
-            "model": models.OxygenSaturation,
-            "crud_function": crud.add_oxygen_saturation_data,
-            "parser": lambda p: {
-                "timestamp": dt.fromtimestamp(int(p["startTimeNanos"]) / 1e9, tz=timezone.utc),
-                "value": p["value"][0].get("fpVal")
-            }
-        },
-        "blood_pressure": {
-            "dataTypeName": "com.google.blood_pressure",
-            "model": models.BloodPressure,
-            "crud_function": crud.add_blood_pressure_data,
-            "parser": lambda p: {
-                "timestamp": dt.fromtimestamp(int(p["startTimeNanos"]) / 1e9, tz=timezone.utc),
-                "systolic": p["value"][0].get("fpVal"),
-                "diastolic": p["value"][1].get("fpVal")
-            }
-        },
-    }
-}
-
-# --- Helper functions ---
-def parse_aggregate_response(response_json: dict, parser_func: callable) -> list[dict]:
-    """Universal function for parsing aggregated responses from Google Fit."""
-    parsed_data = []
-    for bucket in response_json.get("bucket", []):
-        timestamp = dt.fromtimestamp(int(bucket["endTimeMillis"]) / 1000, tz=timezone.utc)
-        for dataset in bucket.get("dataset", []):
-            for point in dataset.get("point", []):
-                if point.get("value"):
-                    parsed_point = parser_func(point)
-                    if all(v is not None for v in parsed_point.values()):
-                        parsed_data.append({"timestamp": timestamp, **parsed_point})
-    return parsed_data
-
 # --- Endpoints ---
-@router.post("/users/{user_id}/sync")
+@router.post("/users/{user_id}/sync", status_code=202)
 async def sync_user_data(
     user_id: int, 
     days: int = 30, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     exclude: Optional[List[str]] = Query(None)
 ):
     """
-    Starts data synchronization. You can exclude certain data types
-    using the 'exclude' query parameter, e.g. ?exclude=sleep
+    Starts data synchronization as a background job and returns its id at once;
+    poll GET /sync/jobs/{job_id} for its progress and results. You can exclude certain
+    data types using the 'exclude' query parameter, e.g. ?exclude=sleep
+    Only the data since the last sync of each type is fetched ('days' bounds the window).
+    Long ranges, e.g. ?days=365 to backfill a new user's history, are fetched in parallel
+    windows and committed window by window; a repeated request resumes where one stopped.
+    If a sync of the user is already running, on any worker, the request joins it.
     """
-    exclude = exclude or []
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    db_user = await crud.get_user(db, user_id)
     if not db_user:
         return JSONResponse(status_code=404, content={"message": "User not found."})
-    
-    # STEP 1: Obtain a valid token (refreshed if necessary)
-    credentials = get_and_refresh_credentials(db=db, user=db_user)
-    if not credentials or not credentials.token:
-        return JSONResponse(
-            status_code=401,
-            content={"message": "Failed to refresh token or token is invalid. Please re-authenticate."}
-        )
-    
-    access_token = credentials.token
-    headers = {"Authorization": f"Bearer {access_token}"}
-    end_time = dt.now(timezone.utc)
-    start_time = end_time - timedelta(days=days)
-    sync_results = {}
-    
-    # STEP 2: Use a valid token to synchronize data
-    async with httpx.AsyncClient() as client:
-        # Loops for AGGREGATE and LIST data
-        for data_category, data_configs in DATA_TYPE_CONFIG.items():
-            for data_key, config in data_configs.items():
-                if data_key in exclude:
-                    sync_results[data_key] = "Skipped on request."
-                    continue
-                
-                db.query(config["model"]).filter(config["model"].user_id == user_id).delete()
-                
-                if data_category == "AGGREGATE":
-                    endpoint = "https://www.googleapis.com/fitness/v1/users/me/dataset:aggregate"
-                    body = {"aggregateBy": [{"dataTypeName": config["dataTypeName"]}], "bucketByTime": {"durationMillis": 86400000}, "startTimeMillis": int(start_time.timestamp() * 1000), "endTimeMillis": int(end_time.timestamp() * 1000)}
-                    response = await client.post(endpoint, json=body, headers=headers)
-                else: # LIST
-                    source = f"derived:{config['dataTypeName']}:com.google.android.gms:merged"
-                    endpoint = f"https://www.googleapis.com/fitness/v1/users/me/dataSources/{source}/datasets/{int(start_time.timestamp() * 1e9)}-{int(end_time.timestamp() * 1e9)}"
-                    response = await client.get(endpoint, headers=headers)
-                
-                if response.status_code != 200:
-                    sync_results[data_key] = f"Error: {response.status_code}"
-                    continue
-                
-                if data_category == "AGGREGATE":
-                    parsed_data = parse_aggregate_response(response.json(), config["parser"])
-                else: # LIST
-                    raw_data = response.json().get("point", [])
-                    parsed_data = [config["parser"](point) for point in raw_data if point.get("value")]
-                
-                if parsed_data:
-                    config["crud_function"](db=db, user_id=user_id, data=parsed_data)
-                sync_results[data_key] = f"Processed {len(parsed_data)} entries."
-        
-        # Section for sleep (handled separately)
-        if "sleep" not in exclude:
-            # db.query(models.Sleep).filter(models.Sleep.user_id == user_id).delete() // TODO: Uncomment if you want to clear sleep data before sync
-            endpoint = "https://www.googleapis.com/fitness/v1/users/me/sessions"
-            params = {"startTime": start_time.isoformat(timespec='seconds') + "Z", "endTime": end_time.isoformat(timespec='seconds') + "Z", "activityType": 72}
-            response = await client.get(endpoint, headers=headers, params=params)
-            
-            if response.status_code != 200:
-                sync_results["sleep"] = f"Error: {response.status_code}, Details: {response.text}"
-            else:
-                sessions = response.json().get("session", [])
-                segments = []
-                for session in sessions:
-                    for dataset in session.get("dataset", []):
-                        if "sleep.segment" in dataset.get("dataSourceId", ""):
-                            for point in dataset.get("point", []):
-                                if point.get("value") and point["value"][0].get("intVal"):
-                                    segments.append({"start_time": dt.fromtimestamp(int(point["startTimeNanos"]) / 1e9, tz=timezone.utc), "end_time": dt.fromtimestamp(int(point["endTimeNanos"]) / 1e9, tz=timezone.utc), "value": point["value"][0]["intVal"]})
-                if segments:
-                    crud.add_sleep_data(db=db, user_id=user_id, data=segments)
-                sync_results["sleep"] = f"Processed {len(segments)} sleep segments from {len(sessions)} sessions."
-        else:
-            sync_results["sleep"] = "Skipped on request."
 
-    db.commit()
-    return {"message": "Synchronization completed.", "details": sync_results}
+    job, created = await sync_jobs.submit(user_id, days=days, exclude=exclude)
+    status_url = f"/sync/jobs/{job.id}"
+    return JSONResponse(
+        status_code=202,
+        headers={"Location": status_url},
+        content={
+            "message": "Synchronization started." if created else "Synchronization already in progress.",
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": status_url
+        }
+    )
 
+@router.get("/sync/jobs/{job_id}")
+async def get_sync_job(job_id: str):
+    """
+    Returns the status of a sync job, the progress of every data type and, once the job
+    is completed, the per-data-type results ('details'). Any worker reports on any job.
+    """
+    job = await sync_jobs.get(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"message": "Sync job not found."})
+    return job.to_dict()
 
-# --- HL7/JSON export logic ---
-def create_msh_segment():
-    return {"segment": "MSH", "sending_application": "HealthSyncApp", "sending_facility": "HealthSyncFacility", "datetime_of_message": dt.now(timezone.utc).strftime('%Y%m%d%H%M%S'), "message_type": "ORU^R01", "message_control_id": str(uuid.uuid4()), "processing_id": "P", "version_id": "2.3"}
-
-def create_pid_segment(user: models.User):
-    return {"segment": "PID", "patient_id": user.id, "external_patient_id": user.google_id, "patient_name": "User^Anonymized", "patient_email": user.email}
+@router.get("/sync/scheduler/stats")
+def get_scheduler_stats():
+    """
+    Returns throughput and backlog statistics of the background sync scheduler.
+    """
+    return scheduler.stats()
 
-def create_obx_segment(seq_id: int, obs_id: str, obs_text: str, value: any, unit: str, timestamp: dt):
-    return {"segment": "OBX", "set_id": seq_id, "value_type": "NM", "observation_identifier": f"{obs_id}^{obs_text}", "observation_value": str(value), "units": unit, "observation_result_status": "F", "observation_datetime": timestamp.strftime('%Y%m%d%H%M%S')}
 
+# --- HL7 export ---
 @router.get("/users/{user_id}/export/hl7")
-def export_user_data_as_hl7_json(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+async def export_user_data_as_hl7_json(
+    user_id: int,
+    start: dt | None = None,
+    end: dt | None = None,
+    fmt: Annotated[Literal["json", "er7"], Query(alias="format")] = "json",
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Exports the user's latest observations as an HL7 v2 ORU^R01 message, as JSON segments
+    or, with format=er7, as pipe-delimited HL7 v2. 'start'/'end' limit the observations
+    to a time range.
+    """
+    user = await crud.get_user(db, user_id)
     if not user:
         return JSONResponse(status_code=404, content={"message": "User not found."})
 
-    hl7_message = [create_msh_segment(), create_pid_segment(user)]
-    obx_sequence_id = 1
+    hl7_message = await hl7_export.build_hl7_message(db, user, start=start, end=end)
+    if fmt == "er7":
+        return Response(content=hl7_export.encode_er7(hl7_message), media_type=hl7_export.ER7_MEDIA_TYPE)
+    return JSONResponse(content={"hl7_message": hl7_message})
 
-    # Steps
-    for entry in get_steps_data(user_id=user_id, db=db)[-7:]:
-        hl7_message.append(create_obx_segment(obx_sequence_id, "88942-2", "Number of steps in 24 hour Measured", entry.value, "steps", entry.timestamp))
-        obx_sequence_id += 1
-    # Heart rate
-    for entry in get_heart_rate_data(user_id=user_id, db=db)[-10:]:
-        hl7_message.append(create_obx_segment(obx_sequence_id, "8867-4", "Heart rate", entry.value, "bpm", entry.timestamp))
-        obx_sequence_id += 1
-    # Sleep
-    sleep_summary = get_sleep_summary(user_id=user_id, db=db)
-    if sleep_summary.data_available and sleep_summary.total_duration_minutes is not None:
-        hl7_message.append(create_obx_segment(obx_sequence_id, "2482-2", "Sleep duration", sleep_summary.total_duration_minutes, "min", dt.now(timezone.utc)))
-        obx_sequence_id += 1
-        
-    return JSONResponse(content={"hl7_message": hl7_message})
\ No newline at end of file
+@router.get("/export/hl7")
+async def export_cohort_as_hl7(
+    user_id: Annotated[list[int] | None, Query()] = None,
+    start: dt | None = None,
+    end: dt | None = None,
+    fmt: Annotated[Literal["er7", "ndjson"], Query(alias="format")] = "er7",
+):
+    """
+    Streams one ORU^R01 message per user for a whole cohort (all users, or those given
+    with ?user_id=1&user_id=2): an HL7 v2 batch by default, or NDJSON of the JSON messages
+    with format=ndjson. Messages are sent as they are built.
+    """
+    media_type = hl7_export.ER7_MEDIA_TYPE if fmt == "er7" else "application/x-ndjson"
+    return StreamingResponse(hl7_export.stream_bulk_export(user_id, fmt, start=start, end=end), media_type=media_type)
@@ -0,0 +1,66 @@
+"""
+Measures the fetch/parse stage of a sync against the local Google Fit stub,
+sequentially (concurrency 1) and fanned out (SYNC_MAX_CONCURRENCY).
+
+    python -m benchmarks.bench_sync_fanout --latency 0.2 --days 30
+"""
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime as dt, timedelta, timezone
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "benchmark")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "benchmark")
+os.environ.setdefault("REDIRECT_URI", "http://localhost/callback")
+
+import httpx
+
+from services.sync_service import DATA_TYPE_CONFIG, fetch_all
+from benchmarks.google_fit_stub import create_transport
+from core.config import settings
+
+def build_plan(days: int) -> list[dict]:
+    end_time = dt.now(timezone.utc)
+    start_time = end_time - timedelta(days=days)
+    plan = [
+        {"data_key": data_key, "category": data_category, "config": config, "start": start_time, "end": end_time}
+        for data_category, data_configs in DATA_TYPE_CONFIG.items()
+        for data_key, config in data_configs.items()
+    ]
+    plan.append({"data_key": "sleep", "category": "SESSION", "config": None, "start": start_time, "end": end_time})
+    return plan
+
+async def run(concurrency: int, latency: float, days: int, rounds: int) -> float:
+    plan = build_plan(days)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(transport=create_transport(latency), limits=limits) as client:
+        rows = 0
+
+        async def emit(index: int, kind: str, batch: list[dict]):
+            nonlocal rows
+            rows += len(batch)
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            errors = await fetch_all(client, plan, {"Authorization": "Bearer benchmark"}, concurrency, emit)
+        elapsed = (time.perf_counter() - started) / rounds
+    assert not any(errors) and rows, errors
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated Google round trip in seconds")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    sequential = asyncio.run(run(1, args.latency, args.days, args.rounds))
+    concurrent = asyncio.run(run(settings.SYNC_MAX_CONCURRENCY, args.latency, args.days, args.rounds))
+    print(f"sequential (concurrency=1): {sequential * 1000:8.1f} ms per sync")
+    print(f"fan-out (concurrency={settings.SYNC_MAX_CONCURRENCY}):    {concurrent * 1000:8.1f} ms per sync")
+    print(f"speed-up: {sequential / concurrent:.2f}x")
+
+if __name__ == "__main__":
+    main()
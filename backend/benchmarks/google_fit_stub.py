@@ -0,0 +1,169 @@
+"""
+Local stand-in for the Google Fit endpoints used by the sync, built on httpx.MockTransport.
+
+Responses are generated on the fly from the request window by a synthetic data
+generator: steps and heart rate follow a daily activity profile, SpO2 and blood
+pressure are spot readings every 'interval_seconds', and every night has a sleep
+session with light/deep/REM cycles. Values are deterministic pseudo-random noise
+seeded by the access token, so each benchmark user gets its own reproducible data.
+An optional per-request latency mimics the round trip to Google.
+"""
+import asyncio
+import json
+import zlib
+from datetime import datetime as dt
+
+import httpx
+
+HOUR_MILLIS = 3600 * 1000
+DAY_MILLIS = 24 * HOUR_MILLIS
+NANOS_PER_MILLI = 10**6
+
+# Share of the day's activity per hour of the day (UTC): quiet at night, peaks at commute times
+ACTIVITY_PROFILE = [0.1, 0.05, 0.05, 0.05, 0.05, 0.2, 0.6, 1.5, 2.0, 1.2, 1.0, 1.1, 1.6, 1.2, 1.0, 1.0, 1.3, 2.0, 2.2, 1.5, 1.0, 0.7, 0.4, 0.2]
+ACTIVITY_TOTAL = sum(ACTIVITY_PROFILE)
+
+# Sleep stages of Google Fit (4 light, 5 deep, 6 REM, 1 awake) and their minutes in one cycle
+SLEEP_CYCLE = [(4, 35), (5, 25), (4, 15), (6, 20), (1, 5)]
+
+def noise(seed: int, *keys: int) -> float:
+    """Deterministic pseudo-random number in [0, 1) for the given seed and keys."""
+    value = seed
+    for key in keys:
+        value = (value * 1_000_003 ^ key) & 0xFFFFFFFF
+    value = (value * 2_654_435_761) & 0xFFFFFFFF
+    return ((value >> 7) % 100_003) / 100_003
+
+def user_seed(request: httpx.Request) -> int:
+    return zlib.crc32(request.headers.get("Authorization", "").encode())
+
+# --- Aggregates (steps, heart rate) ---
+def daily_steps(seed: int, day: int) -> int:
+    return int(4000 + 9000 * noise(seed, day))
+
+def bucket_steps(seed: int, start: int, duration: int) -> int:
+    """Steps between 'start' and 'start + duration' (epoch milliseconds)."""
+    if duration >= DAY_MILLIS:
+        return sum(daily_steps(seed, day) for day in range(start // DAY_MILLIS, (start + duration) // DAY_MILLIS))
+    hour = start // HOUR_MILLIS % 24
+    return int(daily_steps(seed, start // DAY_MILLIS) * ACTIVITY_PROFILE[hour] / ACTIVITY_TOTAL * duration / HOUR_MILLIS)
+
+def bucket_heart_rate(seed: int, start: int, duration: int) -> tuple[float, float, float]:
+    """Average, maximum and minimum heart rate of a bucket."""
+    resting = 55 + 15 * noise(seed)
+    if duration >= DAY_MILLIS:
+        activity = 1.0
+    else:
+        activity = ACTIVITY_PROFILE[start // HOUR_MILLIS % 24]
+    average = round(resting + 12 * activity + 6 * noise(seed, start), 1)
+    return average, round(average + 10 + 30 * noise(seed, start, 1), 1), round(resting - 5 + 5 * noise(seed, start, 2), 1)
+
+def _aggregate_response(request: httpx.Request) -> dict:
+    body = json.loads(request.content)
+    start, end = body["startTimeMillis"], body["endTimeMillis"]
+    duration = body["bucketByTime"]["durationMillis"]
+    data_type = body["aggregateBy"][0]["dataTypeName"]
+    seed = user_seed(request)
+    buckets = []
+    for bucket_start in range(start, end, duration):
+        if "step_count" in data_type:
+            value = [{"intVal": bucket_steps(seed, bucket_start, duration), "mapVal": []}]
+        else:
+            value = [{"fpVal": statistic, "mapVal": []} for statistic in bucket_heart_rate(seed, bucket_start, duration)]
+        buckets.append({
+            "startTimeMillis": str(bucket_start),
+            "endTimeMillis": str(bucket_start + duration),
+            "dataset": [{
+                "dataSourceId": f"derived:{data_type}:com.google.android.gms:aggregated",
+                "point": [{
+                    "startTimeNanos": str(bucket_start * NANOS_PER_MILLI),
+                    "endTimeNanos": str((bucket_start + duration) * NANOS_PER_MILLI),
+                    "dataTypeName": data_type if "step_count" in data_type else "com.google.heart_rate.summary",
+                    "value": value
+                }]
+            }]
+        })
+    return {"bucket": buckets}
+
+# --- Datasets (SpO2, blood pressure) ---
+def _dataset_response(request: httpx.Request, interval_nanos: int) -> dict:
+    start, end = (int(part) for part in request.url.path.rsplit("/", 1)[1].split("-"))
+    seed = user_seed(request)
+    blood_pressure = "blood_pressure" in request.url.path
+    first = start - start % interval_nanos + interval_nanos
+    timestamps = range(first, end, interval_nanos)
+    # Paged like Google Fit when a limit is given; the page token is the offset
+    offset = int(request.url.params.get("pageToken", 0))
+    limit = int(request.url.params.get("limit", len(timestamps)))
+    points = []
+    for t in timestamps[offset:offset + limit]:
+        if blood_pressure:
+            systolic = round(108 + 30 * noise(seed, t), 1)
+            value = [{"fpVal": systolic}, {"fpVal": round(systolic * 0.62 + 8 * noise(seed, t, 1), 1)}]
+        else:
+            value = [{"fpVal": round(94.5 + 4.5 * noise(seed, t), 1)}]
+        points.append({"startTimeNanos": str(t), "endTimeNanos": str(t), "value": value})
+    response = {"minStartTimeNs": str(start), "maxEndTimeNs": str(end), "point": points}
+    if offset + limit < len(timestamps):
+        response["nextPageToken"] = str(offset + limit)
+    return response
+
+# --- Sleep sessions ---
+def sleep_session(seed: int, day: int) -> dict:
+    """The session of the night starting on 'day' (days since the epoch): bedtime around 22:30 UTC."""
+    start = day * DAY_MILLIS + 22 * HOUR_MILLIS + int(noise(seed, day) * 2 * HOUR_MILLIS)
+    cycles = 4 + int(noise(seed, day, 1) * 2)
+    points = []
+    segment_start = start
+    for cycle in range(cycles):
+        for stage, minutes in SLEEP_CYCLE:
+            minutes = int(minutes * (0.7 + 0.6 * noise(seed, day, cycle, stage)))
+            segment_end = segment_start + minutes * 60000
+            points.append({
+                "startTimeNanos": str(segment_start * NANOS_PER_MILLI),
+                "endTimeNanos": str(segment_end * NANOS_PER_MILLI),
+                "value": [{"intVal": stage}]
+            })
+            segment_start = segment_end
+    return {
+        "id": f"sleep-{seed}-{day}",
+        "name": "Sleep",
+        "activityType": 72,
+        "startTimeMillis": str(start),
+        "endTimeMillis": str(segment_start),
+        "dataset": [{"dataSourceId": "derived:com.google.sleep.segment:merged", "point": points}]
+    }
+
+def _rfc3339_millis(value: str) -> int:
+    """Epoch milliseconds of a time as sent in the sessions query."""
+    return int(dt.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000)
+
+def _sessions_response(request: httpx.Request) -> dict:
+    start = _rfc3339_millis(request.url.params["startTime"])
+    end = _rfc3339_millis(request.url.params["endTime"])
+    seed = user_seed(request)
+    sessions = [sleep_session(seed, day) for day in range(start // DAY_MILLIS - 1, end // DAY_MILLIS + 1)]
+    return {"session": [session for session in sessions if start <= int(session["startTimeMillis"]) and int(session["endTimeMillis"]) <= end]}
+
+def create_transport(latency: float = 0.0, interval_seconds: int = 3600) -> httpx.MockTransport:
+    """
+    Returns a transport answering the aggregate, dataset, sessions, token and userinfo
+    endpoints; 'interval_seconds' is the spacing of the SpO2 and blood pressure readings.
+    """
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        path = request.url.path
+        if path.endswith("dataset:aggregate"):
+            return httpx.Response(200, json=_aggregate_response(request))
+        if "/datasets/" in path:
+            return httpx.Response(200, json=_dataset_response(request, interval_seconds * 10**9))
+        if path.endswith("/sessions"):
+            return httpx.Response(200, json=_sessions_response(request))
+        if path.endswith("/token"):
+            return httpx.Response(200, json={"access_token": "stub-access-token", "expires_in": 3599, "token_type": "Bearer"})
+        if path.endswith("/userinfo"):
+            return httpx.Response(200, json={"sub": "stub-user", "email": "stub@example.com"})
+        return httpx.Response(404)
+
+    return httpx.MockTransport(handler)
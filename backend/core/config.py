@@ -1,3 +1,4 @@
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):   
@@ -8,6 +9,42 @@ class Settings(BaseSettings):
     
     # --- Database Variables ---
     DATABASE_URL: str
+    # Optional explicit URL for the async engine; derived from DATABASE_URL if not set
+    ASYNC_DATABASE_URL: str | None = None
+    # Optional read replica for the data and export endpoints (sync and auth use the
+    # primary); its async URL is derived like the primary's unless set explicitly
+    READ_DATABASE_URL: str | None = None
+    ASYNC_READ_DATABASE_URL: str | None = None
+    # Connection pool of each engine (pool size and overflow do not apply to SQLite)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    # Connections older than this are replaced, before servers or proxies drop them
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    # Tests each connection when it is checked out, so a dropped one is replaced
+    DB_POOL_PRE_PING: bool = True
+    # Applies the migrations (and TimescaleDB provisioning) when the app starts. With
+    # several instances, turn it off and run `python -m db.provisioning` on deploy instead.
+    DB_MIGRATE_ON_STARTUP: bool = True
+
+    # --- TimescaleDB (see db/provisioning.py; ignored on plain PostgreSQL and SQLite) ---
+    # Turns the time-series tables into hypertables when the extension is available
+    TIMESCALEDB_ENABLED: bool = True
+    # Chunk size per table: dense series get short chunks, sparse ones long chunks
+    TIMESCALEDB_CHUNK_INTERVAL_DAYS: dict[str, int] = {
+        "steps": 7,
+        "heart_rate": 7,
+        "sleep": 30,
+        "blood_pressure": 30,
+        "oxygen_saturation": 30,
+    }
+    # Chunks are compressed once all their rows are this old (None: no compression).
+    # Set it above the longest sync or backfill ('days' of a sync): syncs delete and rewrite
+    # their whole window, which is slow in compressed chunks and needs TimescaleDB 2.11+.
+    TIMESCALEDB_COMPRESS_AFTER_DAYS: int | None = None
+    # Raw rows older than this are dropped, chunk by chunk (None: kept forever);
+    # the daily rollups are kept
+    TIMESCALEDB_RETENTION_DAYS: int | None = None
 
     # --- Google OAuth Variables ---
     GOOGLE_CLIENT_ID: str
@@ -30,7 +67,112 @@ class Settings(BaseSettings):
         "https://www.googleapis.com/auth/fitness.blood_pressure.read",
         "https://www.googleapis.com/auth/fitness.oxygen_saturation.read"
     ]
-    
+
+    # --- Synchronization ---
+    # Each sync re-fetches this many hours before the stored watermark,
+    # so late-arriving points from Google Fit are not missed.
+    SYNC_OVERLAP_HOURS: int = 6
+    # Maximum number of Google Fit requests a single sync runs at the same time
+    SYNC_MAX_CONCURRENCY: int = 5
+    # Points requested per page of a Google Fit dataset
+    GOOGLE_FIT_PAGE_SIZE: int = 10000
+    # Parsed rows are written to the DB in batches of this size while a sync streams in
+    SYNC_FLUSH_BATCH_SIZE: int = 5000
+    # Longer ranges (e.g. onboarding backfills) are split into windows of this many days,
+    # fetched in parallel and committed one by one
+    SYNC_WINDOW_DAYS: int = 30
+    # Aggregate windows are shortened so that a request has at most this many buckets
+    SYNC_MAX_BUCKETS_PER_REQUEST: int = 5000
+    # Aggregate bucket size per data type in minutes; one day (1440) for the types not
+    # listed. Must divide a day. Finer buckets are opt-in, as they multiply the points of
+    # the data endpoints and exports, e.g. {"heart_rate": 15} for a resting heart rate
+    # (see RESTING_HEART_RATE_MIN_READINGS).
+    SYNC_BUCKET_MINUTES: dict[str, int] = {}
+
+    # --- Google API client (shared by auth and sync) ---
+    GOOGLE_API_TIMEOUT_SECONDS: float = 30.0
+    GOOGLE_API_MAX_CONNECTIONS: int = 20
+    # Used when the 'h2' package is installed (httpx[http2])
+    GOOGLE_API_HTTP2: bool = True
+    # Token bucket shared by all requests of the process; keep it under the project's quota
+    GOOGLE_API_RATE_PER_SECOND: float = 10.0
+    GOOGLE_API_BURST: int = 20
+    # Retries of 429/5xx responses and connection errors, with jittered exponential backoff
+    GOOGLE_API_MAX_RETRIES: int = 4
+    GOOGLE_API_BACKOFF_BASE_SECONDS: float = 0.5
+    GOOGLE_API_BACKOFF_MAX_SECONDS: float = 30.0
+
+    # --- Ingest ---
+    # Rows per multi-row INSERT ... ON CONFLICT statement
+    INGEST_BATCH_SIZE: int = 1000
+    # From this many rows on, PostgreSQL (asyncpg) ingests go through COPY into a staging table
+    INGEST_COPY_THRESHOLD: int = 5000
+
+    # --- Sync jobs ---
+    # Finished jobs can be polled for this long
+    SYNC_JOB_RETENTION_MINUTES: int = 60
+    # How often a job waits for the user's sync lock held by another worker, and how
+    # often a worker waiting for a job run by another one polls it
+    SYNC_JOB_LOCK_POLL_SECONDS: float = 1.0
+    # How often the worker running a job writes its status and progress to the database
+    SYNC_JOB_HEARTBEAT_SECONDS: float = 5.0
+    # An active job without a heartbeat for this long (its worker stopped) is marked failed
+    # and replaced by the next sync request of the user
+    SYNC_JOB_STALE_SECONDS: int = 60
+
+    # --- Background sync scheduler ---
+    SYNC_SCHEDULER_ENABLED: bool = False
+    # A user is synced again once their oldest watermark is older than this
+    SYNC_SCHEDULER_INTERVAL_MINUTES: int = 60
+    # Fraction of the interval used to spread syncs out randomly
+    SYNC_SCHEDULER_JITTER: float = 0.2
+    SYNC_SCHEDULER_WORKERS: int = 8
+    SYNC_SCHEDULER_POLL_SECONDS: int = 30
+    SYNC_SCHEDULER_DAYS: int = 30
+
+    # --- OAuth token cache ---
+    # Tokens are not used within this many seconds of their expiry...
+    TOKEN_EXPIRY_MARGIN_SECONDS: int = 60
+    # ...and are refreshed in the background from this many seconds before it,
+    TOKEN_PROACTIVE_REFRESH_SECONDS: int = 600
+    # for users whose credentials were used within this many minutes
+    TOKEN_KEEP_WARM_MINUTES: int = 120
+    # Refreshed tokens are written back in batches, at least this often
+    TOKEN_FLUSH_INTERVAL_SECONDS: int = 10
+    TOKEN_FLUSH_BATCH_SIZE: int = 100
+
+    # --- Columnar export ---
+    # Rows per DB cursor batch (and per Arrow record batch / Parquet row group)
+    EXPORT_BATCH_SIZE: int = 50000
+
+    # --- Cohort analytics ---
+    # Memory for the per-user arrays and the DB batch of one cohort request; the batch
+    # size is derived from it, and larger cohorts are refused
+    COHORT_MEMORY_BUDGET_MB: int = 64
+
+    # --- Derived metrics ---
+    # The resting heart rate of a day is a low percentile of its heart rate readings, for
+    # days with at least this many: the heart rate buckets of SYNC_BUCKET_MINUTES must give
+    # that many per day (15-minute buckets give 96, one-day buckets 1). 0 (the default)
+    # turns it off; e.g. 12 with SYNC_BUCKET_MINUTES={"heart_rate": 15} turns it on.
+    RESTING_HEART_RATE_MIN_READINGS: int = 0
+
+    # --- Response cache (per-user read endpoints) ---
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_MAX_MB: int = 64
+    # Larger responses are served with an ETag but not stored
+    RESPONSE_CACHE_MAX_ENTRY_KB: int = 1024
+
+    @model_validator(mode="after")
+    def check_resting_heart_rate_readings(self):
+        readings_per_day = 1440 // max(1, self.SYNC_BUCKET_MINUTES.get("heart_rate", 1440))
+        if self.RESTING_HEART_RATE_MIN_READINGS > readings_per_day:
+            raise ValueError(
+                f"RESTING_HEART_RATE_MIN_READINGS={self.RESTING_HEART_RATE_MIN_READINGS} needs as many heart rate readings "
+                f"per day, SYNC_BUCKET_MINUTES gives {readings_per_day}: use smaller heart rate buckets, or 0 to turn it off."
+            )
+        return self
+
     # Pydantic configuration to load variables from the .env file
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding='utf-8')
 
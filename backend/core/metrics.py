@@ -0,0 +1,59 @@
+"""
+Prometheus metrics (prometheus_client), served by GET /metrics.
+
+Counters and histograms are updated on the hot paths (sync stages, Google API calls,
+DB writes, SQL statements, HTTP requests); the stats of the caches, clients and
+scheduler are collected when the endpoint is scraped (see api/instrumentation.py).
+Each process (worker) has its own metrics, like its caches, so Prometheus should
+scrape every worker.
+"""
+from contextvars import ContextVar
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+# The app's own registry, without the default process and platform collectors
+registry = CollectorRegistry()
+
+# Seconds; from sub-millisecond SQL statements up to minute-long syncs
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def histogram(name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Histogram:
+    return Histogram(name, documentation, labelnames, buckets=DEFAULT_BUCKETS, registry=registry)
+
+def counter(name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+    return Counter(name, documentation, labelnames, registry=registry)
+
+# --- Sync ---
+SYNC_SECONDS = histogram("healthsync_sync_seconds", "Duration of user syncs.", ("result",))
+SYNC_STAGE_SECONDS = histogram(
+    "healthsync_sync_stage_seconds",
+    "Duration of the stages of a sync: token, plan, google_request, decode, parse, delete, insert, rollups, derived_metrics, commit. "
+    "Stages of concurrent windows overlap.",
+    ("stage",)
+)
+SYNC_ROWS = counter("healthsync_sync_rows_total", "Rows fetched from Google Fit and stored by syncs.", ("data_type",))
+
+# --- Google API ---
+GOOGLE_API_REQUEST_SECONDS = histogram("healthsync_google_api_request_seconds", "Duration of single requests to Google APIs (without retry waits).", ("endpoint",))
+GOOGLE_API_RESPONSES = counter("healthsync_google_api_responses_total", "Responses from Google APIs by status code ('error' for connection errors).", ("endpoint", "status"))
+
+# --- OAuth tokens ---
+CREDENTIAL_LOOKUPS = counter("healthsync_credential_lookups_total", "Credential lookups: served from the cache, refreshed first, or re-authentication needed.", ("result",))
+TOKEN_REFRESH_SECONDS = histogram("healthsync_token_refresh_seconds", "Duration of OAuth token refreshes, retries included.")
+
+# --- Database ---
+DB_WRITE_SECONDS = histogram("healthsync_db_write_seconds", "Duration of the bulk upserts into the time-series tables.", ("table",))
+DB_ROWS_WRITTEN = counter("healthsync_db_rows_written_total", "Rows upserted into the time-series tables.", ("table",))
+SQL_STATEMENT_SECONDS = histogram("healthsync_sql_statement_seconds", "Duration of SQL statements by kind (SELECT, INSERT, ...).", ("statement",))
+SQL_ERRORS = counter("healthsync_sql_errors_total", "SQL statements that raised an error, by kind.", ("statement",))
+
+# --- HTTP ---
+HTTP_REQUEST_SECONDS = histogram(
+    "healthsync_http_request_seconds",
+    "Duration of HTTP requests by route template, until the response is fully sent.",
+    ("method", "route", "status")
+)
+HTTP_REQUEST_SQL_SECONDS = histogram("healthsync_http_request_sql_seconds", "Time spent in SQL statements per HTTP request.", ("method", "route"))
+# Set by the HTTP middleware: [seconds spent in SQL statements by the current request]
+request_sql_seconds: ContextVar[list[float] | None] = ContextVar("request_sql_seconds", default=None)
+HTTP_REQUESTS_IN_PROGRESS = Gauge("healthsync_http_requests_in_progress", "HTTP requests being handled.", registry=registry)
@@ -1,20 +1,41 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import column as sa_column, delete, func, or_, select, table as sa_table, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from core import metrics
+from core.config import settings
 from . import models
-from datetime import datetime
+from datetime import datetime, timezone
 
-def get_user_by_google_id(db: Session, google_id: str):
+async def get_user(db: AsyncSession, user_id: int) -> models.User | None:
+    """ Returns the user with the given id, if it exists. """
+    return await db.get(models.User, user_id)
+
+async def get_data_version(db: AsyncSession, user_id: int) -> int | None:
+    """ Returns the version of the user's data (None if the user does not exist). """
+    return (await db.execute(select(models.User.data_version).where(models.User.id == user_id))).scalar_one_or_none()
+
+async def bump_data_version(db: AsyncSession, user_id: int | None = None):
+    """ Marks the user's data (everyone's if not given) as changed, in the transaction that changes it. Does not commit. """
+    stmt = update(models.User).values(data_version=models.User.data_version + 1)
+    if user_id is not None:
+        stmt = stmt.where(models.User.id == user_id)
+    await db.execute(stmt)
+
+async def get_user_by_google_id(db: AsyncSession, google_id: str):
     """ Searches for a user by their Google ID. """
-    return db.query(models.User).filter(models.User.google_id == google_id).first()
+    result = await db.execute(select(models.User).where(models.User.google_id == google_id))
+    return result.scalars().first()
 
-def create_or_update_user(db: Session, google_id: str, email: str, access_token: str, refresh_token: str | None):
+async def create_or_update_user(db: AsyncSession, google_id: str, email: str, access_token: str, refresh_token: str | None, token_expiry: datetime | None = None):
     """
     Creates a new user or updates tokens for an existing one.
     """
-    db_user = get_user_by_google_id(db, google_id)
-    
+    db_user = await get_user_by_google_id(db, google_id)
+
     if db_user:
         # User exists, update tokens
         db_user.access_token = access_token
+        db_user.token_expiry = token_expiry
         if refresh_token:
             # Refresh token is sent by Google only the first time,
             # so we update it only if we receive it.
@@ -26,43 +47,203 @@ def create_or_update_user(db: Session, google_id: str, email: str, access_token:
             google_id=google_id,
             email=email,
             access_token=access_token,
-            refresh_token=refresh_token
+            refresh_token=refresh_token,
+            token_expiry=token_expiry
         )
         db.add(db_user)
-        
-    db.commit()
-    db.refresh(db_user)
+
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def add_steps_data(db: Session, user_id: int, data: list[dict]): 
-    """ Adds step entries for the given user. """
-    objects_to_add = []
+# --- Time-series writers ---
+def to_utc_naive(timestamp: datetime) -> datetime:
+    """ Normalizes a timestamp to naive UTC, the form in which the DateTime columns store it. """
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def insert_for(db: AsyncSession, table):
+    """ Returns the dialect-specific INSERT construct, which supports ON CONFLICT. """
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+def on_conflict_update(insert_stmt, key_columns: list[str], value_columns: list[str]):
+    # Rows whose values did not change are left alone, so re-fetched overlap
+    # windows do not rewrite (and bloat) existing rows.
+    target = insert_stmt.table.c
+    return insert_stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={column: insert_stmt.excluded[column] for column in value_columns},
+        where=or_(*(target[column].is_distinct_from(insert_stmt.excluded[column]) for column in value_columns))
+    )
+
+async def _copy_upsert(db: AsyncSession, table, columns: list[str], key_columns: list[str], rows: list[dict]):
+    """
+    PostgreSQL fast path: COPY the rows into a temporary staging table (binary protocol,
+    no per-row statements) and merge it into the target with a single INSERT ... SELECT.
+    """
+    staging_name = f"ingest_{table.name}"
+    connection = await db.connection()
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    await connection.exec_driver_sql(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging_name} ON COMMIT DROP AS "
+        f"SELECT {column_list} FROM {table.name} WITH NO DATA"
+    )
+    await connection.exec_driver_sql(f"TRUNCATE {staging_name}")
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        staging_name, records=[tuple(row[column] for column in columns) for row in rows], columns=columns
+    )
+
+    staging = sa_table(staging_name, *(sa_column(column) for column in columns))
+    insert_stmt = postgresql.insert(table).from_select(columns, select(*staging.c))
+    value_columns = [column for column in columns if column not in key_columns]
+    await connection.execute(on_conflict_update(insert_stmt, key_columns, value_columns))
+
+async def upsert_series_data(db: AsyncSession, model, user_id: int, data: list[dict], key: str = "timestamp") -> int:
+    """
+    Idempotent, set-based ingest into a time-series table. Rows are matched on their
+    natural key (user_id, key): existing ones are updated in place, new ones inserted.
+    Uses batched multi-row INSERT ... ON CONFLICT DO UPDATE, or COPY for large PostgreSQL loads.
+    Does not commit; the caller commits once for the whole sync.
+    """
+    if not data:
+        return 0
+    # Deduplicate on the natural key (last one wins): a single ON CONFLICT statement
+    # may not touch the same row twice.
+    rows = {}
     for entry in data:
-        db_entry = models.Steps(
-            user_id=user_id,
-            timestamp=entry["timestamp"],
-            value=entry["value"]
-        )
-        objects_to_add.append(db_entry)
-        
-    db.bulk_save_objects(objects_to_add)
-
-def add_heart_rate_data(db: Session, user_id: int, data: list[dict]):
-    objects_to_add = [models.HeartRate(user_id=user_id, **entry) for entry in data]
-    db.bulk_save_objects(objects_to_add)
-    db.commit()
-
-def add_sleep_data(db: Session, user_id: int, data: list[dict]):
-    objects_to_add = [models.Sleep(user_id=user_id, **entry) for entry in data]
-    db.bulk_save_objects(objects_to_add)
-    db.commit()
-
-def add_blood_pressure_data(db: Session, user_id: int, data: list[dict]):
-    objects_to_add = [models.BloodPressure(user_id=user_id, **entry) for entry in data]
-    db.bulk_save_objects(objects_to_add)
-    db.commit()
-
-def add_oxygen_saturation_data(db: Session, user_id: int, data: list[dict]):
-    objects_to_add = [models.OxygenSaturation(user_id=user_id, **entry) for entry in data]
-    db.bulk_save_objects(objects_to_add)
-    db.commit()
\ No newline at end of file
+        row = {"user_id": user_id, **entry}
+        for field, value in row.items():
+            if isinstance(value, datetime):
+                row[field] = to_utc_naive(value)
+        rows[row[key]] = row
+    rows = list(rows.values())
+
+    table = model.__table__
+    key_columns = ["user_id", key]
+    columns = list(rows[0].keys())
+    value_columns = [column for column in columns if column not in key_columns]
+
+    with metrics.DB_WRITE_SECONDS.labels(table=table.name).time():
+        if db.get_bind().dialect.driver == "asyncpg" and len(rows) >= settings.INGEST_COPY_THRESHOLD:
+            await _copy_upsert(db, table, columns, key_columns, rows)
+        else:
+            # One cached statement executed with many parameter sets; SQLAlchemy's "insertmanyvalues"
+            # sends each batch as a single multi-row INSERT ... VALUES (...), (...) ON CONFLICT.
+            upsert_stmt = on_conflict_update(insert_for(db, table), key_columns, value_columns)
+            for start in range(0, len(rows), settings.INGEST_BATCH_SIZE):
+                await db.execute(upsert_stmt, rows[start:start + settings.INGEST_BATCH_SIZE])
+    metrics.DB_ROWS_WRITTEN.labels(table=table.name).inc(len(rows))
+    return len(rows)
+
+async def add_steps_data(db: AsyncSession, user_id: int, data: list[dict]):
+    """ Adds or updates step entries for the given user. """
+    await upsert_series_data(db, models.Steps, user_id, data)
+
+async def add_heart_rate_data(db: AsyncSession, user_id: int, data: list[dict]):
+    await upsert_series_data(db, models.HeartRate, user_id, data)
+
+async def add_sleep_data(db: AsyncSession, user_id: int, data: list[dict]):
+    # Sleep segments are identified by their start time
+    await upsert_series_data(db, models.Sleep, user_id, data, key="start_time")
+
+async def add_sleep_sessions(db: AsyncSession, user_id: int, data: list[dict]):
+    # Sessions are identified by their start time, like their segments
+    await upsert_series_data(db, models.SleepSession, user_id, data, key="start_time")
+
+async def add_blood_pressure_data(db: AsyncSession, user_id: int, data: list[dict]):
+    await upsert_series_data(db, models.BloodPressure, user_id, data)
+
+async def add_oxygen_saturation_data(db: AsyncSession, user_id: int, data: list[dict]):
+    await upsert_series_data(db, models.OxygenSaturation, user_id, data)
+
+async def delete_series_window(db: AsyncSession, model, user_id: int, start: datetime, end: datetime):
+    """ Deletes the user's rows of a series with start <= timestamp < end (bucket start times). """
+    await db.execute(delete(model).where(
+        model.user_id == user_id,
+        model.timestamp >= to_utc_naive(start),
+        model.timestamp < to_utc_naive(end)
+    ))
+
+async def get_last_sleep_session(db: AsyncSession, user_id: int, start: datetime | None = None, end: datetime | None = None) -> models.SleepSession | None:
+    """ Returns the user's most recent sleep session (ending in [start, end) if given), via the (user_id, end_time) index. """
+    query = select(models.SleepSession).where(models.SleepSession.user_id == user_id)
+    if start:
+        query = query.where(models.SleepSession.end_time >= to_utc_naive(start))
+    if end:
+        query = query.where(models.SleepSession.end_time < to_utc_naive(end))
+    result = await db.execute(query.order_by(models.SleepSession.end_time.desc()).limit(1))
+    return result.scalars().first()
+
+# --- Sync cursors ---
+async def _get_sync_cursor(db: AsyncSession, user_id: int, data_type: str) -> models.SyncCursor | None:
+    result = await db.execute(select(models.SyncCursor).where(
+        models.SyncCursor.user_id == user_id,
+        models.SyncCursor.data_type == data_type
+    ))
+    return result.scalars().first()
+
+async def get_sync_watermark(db: AsyncSession, user_id: int, data_type: str) -> datetime | None:
+    """ Returns the (UTC) end of the last synchronized window for the given data type, if any. """
+    cursor = await _get_sync_cursor(db, user_id, data_type)
+    if not cursor:
+        return None
+    return cursor.watermark.replace(tzinfo=timezone.utc)
+
+async def set_sync_watermark(db: AsyncSession, user_id: int, data_type: str, watermark: datetime):
+    """ Moves the sync cursor of the given data type forward. Committed together with the data. """
+    cursor = await _get_sync_cursor(db, user_id, data_type)
+    if cursor:
+        cursor.watermark = to_utc_naive(watermark)
+    else:
+        db.add(models.SyncCursor(user_id=user_id, data_type=data_type, watermark=to_utc_naive(watermark)))
+
+def _stale_users_query(stale_before: datetime):
+    oldest_watermark = func.min(models.SyncCursor.watermark)
+    query = select(models.User.id).outerjoin(models.SyncCursor).group_by(models.User.id).having(
+        or_(oldest_watermark.is_(None), oldest_watermark < to_utc_naive(stale_before))
+    )
+    return query, oldest_watermark
+
+async def get_stale_user_ids(db: AsyncSession, stale_before: datetime, limit: int, exclude_ids: set[int] | None = None) -> list[int]:
+    """
+    Returns ids of users whose oldest sync cursor is older than 'stale_before', most stale first.
+    Users that have never been synchronized come first.
+    """
+    query, oldest_watermark = _stale_users_query(stale_before)
+    if exclude_ids:
+        query = query.where(models.User.id.notin_(exclude_ids))
+    result = await db.execute(query.order_by(oldest_watermark.asc().nullsfirst()).limit(limit))
+    return list(result.scalars())
+
+async def count_stale_users(db: AsyncSession, stale_before: datetime) -> int:
+    """ Counts the users that are due for a sync (the scheduler backlog). """
+    query, _ = _stale_users_query(stale_before)
+    result = await db.execute(select(func.count()).select_from(query.subquery()))
+    return result.scalar_one()
+
+# --- Sync jobs ---
+def _sync_job_values(values: dict) -> dict:
+    return {field: to_utc_naive(value) if isinstance(value, datetime) else value for field, value in values.items()}
+
+async def get_sync_job(db: AsyncSession, job_id: str) -> models.SyncJob | None:
+    result = await db.execute(select(models.SyncJob).where(models.SyncJob.id == job_id))
+    return result.scalars().first()
+
+async def get_active_sync_job(db: AsyncSession, user_id: int) -> models.SyncJob | None:
+    """ Returns the user's unfinished sync job, if any. """
+    result = await db.execute(select(models.SyncJob).where(models.SyncJob.user_id == user_id, models.SyncJob.finished_at.is_(None)))
+    return result.scalars().first()
+
+def add_sync_job(db: AsyncSession, **values):
+    """ Adds a sync job; committing fails with an IntegrityError if the user has an active one. """
+    db.add(models.SyncJob(**_sync_job_values(values)))
+
+async def update_sync_job(db: AsyncSession, job_id: str, **values):
+    await db.execute(update(models.SyncJob).where(models.SyncJob.id == job_id).values(**_sync_job_values(values)))
+
+async def delete_finished_sync_jobs(db: AsyncSession, finished_before: datetime):
+    await db.execute(delete(models.SyncJob).where(models.SyncJob.finished_at < to_utc_naive(finished_before)))
@@ -1,12 +1,114 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 
+from core import metrics
 from core.config import settings
 
+# Async drivers used for each synchronous dialect of DATABASE_URL
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+}
+
+def to_async_url(database_url: str) -> str:
+    """Switches a database URL to the async driver of its dialect (asyncpg for PostgreSQL, aiosqlite for SQLite)."""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for '{backend}'. Set ASYNC_DATABASE_URL explicitly.")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+def get_async_database_url() -> str:
+    """
+    Returns ASYNC_DATABASE_URL if set, otherwise DATABASE_URL switched to its async driver
+    (asyncpg for PostgreSQL, aiosqlite for SQLite).
+    """
+    return settings.ASYNC_DATABASE_URL or to_async_url(settings.DATABASE_URL)
+
+def get_async_read_database_url() -> str | None:
+    """Returns the async URL of the read replica (ASYNC_READ_DATABASE_URL or READ_DATABASE_URL), if one is set."""
+    if settings.ASYNC_READ_DATABASE_URL:
+        return settings.ASYNC_READ_DATABASE_URL
+    return to_async_url(settings.READ_DATABASE_URL) if settings.READ_DATABASE_URL else None
+
+def engine_options(database_url: str) -> dict:
+    """Connection pool options from the settings (SQLite's pools have no size)."""
+    options = {
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+    }
+    if make_url(database_url).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        )
+    return options
+
+# Synchronous engine, used for schema management and command line tools
 engine = create_engine(
-    settings.DATABASE_URL
+    settings.DATABASE_URL,
+    **engine_options(settings.DATABASE_URL)
+)
+
+# Async engine, used by the API so database I/O does not block the event loop
+async_engine = create_async_engine(
+    get_async_database_url(),
+    **engine_options(get_async_database_url())
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+# Objects stay usable after commit, since lazy refreshes are not possible in async code
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def _read_only_options(database_url: str) -> dict:
+    # On PostgreSQL the replica's sessions are read-only, also when READ_DATABASE_URL
+    # points at the primary
+    if make_url(database_url).get_driver_name() == "asyncpg":
+        return {"connect_args": {"server_settings": {"default_transaction_read_only": "on"}}}
+    return {}
+
+# Async engine of the read replica, used by the data and export endpoints (the primary
+# if no replica is configured)
+_read_database_url = get_async_read_database_url()
+read_async_engine = create_async_engine(
+    _read_database_url,
+    **engine_options(_read_database_url),
+    **_read_only_options(_read_database_url)
+) if _read_database_url else async_engine
+
+AsyncReadSessionLocal = async_sessionmaker(read_async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
+
+# --- Instrumentation ---
+SQL_STATEMENT_KINDS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "CREATE", "TRUNCATE", "BEGIN", "COMMIT", "ROLLBACK"}
+
+def _statement_kind(statement: str) -> str:
+    words = statement.split(None, 1)
+    kind = words[0].upper() if words else ""
+    return kind if kind in SQL_STATEMENT_KINDS else "OTHER"
+
+# Registered on the Engine class, so they time the statements of every engine
+# (sync and async, as the async engine runs on a sync one)
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["statement_started"].pop()
+    metrics.SQL_STATEMENT_SECONDS.labels(statement=_statement_kind(statement)).observe(elapsed)
+    request_sql = metrics.request_sql_seconds.get()
+    if request_sql is not None:
+        request_sql[0] += elapsed
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    started = context.connection.info.get("statement_started") if context.connection is not None else None
+    if started:
+        started.pop()
+    metrics.SQL_ERRORS.labels(statement=_statement_kind(context.statement or "")).inc()
@@ -0,0 +1,208 @@
+"""
+Per-user daily derived metrics, kept up to date at ingest after the daily rollups:
+
+- resting_heart_rate: the 10th percentile of the day's heart rate readings (a low
+  that single artefacts do not move), for days with at least
+  RESTING_HEART_RATE_MIN_READINGS of them; the readings are the heart rate buckets of
+  the sync. Off by default: it needs heart rate buckets smaller than the default day
+  (settings check that they are small enough)
+- <base>_avg_7d, <base>_avg_30d: mean of the daily values of the last 7 or 30 days,
+  the day included, over the days with data (bases: see DAILY_BASES)
+- blood_pressure_systolic_trend_30d, blood_pressure_diastolic_trend_30d: slope of the
+  least-squares line through the daily means of the last 30 days, in mmHg per day
+
+Rolling values are stored for the days with a value of their base. A sync touching the
+days [first, last] of a data type recomputes the resting heart rate of those days from
+their readings, and the rolling values of the days whose windows contain them
+([first, last + 29]) from the daily values of [first - 29, last + 29]. The stored values
+of the recomputed days are deleted first, so a day left without data keeps none. A sync
+that appends today only recomputes today. The windows are computed with NumPy, as
+cumulative sums over dense daily arrays. Existing data can be derived with:
+
+    python -m db.derived_metrics backfill [--user-id ID]
+"""
+import argparse
+import asyncio
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from . import models
+from .crud import bump_data_version, insert_for, on_conflict_update
+from .database import AsyncSessionLocal
+from .rollups import day_expression, delete_days, in_days
+
+RESTING_HEART_RATE_PERCENTILE = 10
+ROLLING_WINDOWS = {"7d": 7, "30d": 30}
+TREND_WINDOW_DAYS = 30
+# Fewer daily means than this in a window give no trend
+TREND_MIN_DAYS = 3
+# Longest window: how far a changed day reaches forward, and how far back its inputs go
+MAX_WINDOW_DAYS = max(*ROLLING_WINDOWS.values(), TREND_WINDOW_DAYS)
+
+# Daily series the rolling values are computed from: (model, metric, column of the daily value)
+DAILY_BASES = {
+    "steps": (models.DailyRollup, "steps", "sum"),
+    "heart_rate": (models.DailyRollup, "heart_rate", "mean"),
+    "resting_heart_rate": (models.DerivedMetric, "resting_heart_rate", "value"),
+    "oxygen_saturation": (models.DailyRollup, "oxygen_saturation", "mean"),
+    "blood_pressure_systolic": (models.DailyRollup, "blood_pressure_systolic", "mean"),
+    "blood_pressure_diastolic": (models.DailyRollup, "blood_pressure_diastolic", "mean"),
+}
+TREND_BASES = ["blood_pressure_systolic", "blood_pressure_diastolic"]
+# Ingested data type -> the bases it changes
+INGEST_BASES = {
+    "steps": ["steps"],
+    "heart_rate": ["heart_rate", "resting_heart_rate"],
+    "oxygen_saturation": ["oxygen_saturation"],
+    "blood_pressure": ["blood_pressure_systolic", "blood_pressure_diastolic"],
+}
+
+# --- Window computations (vectorised, over dense daily arrays with NaN for days without data) ---
+def daily_percentile(days: np.ndarray, values: np.ndarray, percentile: int, min_count: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The given percentile (nearest lower rank) of the values of every day with at least
+    'min_count' values: (days, percentiles).
+    """
+    order = np.lexsort((values, days))
+    days, values = days[order], values[order]
+    unique_days, starts, counts = np.unique(days, return_index=True, return_counts=True)
+    enough = counts >= min_count
+    starts, counts = starts[enough], counts[enough]
+    return unique_days[enough], values[starts + (counts - 1) * percentile // 100]
+
+def _window_sums(values: np.ndarray, window: int) -> np.ndarray:
+    """Sums over the last 'window' entries of every position (fewer at the start), via cumulative sums."""
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    ends = np.arange(1, len(values) + 1)
+    return sums[ends] - sums[np.maximum(ends - window, 0)]
+
+def rolling_means(values: np.ndarray, window: int) -> np.ndarray:
+    """Mean of the non-NaN values of the last 'window' days of every day; NaN without any."""
+    present = ~np.isnan(values)
+    counts = _window_sums(present.astype(np.float64), window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return _window_sums(np.where(present, values, 0.0), window) / counts
+
+def rolling_slopes(values: np.ndarray, window: int, min_count: int) -> np.ndarray:
+    """Least-squares slope (per day) of the non-NaN values of the last 'window' days of every day."""
+    present = ~np.isnan(values)
+    x = np.where(present, np.arange(len(values), dtype=np.float64), 0.0)
+    y = np.where(present, values, 0.0)
+    n = _window_sums(present.astype(np.float64), window)
+    sum_x, sum_y = _window_sums(x, window), _window_sums(y, window)
+    sum_xy, sum_xx = _window_sums(x * y, window), _window_sums(x * x, window)
+    denominator = n * sum_xx - sum_x ** 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slopes = (n * sum_xy - sum_x * sum_y) / denominator
+    return np.where((n >= min_count) & (denominator > 0), slopes, np.nan)
+
+# --- Refresh ---
+async def _upsert(db: AsyncSession, rows: list[dict]):
+    if rows:
+        upsert_stmt = on_conflict_update(insert_for(db, models.DerivedMetric.__table__), ["user_id", "metric", "day"], ["value"])
+        await db.execute(upsert_stmt, rows)
+
+def rolling_metric_names(base: str) -> list[str]:
+    """The derived metrics computed from the daily values of a base."""
+    names = [f"{base}_avg_{label}" for label in ROLLING_WINDOWS]
+    if base in TREND_BASES:
+        names.append(f"{base}_trend_{TREND_WINDOW_DAYS}d")
+    return names
+
+async def refresh_resting_heart_rate(db: AsyncSession, user_id: int, first_day: date | None = None, last_day: date | None = None):
+    """Recomputes the user's resting heart rate of the given days (all days if not given). Does not commit."""
+    await delete_days(db, models.DerivedMetric, user_id, first_day, last_day, models.DerivedMetric.metric == "resting_heart_rate")
+    if not settings.RESTING_HEART_RATE_MIN_READINGS:
+        return
+    day = day_expression(models.HeartRate.timestamp, db.get_bind().dialect.name)
+    query = in_days(select(day, models.HeartRate.value).where(models.HeartRate.user_id == user_id), models.HeartRate.timestamp, first_day, last_day)
+    rows = (await db.execute(query)).all()
+    if not rows:
+        return
+    days = np.fromiter((row[0].toordinal() for row in rows), dtype=np.int64, count=len(rows))
+    values = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+    days, resting = daily_percentile(days, values, RESTING_HEART_RATE_PERCENTILE, settings.RESTING_HEART_RATE_MIN_READINGS)
+    await _upsert(db, [
+        {"user_id": user_id, "metric": "resting_heart_rate", "day": date.fromordinal(int(ordinal)), "value": float(value)}
+        for ordinal, value in zip(days, resting)
+    ])
+
+def daily_values_query(user_id: int, bases: list[str], first_day: date | None, last_day: date | None):
+    """(base, day, value) of the daily values of the given bases, in one statement."""
+    queries = []
+    for base in bases:
+        model, metric, column = DAILY_BASES[base]
+        query = select(literal(base), model.day, getattr(model, column)).where(model.user_id == user_id, model.metric == metric)
+        if first_day:
+            query = query.where(model.day >= first_day)
+        if last_day:
+            query = query.where(model.day <= last_day)
+        queries.append(query)
+    return union_all(*queries)
+
+async def refresh_rolling_metrics(db: AsyncSession, user_id: int, bases: list[str], first_day: date | None = None, last_day: date | None = None):
+    """
+    Recomputes the rolling averages (and trends) of the given bases for the days from
+    'first_day' to 'last_day' (all days if not given). Does not commit.
+    """
+    metric_names = [name for base in bases for name in rolling_metric_names(base)]
+    await delete_days(db, models.DerivedMetric, user_id, first_day, last_day, models.DerivedMetric.metric.in_(metric_names))
+    read_from = first_day - timedelta(days=MAX_WINDOW_DAYS - 1) if first_day else None
+    daily: dict[str, dict[int, float]] = {base: {} for base in bases}
+    for base, day, value in await db.execute(daily_values_query(user_id, bases, read_from, last_day)):
+        daily[base][day.toordinal()] = value
+    ordinals = [ordinal for values in daily.values() for ordinal in values]
+    if not ordinals:
+        return
+    start = min(ordinals)
+    length = max(ordinals) - start + 1
+    first_output = first_day.toordinal() - start if first_day else 0
+
+    rows = []
+    for base, values in daily.items():
+        if not values:
+            continue
+        series = np.full(length, np.nan)
+        series[np.fromiter(values, dtype=np.int64, count=len(values)) - start] = np.fromiter(values.values(), dtype=np.float64, count=len(values))
+        results = [rolling_means(series, window) for window in ROLLING_WINDOWS.values()]
+        if base in TREND_BASES:
+            results.append(rolling_slopes(series, TREND_WINDOW_DAYS, TREND_MIN_DAYS))
+        derived = dict(zip(rolling_metric_names(base), results))
+        # Only the requested days with a value of the base
+        output = ~np.isnan(series)
+        output[:max(first_output, 0)] = False
+        for metric, results in derived.items():
+            for index in np.flatnonzero(output & ~np.isnan(results)):
+                rows.append({"user_id": user_id, "metric": metric, "day": date.fromordinal(start + int(index)), "value": float(results[index])})
+    await _upsert(db, rows)
+
+async def refresh_derived_metrics_for_ingest(db: AsyncSession, user_id: int, data_key: str, first_day: date, last_day: date):
+    """Recomputes the derived metrics affected by freshly ingested points of one data type (after their rollups)."""
+    bases = INGEST_BASES.get(data_key)
+    if not bases:
+        return
+    if data_key == "heart_rate":
+        await refresh_resting_heart_rate(db, user_id, first_day, last_day)
+    await refresh_rolling_metrics(db, user_id, bases, first_day, last_day + timedelta(days=MAX_WINDOW_DAYS - 1))
+
+async def backfill(user_id: int | None = None):
+    """Derives the metrics of all existing data (of one user, or of everyone) from the rollups."""
+    async with AsyncSessionLocal() as db:
+        user_ids = [user_id] if user_id is not None else (await db.execute(select(models.User.id))).scalars().all()
+        for user_id in user_ids:
+            await refresh_resting_heart_rate(db, user_id)
+            await refresh_rolling_metrics(db, user_id, list(DAILY_BASES))
+            await bump_data_version(db, user_id)
+            await db.commit()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the derived metrics table.")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--user-id", type=int, help="only derive this user's metrics")
+    args = parser.parse_args()
+    asyncio.run(backfill(args.user_id))
+    print("Derived metrics are up to date.")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, func, Text, Float, ForeignKey
+from sqlalchemy import Column, String, Integer, DateTime, Date, func, Text, Float, ForeignKey, Index, JSON, UniqueConstraint, text
 from sqlalchemy.orm import relationship 
 from .database import Base
 
@@ -12,6 +12,9 @@ class User(Base):
     # Tokens can be long, so we use the Text type
     access_token = Column(Text, nullable=False)
     refresh_token = Column(Text, nullable=True) # Refresh token is optional
+    token_expiry = Column(DateTime, nullable=True) # UTC expiry of the access token, if known
+    # Incremented with every commit that changes the user's data (keys of the response cache)
+    data_version = Column(Integer, nullable=False, server_default="0")
     
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -19,13 +22,59 @@ class User(Base):
     steps = relationship("Steps", back_populates="user", cascade="all, delete-orphan")
     heart_rates = relationship("HeartRate", back_populates="user", cascade="all, delete-orphan")
     sleep = relationship("Sleep", back_populates="user", cascade="all, delete-orphan")
+    sleep_sessions = relationship("SleepSession", back_populates="user", cascade="all, delete-orphan")
     blood_pressures = relationship("BloodPressure", back_populates="user", cascade="all, delete-orphan")
     oxygen_saturations = relationship("OxygenSaturation", back_populates="user", cascade="all, delete-orphan")
+    sync_cursors = relationship("SyncCursor", back_populates="user", cascade="all, delete-orphan")
+    sync_jobs = relationship("SyncJob", back_populates="user", cascade="all, delete-orphan")
+    daily_rollups = relationship("DailyRollup", back_populates="user", cascade="all, delete-orphan")
+    daily_sleep_rollups = relationship("DailySleepRollup", back_populates="user", cascade="all, delete-orphan")
+    derived_metrics = relationship("DerivedMetric", back_populates="user", cascade="all, delete-orphan")
+
+class SyncCursor(Base):
+    __tablename__ = "sync_cursors"
+    # One watermark per user and data type (e.g. "steps", "sleep")
+    __table_args__ = (UniqueConstraint("user_id", "data_type", name="uq_sync_cursor_user_data_type"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    data_type = Column(String, nullable=False)
+    # End of the last successfully synchronized window (UTC)
+    watermark = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    user = relationship("User", back_populates="sync_cursors")
+
+class SyncJob(Base):
+    """ A sync job (see services/sync_jobs.py), reported by every worker, whichever one runs it. """
+    __tablename__ = "sync_jobs"
+    __table_args__ = (
+        # At most one active (unfinished) job per user
+        Index("uq_sync_jobs_user_active", "user_id", unique=True,
+              postgresql_where=text("finished_at IS NULL"), sqlite_where=text("finished_at IS NULL")),
+    )
+
+    id = Column(String, primary_key=True) # UUID (hex)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    days = Column(Integer, nullable=False)
+    exclude = Column(JSON, nullable=False)
+    status = Column(String, nullable=False) # queued, waiting, running, completed, unauthorized, failed
+    message = Column(Text, nullable=True)
+    progress = Column(JSON, nullable=False) # Per data type: status, windows, windows_done, rows
+    details = Column(JSON, nullable=True) # Per data type results, once completed
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # Last write of the worker running the job; an active job without one for long was abandoned
+    heartbeat_at = Column(DateTime, nullable=False)
+
+    user = relationship("User", back_populates="sync_jobs")
 
 class Steps(Base):
     __tablename__ = "steps"
-    # Settings for TimescaleDB (optional in SQLAlchemy, but good practice)
+    # Made a TimescaleDB hypertable on this column by db/provisioning.py (when available)
     __table_args__ = (
+        UniqueConstraint("user_id", "timestamp", name="uq_steps_user_timestamp"),
         {"timescaledb_hypertable": {
             "time_column_name": "timestamp"
         }}
@@ -33,7 +82,7 @@ class Steps(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    timestamp = Column(DateTime, nullable=False, index=True)
+    timestamp = Column(DateTime, nullable=False)
     value = Column(Integer, nullable=False)
     
     user = relationship("User", back_populates="steps")
@@ -41,6 +90,7 @@ class Steps(Base):
 class HeartRate(Base):
     __tablename__ = "heart_rate"
     __table_args__ = (
+        UniqueConstraint("user_id", "timestamp", name="uq_heart_rate_user_timestamp"),
         {"timescaledb_hypertable": {
             "time_column_name": "timestamp"
         }}
@@ -48,14 +98,18 @@ class HeartRate(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    timestamp = Column(DateTime, nullable=False, index=True)
+    timestamp = Column(DateTime, nullable=False)
     value = Column(Float, nullable=False) # Heart rate can be a floating point value (average)
 
     user = relationship("User", back_populates="heart_rates")
 
 class Sleep(Base):
     __tablename__ = "sleep"
-    __table_args__ = ({"timescaledb_hypertable": {"time_column_name": "end_time"}})
+    __table_args__ = (
+        UniqueConstraint("user_id", "start_time", name="uq_sleep_user_start_time"),
+        # Partitioned on start_time: unique constraints of a hypertable must include its time column
+        {"timescaledb_hypertable": {"time_column_name": "start_time"}}
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -66,13 +120,41 @@ class Sleep(Base):
     
     user = relationship("User", back_populates="sleep")
 
+class SleepSession(Base):
+    """ A Google Fit sleep session, with the per-phase totals of its segments computed at ingest. """
+    __tablename__ = "sleep_sessions"
+    __table_args__ = (
+        UniqueConstraint("user_id", "start_time", name="uq_sleep_session_user_start_time"),
+        Index("ix_sleep_sessions_user_end_time", "user_id", "end_time"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    session_id = Column(String, nullable=True) # Google Fit session id
+    name = Column(String, nullable=True)
+    start_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    awake_minutes = Column(Float, nullable=False, default=0)
+    sleep_minutes = Column(Float, nullable=False, default=0)
+    out_of_bed_minutes = Column(Float, nullable=False, default=0)
+    light_minutes = Column(Float, nullable=False, default=0)
+    deep_minutes = Column(Float, nullable=False, default=0)
+    rem_minutes = Column(Float, nullable=False, default=0)
+    # Light + deep + REM (the whole session if it has no segments)
+    total_sleep_minutes = Column(Float, nullable=False, default=0)
+
+    user = relationship("User", back_populates="sleep_sessions")
+
 class BloodPressure(Base):
     __tablename__ = "blood_pressure"
-    __table_args__ = ({"timescaledb_hypertable": {"time_column_name": "timestamp"}})
+    __table_args__ = (
+        UniqueConstraint("user_id", "timestamp", name="uq_blood_pressure_user_timestamp"),
+        {"timescaledb_hypertable": {"time_column_name": "timestamp"}}
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    timestamp = Column(DateTime, nullable=False, index=True)
+    timestamp = Column(DateTime, nullable=False)
     systolic = Column(Float, nullable=False)
     diastolic = Column(Float, nullable=False)
     
@@ -80,11 +162,80 @@ class BloodPressure(Base):
 
 class OxygenSaturation(Base):
     __tablename__ = "oxygen_saturation"
-    __table_args__ = ({"timescaledb_hypertable": {"time_column_name": "timestamp"}})
+    __table_args__ = (
+        UniqueConstraint("user_id", "timestamp", name="uq_oxygen_saturation_user_timestamp"),
+        {"timescaledb_hypertable": {"time_column_name": "timestamp"}}
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    timestamp = Column(DateTime, nullable=False, index=True)
+    timestamp = Column(DateTime, nullable=False)
     value = Column(Float, nullable=False)
     
-    user = relationship("User", back_populates="oxygen_saturations")
\ No newline at end of file
+    user = relationship("User", back_populates="oxygen_saturations")
+
+# --- Per-user time indexes (the data queries select one user's time range) ---
+# The (user_id, timestamp) unique keys of the other series serve their queries, in either direction
+Index("ix_sleep_user_end_time_desc", Sleep.user_id, Sleep.end_time.desc())
+
+# --- Daily rollups (maintained at ingest, see db/rollups.py) ---
+class DailyRollup(Base):
+    __tablename__ = "daily_rollups"
+    __table_args__ = (
+        UniqueConstraint("user_id", "metric", "day", name="uq_daily_rollup_user_metric_day"),
+        # Cohort queries select one metric's days across all users
+        Index("ix_daily_rollups_metric_day", "metric", "day"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # Series name, suffixed with the value for multi-value series (e.g. "blood_pressure_systolic")
+    metric = Column(String, nullable=False)
+    day = Column(Date, nullable=False) # UTC date
+    count = Column(Integer, nullable=False)
+    sum = Column(Float, nullable=False)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+    mean = Column(Float, nullable=False)
+
+    user = relationship("User", back_populates="daily_rollups")
+
+class DailySleepRollup(Base):
+    __tablename__ = "daily_sleep_rollups"
+    __table_args__ = (
+        UniqueConstraint("user_id", "day", name="uq_daily_sleep_rollup_user_day"),
+        Index("ix_daily_sleep_rollups_day", "day"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    day = Column(Date, nullable=False) # UTC date of the segments' end time
+    # Minutes per Google Fit sleep phase
+    awake_minutes = Column(Float, nullable=False, default=0)
+    sleep_minutes = Column(Float, nullable=False, default=0)
+    out_of_bed_minutes = Column(Float, nullable=False, default=0)
+    light_minutes = Column(Float, nullable=False, default=0)
+    deep_minutes = Column(Float, nullable=False, default=0)
+    rem_minutes = Column(Float, nullable=False, default=0)
+    # Light + deep + REM
+    total_sleep_minutes = Column(Float, nullable=False, default=0)
+
+    user = relationship("User", back_populates="daily_sleep_rollups")
+
+# --- Derived metrics (maintained at ingest, see db/derived_metrics.py) ---
+class DerivedMetric(Base):
+    """ One value of a derived metric (e.g. resting heart rate, 7-day average steps) per user and day. """
+    __tablename__ = "derived_metrics"
+    __table_args__ = (
+        UniqueConstraint("user_id", "metric", "day", name="uq_derived_metric_user_metric_day"),
+        # Cohort queries select one metric's days across all users
+        Index("ix_derived_metrics_metric_day", "metric", "day"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    metric = Column(String, nullable=False)
+    day = Column(Date, nullable=False) # UTC date
+    value = Column(Float, nullable=False)
+
+    user = relationship("User", back_populates="derived_metrics")
@@ -0,0 +1,161 @@
+"""
+Schema provisioning, run by the app's lifespan (DB_MIGRATE_ON_STARTUP) or with:
+
+    python -m db.provisioning
+
+- The Alembic migrations in migrations/ are applied up to the latest revision.
+  Databases created by create_all before migrations existed are adopted: they are
+  stamped as the baseline revision, and the migrations after it bring them to the
+  schema of the models (see migrations/versions/0002_ingest_schema.py).
+- With the TimescaleDB extension available on the server, the tables declaring
+  'timescaledb_hypertable' become hypertables partitioned on that column, with the
+  chunk interval, compression and retention policies of the TIMESCALEDB_* settings.
+  On plain PostgreSQL and SQLite this step is skipped.
+
+Every step is idempotent, and settings changes are applied to existing hypertables.
+"""
+from pathlib import Path
+
+from sqlalchemy import Connection, Engine, inspect, text
+from sqlalchemy.exc import DBAPIError
+
+from core.config import settings
+from . import models
+from .database import engine
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+# Serializes the migrations of workers starting at the same time (PostgreSQL)
+MIGRATION_LOCK_ID = 0x4853796E63
+# The schema create_all built before migrations existed
+BASELINE_REVISION = "0001"
+
+DEFAULT_CHUNK_INTERVAL_DAYS = 7
+
+# Policy kind -> (job procedure, config key of its interval)
+POLICIES = {
+    "compression": ("policy_compression", "compress_after"),
+    "retention": ("policy_retention", "drop_after"),
+}
+
+def hypertables() -> dict[str, str]:
+    """Tables declaring 'timescaledb_hypertable' in the models, with their time column."""
+    return {
+        table.name: table.kwargs["timescaledb_hypertable"]["time_column_name"]
+        for table in models.Base.metadata.sorted_tables
+        if "timescaledb_hypertable" in table.kwargs
+    }
+
+def migrate(bind: Engine = engine):
+    """Applies the migrations up to the latest revision."""
+    # Alembic is only needed here, so it is not imported with the app
+    from alembic import command
+    from alembic.config import Config
+
+    with bind.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        config = Config(str(ALEMBIC_INI))
+        config.attributes["connection"] = conn
+        config.attributes["configure_logging"] = False
+
+        tables = inspect(conn).get_table_names()
+        if "alembic_version" not in tables and "users" in tables:
+            print("Adopting a database created without migrations...")
+            command.stamp(config, BASELINE_REVISION)
+        command.upgrade(config, "head")
+
+def enable_timescaledb(bind: Engine) -> bool:
+    """Creates the extension if the server provides it; False if it cannot be used."""
+    with bind.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'")).first():
+            return True
+        if not conn.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb'")).first():
+            return False
+    try:
+        with bind.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS timescaledb"))
+    except DBAPIError as e:
+        # Typically not in shared_preload_libraries, or missing privileges
+        print(f"Could not create the TimescaleDB extension: {e.orig}")
+        return False
+    return True
+
+def _include_time_in_primary_key(conn: Connection, table_name: str, time_column: str):
+    """Hypertable unique constraints must contain the time column, the primary key included."""
+    primary_key = inspect(conn).get_pk_constraint(table_name)
+    if time_column in primary_key["constrained_columns"]:
+        return
+    quote = conn.dialect.identifier_preparer.quote
+    columns = ", ".join(quote(column) for column in [*primary_key["constrained_columns"], time_column])
+    conn.execute(text(
+        f"ALTER TABLE {quote(table_name)} DROP CONSTRAINT {quote(primary_key['name'])}, ADD PRIMARY KEY ({columns})"
+    ))
+
+def _set_policy(conn: Connection, kind: str, table_name: str, days: int | None):
+    """Adds, replaces or removes the table's compression or retention policy to match 'days'."""
+    proc_name, config_key = POLICIES[kind]
+    current = conn.execute(text(
+        "SELECT (config ->> :key)::interval = make_interval(days => :days) FROM timescaledb_information.jobs "
+        "WHERE proc_name = :proc_name AND hypertable_schema = current_schema() AND hypertable_name = :table"
+    ), {"key": config_key, "days": days, "proc_name": proc_name, "table": table_name}).first()
+    if current is not None:
+        if current[0]:
+            return
+        conn.execute(text(f"SELECT remove_{kind}_policy(:table)"), {"table": table_name})
+    if days is not None:
+        conn.execute(text(f"SELECT add_{kind}_policy(:table, make_interval(days => :days))"), {"table": table_name, "days": days})
+
+def provision_hypertable(conn: Connection, table_name: str, time_column: str):
+    chunk_days = settings.TIMESCALEDB_CHUNK_INTERVAL_DAYS.get(table_name, DEFAULT_CHUNK_INTERVAL_DAYS)
+    hypertable = conn.execute(text(
+        "SELECT compression_enabled FROM timescaledb_information.hypertables "
+        "WHERE hypertable_schema = current_schema() AND hypertable_name = :table"
+    ), {"table": table_name}).first()
+
+    if hypertable is None:
+        print(f"Converting {table_name} into a hypertable on {time_column} ({chunk_days}-day chunks)...")
+        _include_time_in_primary_key(conn, table_name, time_column)
+        # The per-user indexes of the models (the unique keys) replace the default (time DESC) one;
+        # existing rows are moved into chunks, which locks the table while it runs
+        conn.execute(text(
+            "SELECT create_hypertable(:table, :column, chunk_time_interval => make_interval(days => :days), "
+            "create_default_indexes => FALSE, migrate_data => TRUE)"
+        ), {"table": table_name, "column": time_column, "days": chunk_days})
+        compression_enabled = False
+    else:
+        # Applies to chunks created from now on
+        conn.execute(text("SELECT set_chunk_time_interval(:table, make_interval(days => :days))"), {"table": table_name, "days": chunk_days})
+        compression_enabled = hypertable.compression_enabled
+
+    compress_after = settings.TIMESCALEDB_COMPRESS_AFTER_DAYS
+    if compress_after is not None and not compression_enabled:
+        # One compressed segment per user, ordered like the per-user queries
+        quote = conn.dialect.identifier_preparer.quote
+        conn.execute(text(
+            f"ALTER TABLE {quote(table_name)} SET (timescaledb.compress, timescaledb.compress_segmentby = 'user_id', "
+            f"timescaledb.compress_orderby = '{quote(time_column)} DESC')"
+        ))
+    if compression_enabled or compress_after is not None:
+        _set_policy(conn, "compression", table_name, compress_after)
+    _set_policy(conn, "retention", table_name, settings.TIMESCALEDB_RETENTION_DAYS)
+
+def provision_schema(bind: Engine = engine):
+    """Migrates the schema, then creates the hypertables and their policies where TimescaleDB is available."""
+    migrate(bind)
+    if bind.dialect.name != "postgresql" or not settings.TIMESCALEDB_ENABLED:
+        return
+    if not enable_timescaledb(bind):
+        print("TimescaleDB is not available; the time-series tables stay plain tables.")
+        return
+
+    for table_name, time_column in hypertables().items():
+        try:
+            # One transaction per table, so a failure leaves the others provisioned
+            with bind.begin() as conn:
+                provision_hypertable(conn, table_name, time_column)
+        except DBAPIError as e:
+            print(f"Could not provision the hypertable {table_name}: {e.orig}")
+
+if __name__ == "__main__":
+    provision_schema()
+    print("Schema is provisioned.")
@@ -0,0 +1,136 @@
+"""
+Per-user daily rollups of every series, kept up to date at ingest.
+
+Rollups of the days touched by a sync are recomputed from the raw rows: the rollups
+of those days are deleted, then rebuilt with one INSERT ... SELECT ... GROUP BY per
+series, so they stay correct when re-fetched points change or remove existing values.
+Aggregate buckets are stamped with their start time, so a bucket counts towards the
+day it covers (sleep segments count towards the day they end). Existing data can be
+rolled up with:
+
+    python -m db.rollups backfill [--user-id ID]
+"""
+import argparse
+import asyncio
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import Date, String, case, cast, delete, func, literal, select, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .database import AsyncSessionLocal
+from .crud import bump_data_version, insert_for, on_conflict_update
+from .timeseries import SERIES, series_values, sleep_minutes
+
+# Google Fit sleep phase codes and the rollup column of each
+SLEEP_PHASE_COLUMNS = {
+    1: "awake_minutes",
+    2: "sleep_minutes",
+    3: "out_of_bed_minutes",
+    4: "light_minutes",
+    5: "deep_minutes",
+    6: "rem_minutes",
+}
+
+def rollup_metric(series_name: str, value_name: str) -> str:
+    """Name of the rollup metric for a value of a series ('heart_rate', 'blood_pressure_systolic')."""
+    return series_name if value_name == "value" else f"{series_name}_{value_name}"
+
+def day_expression(time_column, dialect_name: str):
+    """SQL expression for the (UTC) date of a DateTime column."""
+    if dialect_name == "postgresql":
+        return cast(time_column, Date)
+    return type_coerce(func.date(time_column), Date())
+
+def in_days(query, time_column, first_day: date | None, last_day: date | None):
+    if first_day:
+        query = query.where(time_column >= datetime.combine(first_day, time.min))
+    if last_day:
+        query = query.where(time_column < datetime.combine(last_day + timedelta(days=1), time.min))
+    return query
+
+async def delete_days(db: AsyncSession, model, user_id: int | None, first_day: date | None, last_day: date | None, *criteria):
+    """Deletes the rows of a per-day table for the given days and user (all if not given), before they are rebuilt."""
+    stmt = delete(model).where(*criteria)
+    if user_id is not None:
+        stmt = stmt.where(model.user_id == user_id)
+    if first_day:
+        stmt = stmt.where(model.day >= first_day)
+    if last_day:
+        stmt = stmt.where(model.day <= last_day)
+    await db.execute(stmt)
+
+async def refresh_series_rollups(db: AsyncSession, series_name: str, user_id: int | None = None, first_day: date | None = None, last_day: date | None = None):
+    """
+    Recomputes the daily rollups of a series for the given days (all days if not given)
+    and user (all users if not given). Does not commit.
+    """
+    series = SERIES[series_name]
+    model = series["model"]
+    dialect_name = db.get_bind().dialect.name
+    day = day_expression(series["time_column"], dialect_name)
+
+    for value_name, expression in series_values(series, dialect_name).items():
+        metric = rollup_metric(series_name, value_name)
+        await delete_days(db, models.DailyRollup, user_id, first_day, last_day, models.DailyRollup.metric == metric)
+        # (The WHERE clause is always present: SQLite needs one before ON CONFLICT in INSERT ... SELECT)
+        query = select(
+            model.user_id,
+            literal(metric, String),
+            day,
+            func.count(expression),
+            func.sum(expression),
+            func.min(expression),
+            func.max(expression),
+            func.avg(expression),
+        ).where(expression.is_not(None))
+        if user_id is not None:
+            query = query.where(model.user_id == user_id)
+        query = in_days(query, series["time_column"], first_day, last_day).group_by(model.user_id, day)
+
+        columns = ["user_id", "metric", "day", "count", "sum", "min", "max", "mean"]
+        insert_stmt = insert_for(db, models.DailyRollup.__table__).from_select(columns, query)
+        await db.execute(on_conflict_update(insert_stmt, ["user_id", "metric", "day"], columns[3:]))
+
+async def refresh_sleep_rollups(db: AsyncSession, user_id: int | None = None, first_day: date | None = None, last_day: date | None = None):
+    """Recomputes the per-phase daily sleep minutes for the given days and user. Does not commit."""
+    dialect_name = db.get_bind().dialect.name
+    minutes = sleep_minutes(dialect_name)
+    day = day_expression(models.Sleep.end_time, dialect_name)
+
+    phase_sums = [func.sum(case((models.Sleep.value == code, minutes), else_=0)) for code in SLEEP_PHASE_COLUMNS]
+    total_sleep = func.sum(case((models.Sleep.value.in_([4, 5, 6]), minutes), else_=0))
+    query = select(models.Sleep.user_id, day, *phase_sums, total_sleep).where(models.Sleep.value.is_not(None))
+    if user_id is not None:
+        query = query.where(models.Sleep.user_id == user_id)
+    query = in_days(query, models.Sleep.end_time, first_day, last_day).group_by(models.Sleep.user_id, day)
+
+    await delete_days(db, models.DailySleepRollup, user_id, first_day, last_day)
+    value_columns = [*SLEEP_PHASE_COLUMNS.values(), "total_sleep_minutes"]
+    insert_stmt = insert_for(db, models.DailySleepRollup.__table__).from_select(["user_id", "day", *value_columns], query)
+    await db.execute(on_conflict_update(insert_stmt, ["user_id", "day"], value_columns))
+
+async def refresh_rollups_for_ingest(db: AsyncSession, user_id: int, data_key: str, first_day: date, last_day: date):
+    """Recomputes the rollups of the days covered by freshly ingested points of one data type."""
+    if data_key == "sleep":
+        await refresh_sleep_rollups(db, user_id, first_day, last_day)
+    else:
+        await refresh_series_rollups(db, data_key, user_id, first_day, last_day)
+
+async def backfill(user_id: int | None = None):
+    """Builds the rollups of all existing data (of one user, or of everyone)."""
+    async with AsyncSessionLocal() as db:
+        for series_name in SERIES:
+            if series_name != "sleep":
+                await refresh_series_rollups(db, series_name, user_id)
+        await refresh_sleep_rollups(db, user_id)
+        await bump_data_version(db, user_id)
+        await db.commit()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the daily rollup tables.")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--user-id", type=int, help="only roll up this user's data")
+    args = parser.parse_args()
+    asyncio.run(backfill(args.user_id))
+    print("Daily rollups are up to date.")
@@ -0,0 +1,115 @@
+import re
+from datetime import datetime
+
+from sqlalchemy import DateTime, Float, Integer, cast, func, literal_column, select, text, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .crud import to_utc_naive
+
+# Sleep phases counted as sleep: 4:light, 5:deep, 6:REM
+SLEEP_PHASE_CODES = [4, 5, 6]
+
+def epoch_seconds(time_column):
+    """SQLite: seconds since the UNIX epoch of a DateTime column."""
+    return cast(func.strftime("%s", time_column), Integer)
+
+def sleep_minutes(dialect_name: str):
+    """Duration of a sleep segment in minutes, as a SQL expression."""
+    if dialect_name == "postgresql":
+        return func.extract("epoch", models.Sleep.end_time - models.Sleep.start_time) / 60
+    return (epoch_seconds(models.Sleep.end_time) - epoch_seconds(models.Sleep.start_time)) / 60.0
+
+# Every time-series model, with the column it is bucketed on and its numeric values.
+# Values are SQL expressions (or factories taking the dialect name) labelled by name.
+SERIES = {
+    "steps": {"model": models.Steps, "time_column": models.Steps.timestamp, "values": {"value": models.Steps.value}},
+    "heart_rate": {"model": models.HeartRate, "time_column": models.HeartRate.timestamp, "values": {"value": models.HeartRate.value}},
+    "oxygen_saturation": {"model": models.OxygenSaturation, "time_column": models.OxygenSaturation.timestamp, "values": {"value": models.OxygenSaturation.value}},
+    "blood_pressure": {
+        "model": models.BloodPressure,
+        "time_column": models.BloodPressure.timestamp,
+        "values": {"systolic": models.BloodPressure.systolic, "diastolic": models.BloodPressure.diastolic}
+    },
+    "sleep": {
+        "model": models.Sleep,
+        "time_column": models.Sleep.end_time,
+        "values": {"minutes": sleep_minutes},
+        "where": models.Sleep.value.in_(SLEEP_PHASE_CODES)
+    },
+}
+
+def series_values(series: dict, dialect_name: str) -> dict:
+    """Returns the value expressions of a series for the given dialect."""
+    return {
+        name: expression(dialect_name) if callable(expression) else expression
+        for name, expression in series["values"].items()
+    }
+
+_timescaledb_available: dict[str, bool] = {}
+
+async def has_timescaledb(db: AsyncSession) -> bool:
+    """Checks (once per database) whether the TimescaleDB extension is installed."""
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return False
+    key = bind.url.render_as_string()
+    if key not in _timescaledb_available:
+        result = await db.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'"))
+        _timescaledb_available[key] = result.first() is not None
+    return _timescaledb_available[key]
+
+def bucket_expression(time_column, bucket_seconds: int, dialect_name: str, timescaledb: bool = False):
+    """
+    SQL expression truncating 'time_column' to buckets of 'bucket_seconds', aligned to the UNIX epoch.
+    Uses time_bucket on TimescaleDB, date_bin on PostgreSQL and epoch arithmetic elsewhere.
+    """
+    # Literal interval (bucket_seconds is an int), so GROUP BY matches the selected expression
+    interval = literal_column(f"INTERVAL '{int(bucket_seconds)} seconds'")
+    if timescaledb:
+        return func.time_bucket(interval, time_column)
+    if dialect_name == "postgresql":
+        return func.date_bin(interval, time_column, literal_column("TIMESTAMP '1970-01-01'"))
+    bucket_start = (epoch_seconds(time_column) // bucket_seconds) * bucket_seconds
+    return type_coerce(func.datetime(bucket_start, "unixepoch"), DateTime())
+
+STATISTICS = {
+    "min": func.min,
+    "max": func.max,
+    "avg": func.avg,
+    "sum": func.sum,
+}
+
+BUCKET_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+def parse_bucket(bucket: str) -> int | None:
+    """Parses a bucket size such as '15m', '1h' or '1d' into seconds."""
+    match = re.fullmatch(r"(\d+)([mhd])", bucket)
+    if not match or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+
+async def aggregate_series(db: AsyncSession, series_name: str, user_id: int, bucket_seconds: int, statistics: list[str], start: datetime | None = None, end: datetime | None = None):
+    """
+    Downsamples a series in SQL: one row per time bucket with the row count and
+    the requested statistics of every value, labelled '<value>_<statistic>'.
+    """
+    series = SERIES[series_name]
+    dialect_name = db.get_bind().dialect.name
+    time_column = series["time_column"]
+    bucket = bucket_expression(time_column, bucket_seconds, dialect_name, await has_timescaledb(db))
+
+    columns = [bucket.label("bucket"), func.count().label("count")]
+    for value_name, expression in series_values(series, dialect_name).items():
+        for statistic in statistics:
+            columns.append(cast(STATISTICS[statistic](expression), Float).label(f"{value_name}_{statistic}"))
+
+    query = select(*columns).where(series["model"].user_id == user_id)
+    if "where" in series:
+        query = query.where(series["where"])
+    if start:
+        query = query.where(time_column >= to_utc_naive(start))
+    if end:
+        query = query.where(time_column < to_utc_naive(end))
+    query = query.group_by(bucket).order_by(bucket)
+    return (await db.execute(query)).mappings().all()
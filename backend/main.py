@@ -1,15 +1,38 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
+from core import metrics
 from core.config import settings
-from db import database, models
-from api.routers import auth, data, sync
+from db import provisioning
+from api.instrumentation import MetricsMiddleware
+from api.routers import auth, cohort, data, exports, overview, sync
+from services.credential_cache import credential_cache
+from services.google_api import google_api
+from services.sync_jobs import sync_jobs
+from services.sync_scheduler import scheduler
 
-models.Base.metadata.create_all(bind=database.engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing touches the database at import time; the schema is brought up to date here
+    if settings.DB_MIGRATE_ON_STARTUP:
+        await asyncio.to_thread(provisioning.provision_schema)
+    await credential_cache.start()
+    if settings.SYNC_SCHEDULER_ENABLED:
+        await scheduler.start()
+    yield
+    await scheduler.stop()
+    await sync_jobs.stop()
+    await credential_cache.stop()
+    await google_api.aclose()
 
 app = FastAPI(
     title=settings.API_TITLE,
-    description=settings.API_DESCRIPTION
+    description=settings.API_DESCRIPTION,
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -19,11 +42,20 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to Health Sync API!"}
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Process metrics in the Prometheus text format."""
+    return Response(generate_latest(metrics.registry), media_type=CONTENT_TYPE_LATEST)
+
 app.include_router(auth.router)
 app.include_router(data.router)
-app.include_router(sync.router)
\ No newline at end of file
+app.include_router(overview.router)
+app.include_router(sync.router)
+app.include_router(exports.router)
+app.include_router(cohort.router)
\ No newline at end of file
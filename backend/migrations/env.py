@@ -0,0 +1,54 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+from db import database, models
+
+config = context.config
+
+# Logging is configured by the alembic CLI, but not when the app runs the migrations
+if config.config_file_name is not None and config.attributes.get("configure_logging", True):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = models.Base.metadata
+
+def include_object(object, name, type_, reflected, compare_to):
+    # Chunks and internal tables of TimescaleDB are not part of the models
+    return not (type_ == "table" and reflected and compare_to is None and name.startswith("_"))
+
+def run_migrations_offline():
+    """Emits the SQL for DATABASE_URL instead of running it (alembic upgrade head --sql)."""
+    context.configure(
+        url=database.engine.url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    # The app passes its own connection; the CLI uses the sync engine of DATABASE_URL
+    connection = config.attributes.get("connection")
+    if connection is None:
+        with database.engine.connect() as connection:
+            run_migrations(connection)
+    else:
+        run_migrations(connection)
+
+def run_migrations(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite cannot alter columns or constraints in place: tables are copied instead
+        render_as_batch=connection.dialect.name == "sqlite",
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,93 @@
+"""baseline schema
+
+The schema create_all built before the ingest constraints (no unique keys, no
+token expiry, no sync state or rollup tables). Databases created without
+migrations are stamped at this revision and upgraded from it (see
+db/provisioning.py).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 04:45:57.112582
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Tables of one timestamped value per user and time
+SERIES_TABLES = {
+    'steps': sa.Integer(),
+    'heart_rate': sa.Float(),
+    'oxygen_saturation': sa.Float(),
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('google_id', sa.String(), nullable=False),
+    sa.Column('email', sa.String(), nullable=False),
+    sa.Column('access_token', sa.Text(), nullable=False),
+    sa.Column('refresh_token', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
+    op.create_index('ix_users_google_id', 'users', ['google_id'], unique=True)
+    op.create_index('ix_users_id', 'users', ['id'], unique=False)
+
+    for table_name, value_type in SERIES_TABLES.items():
+        op.create_table(table_name,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('value', value_type, nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        _create_series_indexes(table_name)
+
+    op.create_table('blood_pressure',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.Column('systolic', sa.Float(), nullable=False),
+    sa.Column('diastolic', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    _create_series_indexes('blood_pressure')
+
+    op.create_table('sleep',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('end_time', sa.DateTime(), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_sleep_id', 'sleep', ['id'], unique=False)
+    op.create_index('ix_sleep_end_time', 'sleep', ['end_time'], unique=False)
+
+
+def _create_series_indexes(table_name: str) -> None:
+    op.create_index(f'ix_{table_name}_id', table_name, ['id'], unique=False)
+    op.create_index(f'ix_{table_name}_timestamp', table_name, ['timestamp'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Indexes go with their tables
+    for table_name in ['sleep', 'blood_pressure', *SERIES_TABLES, 'users']:
+        op.drop_table(table_name)
@@ -0,0 +1,151 @@
+"""ingest constraints, sync state and rollup tables
+
+Brings a baseline database, or one created by create_all at any later point
+before migrations existed, to the schema of the models: the token expiry, the
+unique natural keys of the series tables (duplicate rows are deleted first,
+the latest one is kept, as the ingest upsert keeps the last point), the
+(user_id, end_time DESC) index of the sleep segments and the sync state and
+rollup tables. The per-user queries of the other series use their unique keys.
+Every step is skipped where the database already has it.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 04:45:57.112582
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Table -> the time column of its natural key (user_id, time)
+NATURAL_KEYS = {
+    'steps': 'timestamp',
+    'heart_rate': 'timestamp',
+    'oxygen_saturation': 'timestamp',
+    'blood_pressure': 'timestamp',
+    'sleep': 'start_time',
+}
+# Sleep segments are keyed on their start, but read by their end
+SLEEP_END_TIME_INDEX = 'ix_sleep_user_end_time_desc'
+
+
+def _inspector() -> sa.Inspector:
+    # A fresh one per check: batch operations recreate tables on SQLite
+    return sa.inspect(op.get_bind())
+
+
+def _unique_constraint(table_name: str, time_column: str) -> str:
+    return f'uq_{table_name}_user_{time_column}'
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if 'token_expiry' not in {column['name'] for column in _inspector().get_columns('users')}:
+        with op.batch_alter_table('users') as batch_op:
+            batch_op.add_column(sa.Column('token_expiry', sa.DateTime(), nullable=True))
+
+    for table_name, time_column in NATURAL_KEYS.items():
+        constraint = _unique_constraint(table_name, time_column)
+        if constraint in {unique['name'] for unique in _inspector().get_unique_constraints(table_name)}:
+            continue
+        op.execute(
+            f'DELETE FROM {table_name} WHERE id NOT IN '
+            f'(SELECT max(id) FROM {table_name} GROUP BY user_id, "{time_column}")'
+        )
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.create_unique_constraint(constraint, ['user_id', time_column])
+
+    if SLEEP_END_TIME_INDEX not in {index['name'] for index in _inspector().get_indexes('sleep')}:
+        op.create_index(SLEEP_END_TIME_INDEX, 'sleep', ['user_id', sa.text('end_time DESC')], unique=False)
+
+    tables = set(_inspector().get_table_names())
+    if 'sync_cursors' not in tables:
+        op.create_table('sync_cursors',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('data_type', sa.String(), nullable=False),
+        sa.Column('watermark', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'data_type', name='uq_sync_cursor_user_data_type')
+        )
+        op.create_index('ix_sync_cursors_id', 'sync_cursors', ['id'], unique=False)
+        op.create_index('ix_sync_cursors_user_id', 'sync_cursors', ['user_id'], unique=False)
+
+    if 'sleep_sessions' not in tables:
+        op.create_table('sleep_sessions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('session_id', sa.String(), nullable=True),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('start_time', sa.DateTime(), nullable=False),
+        sa.Column('end_time', sa.DateTime(), nullable=False),
+        sa.Column('awake_minutes', sa.Float(), nullable=False),
+        sa.Column('sleep_minutes', sa.Float(), nullable=False),
+        sa.Column('out_of_bed_minutes', sa.Float(), nullable=False),
+        sa.Column('light_minutes', sa.Float(), nullable=False),
+        sa.Column('deep_minutes', sa.Float(), nullable=False),
+        sa.Column('rem_minutes', sa.Float(), nullable=False),
+        sa.Column('total_sleep_minutes', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'start_time', name='uq_sleep_session_user_start_time')
+        )
+        op.create_index('ix_sleep_sessions_id', 'sleep_sessions', ['id'], unique=False)
+        op.create_index('ix_sleep_sessions_user_end_time', 'sleep_sessions', ['user_id', 'end_time'], unique=False)
+
+    if 'daily_rollups' not in tables:
+        op.create_table('daily_rollups',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('metric', sa.String(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('sum', sa.Float(), nullable=False),
+        sa.Column('min', sa.Float(), nullable=False),
+        sa.Column('max', sa.Float(), nullable=False),
+        sa.Column('mean', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'metric', 'day', name='uq_daily_rollup_user_metric_day')
+        )
+        op.create_index('ix_daily_rollups_id', 'daily_rollups', ['id'], unique=False)
+
+    if 'daily_sleep_rollups' not in tables:
+        op.create_table('daily_sleep_rollups',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('awake_minutes', sa.Float(), nullable=False),
+        sa.Column('sleep_minutes', sa.Float(), nullable=False),
+        sa.Column('out_of_bed_minutes', sa.Float(), nullable=False),
+        sa.Column('light_minutes', sa.Float(), nullable=False),
+        sa.Column('deep_minutes', sa.Float(), nullable=False),
+        sa.Column('rem_minutes', sa.Float(), nullable=False),
+        sa.Column('total_sleep_minutes', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'day', name='uq_daily_sleep_rollup_user_day')
+        )
+        op.create_index('ix_daily_sleep_rollups_id', 'daily_sleep_rollups', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table_name in ['daily_sleep_rollups', 'daily_rollups', 'sleep_sessions', 'sync_cursors']:
+        op.drop_table(table_name)
+    op.drop_index(SLEEP_END_TIME_INDEX, table_name='sleep')
+    for table_name, time_column in NATURAL_KEYS.items():
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_constraint(_unique_constraint(table_name, time_column), type_='unique')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('token_expiry')
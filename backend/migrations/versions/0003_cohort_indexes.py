@@ -0,0 +1,32 @@
+"""cohort indexes
+
+Indexes of the daily rollups by metric and day, for the cohort analytics queries
+that read one metric's days across all users.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 11:20:41.530917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_daily_rollups_metric_day', 'daily_rollups', ['metric', 'day'], unique=False)
+    op.create_index('ix_daily_sleep_rollups_day', 'daily_sleep_rollups', ['day'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_daily_sleep_rollups_day', table_name='daily_sleep_rollups')
+    op.drop_index('ix_daily_rollups_metric_day', table_name='daily_rollups')
@@ -0,0 +1,45 @@
+"""derived metrics
+
+The per-user, per-day derived metrics (resting heart rate, rolling averages,
+blood pressure trends) maintained at ingest by db/derived_metrics.py. Existing
+data is derived with: python -m db.derived_metrics backfill
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 14:02:18.204611
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('derived_metrics',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('metric', sa.String(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('value', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'metric', 'day', name='uq_derived_metric_user_metric_day')
+    )
+    op.create_index('ix_derived_metrics_id', 'derived_metrics', ['id'], unique=False)
+    op.create_index('ix_derived_metrics_metric_day', 'derived_metrics', ['metric', 'day'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_derived_metrics_metric_day', table_name='derived_metrics')
+    op.drop_index('ix_derived_metrics_id', table_name='derived_metrics')
+    op.drop_table('derived_metrics')
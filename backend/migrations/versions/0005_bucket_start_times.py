@@ -0,0 +1,94 @@
+"""aggregate bucket start times
+
+Aggregate points (steps, heart rate) were stamped with the end of their bucket, so
+a day's total was stored at the next midnight and rolled up into the next day. They
+are now stamped with the start of their bucket: the stored rows, all synced with
+one-day buckets, are moved back by a day, and the daily rollups of both series are
+rebuilt. The derived metrics computed from them are deleted; if rows were moved,
+derive them again with: python -m db.derived_metrics backfill
+
+The SQL is inlined, so later changes to the models do not change this revision.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 16:20:41.530318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+AGGREGATE_TABLES = ['steps', 'heart_rate']
+# Bucket size of every aggregate point synced before this revision
+BUCKET_MINUTES = 1440
+# Rows first move this far out of the way, so no row lands on a neighbour's key mid-update
+PARKING_MINUTES = 200000 * 1440
+# Derived metrics of the daily steps and heart rates (db/derived_metrics.py)
+DERIVED_PREFIXES = ['steps_', 'heart_rate_', 'resting_heart_rate']
+
+
+def _shifted(minutes: int) -> str:
+    if op.get_context().dialect.name == 'postgresql':
+        return f'"timestamp" + make_interval(mins => {minutes})'
+    # In the storage format of SQLAlchemy's SQLite DateTime (bucket times have no fraction of a second)
+    return f"strftime('%Y-%m-%d %H:%M:%S', \"timestamp\", '{minutes:+d} minutes') || '.000000'"
+
+
+def _shift(table_name: str, minutes: int) -> None:
+    """
+    Moves the table's timestamps by 'minutes', in place. Done in two updates: moved in
+    one, a row could collide on the unique (user_id, timestamp) key with a neighbour
+    that is not moved yet.
+    """
+    op.execute(f'UPDATE {table_name} SET "timestamp" = {_shifted(minutes - PARKING_MINUTES)}')
+    op.execute(f'UPDATE {table_name} SET "timestamp" = {_shifted(PARKING_MINUTES)}')
+
+
+def _rebuild_rollups(table_name: str) -> None:
+    day = 'CAST("timestamp" AS DATE)' if op.get_context().dialect.name == 'postgresql' else 'date("timestamp")'
+    op.execute(f"DELETE FROM daily_rollups WHERE metric = '{table_name}'")
+    op.execute(
+        f"INSERT INTO daily_rollups (user_id, metric, day, count, sum, min, max, mean) "
+        f"SELECT user_id, '{table_name}', {day}, count(value), sum(value), min(value), max(value), avg(value) "
+        f"FROM {table_name} GROUP BY user_id, {day}"
+    )
+
+
+def _has_rows(table_name: str) -> bool:
+    if op.get_context().as_sql:
+        # Offline (--sql): the statements are emitted whatever the data
+        return True
+    return op.get_bind().execute(sa.text(f'SELECT 1 FROM {table_name} LIMIT 1')).first() is not None
+
+
+def _move_buckets(direction: int) -> None:
+    moved = False
+    for table_name in AGGREGATE_TABLES:
+        if not _has_rows(table_name):
+            continue
+        _shift(table_name, direction * BUCKET_MINUTES)
+        _rebuild_rollups(table_name)
+        moved = True
+    if not moved:
+        return
+    prefixes = " OR ".join(f"substr(metric, 1, {len(prefix)}) = '{prefix}'" for prefix in DERIVED_PREFIXES)
+    op.execute(f'DELETE FROM derived_metrics WHERE {prefixes}')
+    print(f"Aggregate points moved {'back' if direction < 0 else 'forward'} by a day; run 'python -m db.derived_metrics backfill' to derive their metrics again.")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _move_buckets(-1)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _move_buckets(1)
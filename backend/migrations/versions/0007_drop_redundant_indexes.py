@@ -0,0 +1,46 @@
+"""drop redundant series indexes
+
+The (user_id, timestamp DESC) indexes of steps, heart rate, blood pressure and
+oxygen saturation duplicate their (user_id, timestamp) unique keys, which are
+scanned backwards for the latest points, and the timestamp-only indexes of the
+baseline serve no query. Each of them was maintained by every ingested row.
+The sleep end time indexes stay: sleep segments are keyed on their start.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 09:12:37.402518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ['steps', 'heart_rate', 'blood_pressure', 'oxygen_saturation']
+
+
+def _index_names(table_name: str) -> set[str]:
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table_name)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table_name in TABLES:
+        # The DESC indexes exist where 0002 ran before it stopped creating them
+        existing = _index_names(table_name)
+        for index_name in [f'ix_{table_name}_user_timestamp_desc', f'ix_{table_name}_timestamp']:
+            if index_name in existing:
+                op.drop_index(index_name, table_name=table_name)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table_name in TABLES:
+        op.create_index(f'ix_{table_name}_timestamp', table_name, ['timestamp'], unique=False)
@@ -0,0 +1,180 @@
+"""
+Population statistics across many users, computed with NumPy from the daily rollups
+and derived metrics.
+
+The DB folds the window into one row per user (days, sum, min, max), which is streamed
+in cursor batches into columnar arrays, so memory grows with the number of users, not
+of daily values. The per-user arrays and one batch must fit in COHORT_MEMORY_BUDGET_MB:
+the batch size is derived from it, and cohorts too large for it are refused.
+
+A user's value is the mean of their daily values in the window (e.g. their average
+daily steps); percentiles, histograms, rankings and outliers are computed across users.
+"""
+from dataclasses import dataclass
+from datetime import date
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from db import models
+
+# Metric -> (model of the daily values, its metric name (None for sleep), column of the daily value)
+COHORT_METRICS = {
+    "steps": (models.DailyRollup, "steps", "sum"),
+    "heart_rate": (models.DailyRollup, "heart_rate", "mean"),
+    "resting_heart_rate": (models.DerivedMetric, "resting_heart_rate", "value"),
+    "oxygen_saturation": (models.DailyRollup, "oxygen_saturation", "mean"),
+    "lowest_oxygen_saturation": (models.DailyRollup, "oxygen_saturation", "min"),
+    "blood_pressure_systolic": (models.DailyRollup, "blood_pressure_systolic", "mean"),
+    "blood_pressure_diastolic": (models.DailyRollup, "blood_pressure_diastolic", "mean"),
+    "sleep_minutes": (models.DailySleepRollup, None, "total_sleep_minutes"),
+}
+
+# Memory model of the budget: per user, the five result arrays (8 bytes each) and their
+# batches until they are concatenated, and per row of a batch the driver's row while it is converted
+USER_BYTES = 2 * 5 * 8
+ROW_BYTES = 400
+MIN_BATCH_ROWS = 1000
+MAX_BATCH_ROWS = 50_000
+
+class CohortTooLarge(Exception):
+    """The cohort's per-user arrays do not fit in the memory budget."""
+
+@dataclass
+class UserValues:
+    """Per-user aggregates of a metric over a window, for the users with data (sorted by id)."""
+    user_ids: np.ndarray
+    days: np.ndarray
+    sum: np.ndarray
+    min: np.ndarray
+    max: np.ndarray
+
+    @property
+    def rows(self) -> int:
+        """Daily values aggregated."""
+        return int(self.days.sum())
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self.sum / self.days
+
+def batch_size(user_count: int) -> int:
+    """Rows per DB batch that keep the per-user arrays and one batch within the memory budget."""
+    available = settings.COHORT_MEMORY_BUDGET_MB * 2**20 - user_count * USER_BYTES
+    rows = available // ROW_BYTES
+    if rows < MIN_BATCH_ROWS:
+        raise CohortTooLarge(
+            f"A cohort of {user_count} users does not fit in COHORT_MEMORY_BUDGET_MB={settings.COHORT_MEMORY_BUDGET_MB}."
+        )
+    return min(rows, MAX_BATCH_ROWS)
+
+async def cohort_size(db: AsyncSession, user_ids: list[int] | None) -> int:
+    """Users in the cohort: the given users, or everyone."""
+    if user_ids is not None:
+        return len(set(user_ids))
+    return await db.scalar(select(func.count(models.User.id)))
+
+def user_values_query(metric: str, user_ids: list[int] | None, start: date, end: date):
+    """(user_id, days, sum, min, max) of the daily values of 'metric' between 'start' and 'end', per user."""
+    model, metric_name, column = COHORT_METRICS[metric]
+    value = getattr(model, column)
+    query = (
+        select(model.user_id, func.count(value), func.sum(value), func.min(value), func.max(value))
+        .where(model.day.between(start, end))
+        .group_by(model.user_id)
+        .order_by(model.user_id)
+    )
+    if metric_name is not None:
+        query = query.where(model.metric == metric_name)
+    if user_ids is not None:
+        query = query.where(model.user_id.in_(user_ids))
+    return query
+
+async def load_user_values(db: AsyncSession, metric: str, user_ids: list[int] | None, start: date, end: date) -> UserValues:
+    """
+    The per-user aggregates of 'metric' between 'start' and 'end' (inclusive). The window is
+    folded per user by the DB, so one row per user is transferred; the rows are streamed in
+    batches and converted to columnar arrays.
+    """
+    rows_per_batch = batch_size(await cohort_size(db, user_ids))
+    query = user_values_query(metric, user_ids, start, end).execution_options(yield_per=rows_per_batch)
+    # Streamed on the session's connection: Core rows, without the ORM's per-row result processing
+    connection = await db.connection()
+    result = await connection.stream(query)
+
+    dtypes = [np.int64, np.int64, np.float64, np.float64, np.float64]
+    columns = [[] for _ in dtypes]
+    async for batch in result.partitions():
+        # One pass per column; generators avoid materialising the transposed rows
+        for index, dtype in enumerate(dtypes):
+            columns[index].append(np.fromiter((row[index] for row in batch), dtype=dtype, count=len(batch)))
+    return UserValues(*(
+        np.concatenate(batches) if batches else np.empty(0, dtype=dtype)
+        for batches, dtype in zip(columns, dtypes)
+    ))
+
+# --- Statistics (across users) ---
+def distribution(values: np.ndarray, percentiles: list[float], bins: int) -> dict:
+    """Summary statistics, the requested percentiles and a histogram of equal-width bins."""
+    if not len(values):
+        return {"users": 0, "mean": None, "std": None, "min": None, "max": None, "percentiles": {}, "histogram": {"edges": [], "counts": []}}
+    counts, edges = np.histogram(values, bins=bins)
+    return {
+        "users": int(len(values)),
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "percentiles": dict(zip((f"p{p:g}" for p in percentiles), np.percentile(values, percentiles).tolist())),
+        "histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+    }
+
+def percentile_ranks(values: np.ndarray) -> np.ndarray:
+    """Percentage of the users whose value is lower or equal, for every user."""
+    ordered = np.sort(values)
+    return np.searchsorted(ordered, values, side="right") / len(values) * 100
+
+def ranking(user_values: UserValues, limit: int, descending: bool = True) -> list[dict]:
+    """The 'limit' users with the highest (or lowest) values, with their rank and percentile rank."""
+    values = user_values.mean
+    limit = min(limit, len(values))
+    if not limit:
+        return []
+    keys = -values if descending else values
+    # Partial sort: only the top 'limit' are ordered
+    top = np.argpartition(keys, limit - 1)[:limit]
+    top = top[np.argsort(keys[top], kind="stable")]
+    ranks = percentile_ranks(values)[top]
+    return [
+        {"rank": rank, "user_id": int(user_id), "value": float(value), "days": int(days), "percentile_rank": float(percentile_rank)}
+        for rank, (user_id, value, days, percentile_rank) in enumerate(
+            zip(user_values.user_ids[top], values[top], user_values.days[top], ranks), start=1
+        )
+    ]
+
+def outliers(user_values: UserValues, k: float, limit: int) -> dict:
+    """
+    Users outside Tukey's fences [Q1 - k*IQR, Q3 + k*IQR] of the cohort, farthest first,
+    with their z-score.
+    """
+    values = user_values.mean
+    if not len(values):
+        return {"users": 0, "lower_fence": None, "upper_fence": None, "outliers": []}
+    q1, q3 = np.percentile(values, [25, 75])
+    lower, upper = q1 - k * (q3 - q1), q3 + k * (q3 - q1)
+    std = values.std()
+    z_scores = (values - values.mean()) / std if std else np.zeros_like(values)
+    distance = np.maximum(lower - values, values - upper)
+    selected = np.flatnonzero(distance > 0)
+    selected = selected[np.argsort(-distance[selected], kind="stable")][:limit]
+    return {
+        "users": int(len(values)),
+        "lower_fence": float(lower),
+        "upper_fence": float(upper),
+        "outliers": [
+            {"user_id": int(user_id), "value": float(value), "z_score": float(z_score), "direction": "low" if value < lower else "high"}
+            for user_id, value, z_score in zip(user_values.user_ids[selected], values[selected], z_scores[selected])
+        ],
+    }
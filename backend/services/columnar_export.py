@@ -0,0 +1,180 @@
+"""
+Columnar export of the time-series tables for analytics consumers: Arrow IPC stream,
+Parquet, or CSV (no extra dependency). Rows are read from the DB in cursor batches,
+and each batch is transposed straight into column buffers and written out; no ORM
+or Pydantic objects are built. Arrow and Parquet need the optional 'pyarrow' package.
+"""
+import csv
+import functools
+import io
+from datetime import datetime as dt
+from typing import AsyncIterator
+
+from sqlalchemy import Date, DateTime, Float, Integer, select
+
+from core.config import settings
+from db import crud, models
+from db.database import AsyncReadSessionLocal
+
+@functools.cache
+def pyarrow():
+    """Imports pyarrow on first use, as it is slow to import; None if it is not installed."""
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return pyarrow
+
+# Exportable tables, with the column their time range applies to
+EXPORT_TABLES = {
+    "steps": (models.Steps, "timestamp"),
+    "heart_rate": (models.HeartRate, "timestamp"),
+    "oxygen_saturation": (models.OxygenSaturation, "timestamp"),
+    "blood_pressure": (models.BloodPressure, "timestamp"),
+    "sleep": (models.Sleep, "start_time"),
+    "sleep_sessions": (models.SleepSession, "start_time"),
+}
+
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "csv": "text/csv",
+}
+
+def export_columns(series: str) -> list:
+    model, _ = EXPORT_TABLES[series]
+    return [column for column in model.__table__.columns if column.name != "id"]
+
+def _arrow_type(column):
+    pa = pyarrow()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    if isinstance(column.type, Date):
+        return pa.date32()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    return pa.string()
+
+def export_schema(series_names: list[str]):
+    """
+    One schema for all exported tables: a 'series' column, then the union of their
+    columns (missing ones are null). A column that is an integer in one table and a
+    float in another is exported as float.
+    """
+    pa = pyarrow()
+    fields: dict[str, object] = {}
+    for series in series_names:
+        for column in export_columns(series):
+            arrow_type = _arrow_type(column)
+            previous = fields.get(column.name)
+            if previous is not None and previous != arrow_type:
+                numeric = {pa.int64(), pa.float64()}
+                arrow_type = pa.float64() if {previous, arrow_type} <= numeric else pa.string()
+            fields[column.name] = arrow_type
+    return pa.schema([("series", pa.dictionary(pa.int32(), pa.string())), *fields.items()])
+
+def series_export_query(series: str, user_ids: list[int] | None, start: dt | None, end: dt | None):
+    model, time_name = EXPORT_TABLES[series]
+    time_column = getattr(model, time_name)
+    query = select(*export_columns(series))
+    if user_ids is not None:
+        query = query.where(model.user_id.in_(user_ids))
+    if start:
+        query = query.where(time_column >= crud.to_utc_naive(start))
+    if end:
+        query = query.where(time_column < crud.to_utc_naive(end))
+    # (user_id, time) is the natural key, so this follows its unique index
+    return query.order_by(model.user_id, time_column)
+
+async def iter_column_batches(series_names: list[str], user_ids: list[int] | None, start: dt | None, end: dt | None) -> AsyncIterator[tuple[str, list[str], list[tuple]]]:
+    """
+    Yields (series, column names, columns) for every cursor batch of the export, the
+    columns being the batch's rows transposed. Uses its own session, since the
+    response outlives the request.
+    """
+    async with AsyncReadSessionLocal() as db:
+        for series in series_names:
+            names = [column.name for column in export_columns(series)]
+            query = series_export_query(series, user_ids, start, end)
+            result = await db.stream(query.execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+            async for rows in result.partitions():
+                yield series, names, list(zip(*rows))
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file whose content is taken out chunk by chunk; tell() keeps counting."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def _record_batch(schema, series_names: list[str], series: str, names: list[str], columns: list[tuple]):
+    pa = pyarrow()
+    length = len(columns[0])
+    arrays = {name: column for name, column in zip(names, columns)}
+    series_index = pa.compute.fill_null(pa.nulls(length, pa.int32()), series_names.index(series))
+    fields = [pa.DictionaryArray.from_arrays(series_index, pa.array(series_names))]
+    for field in list(schema)[1:]:
+        if field.name in arrays:
+            fields.append(pa.array(arrays[field.name], type=field.type, from_pandas=False))
+        else:
+            fields.append(pa.nulls(length, field.type))
+    return pa.RecordBatch.from_arrays(fields, schema=schema)
+
+async def stream_columnar_export(series_names: list[str], fmt: str, user_ids: list[int] | None = None, start: dt | None = None, end: dt | None = None) -> AsyncIterator[bytes]:
+    """Streams the export in the given format ('arrow', 'parquet' or 'csv'), one DB batch at a time."""
+    batches = iter_column_batches(series_names, user_ids, start, end)
+
+    if fmt == "csv":
+        header = ["series", *dict.fromkeys(column.name for series in series_names for column in export_columns(series))]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        async for series, names, columns in batches:
+            # Columns of other tables are left empty
+            positions = [names.index(name) if name in names else None for name in header[1:]]
+            full_columns = [[series] * len(columns[0]), *(columns[i] if i is not None else [None] * len(columns[0]) for i in positions)]
+            writer.writerows(zip(*full_columns))
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate(0)
+        if buffer.tell():
+            # Nothing was exported: just the header
+            yield buffer.getvalue().encode()
+        return
+
+    pa = pyarrow()
+    schema = export_schema(series_names)
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        writer = pa.parquet.ParquetWriter(sink, schema)
+        write = lambda batch: writer.write_batch(batch)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+    try:
+        async for series, names, columns in batches:
+            write(_record_batch(schema, series_names, series, names, columns))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
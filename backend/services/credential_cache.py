@@ -0,0 +1,221 @@
+"""
+In-process cache of the users' Google OAuth tokens.
+
+Tokens are refreshed over async HTTP shortly before they expire: a background loop
+refreshes the ones about to expire, and a token found expired (or with an unknown
+expiry) on use is refreshed on the spot. Concurrent refreshes of the same user share
+one request to Google. Refreshed tokens are written back to the users table in
+batches, with one executemany UPDATE.
+"""
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime as dt, timedelta, timezone
+from typing import TYPE_CHECKING
+
+from sqlalchemy import bindparam, update
+
+from core import metrics
+from core.config import settings
+from db import models
+from db.database import AsyncSessionLocal
+from services.google_api import google_api
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+@dataclass
+class CachedToken:
+    access_token: str
+    refresh_token: str | None
+    expiry: dt | None  # naive UTC, as google-auth uses it; None if unknown
+
+class TokenRefreshError(Exception):
+    """Google refused to refresh the token (e.g. access was revoked)."""
+
+class CredentialCache:
+
+    def __init__(self, margin_seconds: int, proactive_seconds: int, keep_warm_minutes: int, flush_interval_seconds: int, flush_batch_size: int):
+        # Tokens expiring within 'margin' are not used any more
+        self.margin = timedelta(seconds=margin_seconds)
+        # Tokens expiring within 'proactive' are refreshed in the background
+        self.proactive = timedelta(seconds=proactive_seconds)
+        # ... as long as the user's credentials were used this recently
+        self.keep_warm = timedelta(minutes=keep_warm_minutes)
+        self.flush_interval_seconds = flush_interval_seconds
+        self.flush_batch_size = flush_batch_size
+
+        self._tokens: dict[int, CachedToken] = {}
+        self._last_used: dict[int, dt] = {}
+        self._refreshing: dict[int, asyncio.Task] = {}
+        self._dirty: dict[int, CachedToken] = {}
+        self._loop_task: asyncio.Task | None = None
+        self._counters = {"refreshed": 0, "failed": 0, "flushed": 0}
+
+    # --- Lifecycle ---
+    async def start(self):
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._maintenance_loop())
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        await asyncio.gather(*self._refreshing.values(), return_exceptions=True)
+        await self.flush()
+
+    # --- Lookup ---
+    def store(self, user_id: int, access_token: str, refresh_token: str | None, expiry: dt | None):
+        """Caches tokens that were just obtained and saved elsewhere (e.g. by the OAuth callback)."""
+        self._tokens[user_id] = CachedToken(access_token, refresh_token, expiry)
+        self._dirty.pop(user_id, None)
+
+    async def get_credentials(self, user: models.User) -> "Credentials | None":
+        """
+        Returns valid credentials for the user, refreshing the token first if it is
+        (about to be) expired. Returns None if the user needs to re-authenticate.
+        """
+        token = self._tokens.get(user.id)
+        if token is None:
+            token = CachedToken(user.access_token, user.refresh_token, user.token_expiry)
+            self._tokens[user.id] = token
+
+        now = dt.now(timezone.utc).replace(tzinfo=None)
+        self._last_used[user.id] = now
+        if token.expiry is None or token.expiry - self.margin <= now:
+            if not token.refresh_token:
+                print(f"Cannot refresh token for user {user.id}. Re-authentication needed.")
+                metrics.CREDENTIAL_LOOKUPS.labels(result="reauthenticate").inc()
+                return None
+            try:
+                token = await self.refresh(user.id)
+            except Exception as e:
+                print(f"Error refreshing token for user {user.id}: {e}")
+                metrics.CREDENTIAL_LOOKUPS.labels(result="reauthenticate").inc()
+                return None
+            metrics.CREDENTIAL_LOOKUPS.labels(result="refreshed").inc()
+        else:
+            if token.expiry - self.proactive <= now and token.refresh_token:
+                self._refresh_in_background(user.id)
+            metrics.CREDENTIAL_LOOKUPS.labels(result="cached").inc()
+
+        # google-auth is imported on first use, it is slow to import
+        from google.oauth2.credentials import Credentials
+        return Credentials(
+            token=token.access_token,
+            refresh_token=token.refresh_token,
+            expiry=token.expiry,
+            token_uri=settings.GOOGLE_TOKEN_URI,
+            client_id=settings.GOOGLE_CLIENT_ID,
+            client_secret=settings.GOOGLE_CLIENT_SECRET,
+            scopes=settings.SCOPES
+        )
+
+    # --- Refresh ---
+    async def refresh(self, user_id: int) -> CachedToken:
+        """Refreshes the user's token; concurrent callers share the same request."""
+        task = self._refreshing.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._refresh(user_id))
+            self._refreshing[user_id] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(user_id, None))
+        # shield: a cancelled caller must not cancel the refresh other callers wait for
+        return await asyncio.shield(task)
+
+    def _refresh_in_background(self, user_id: int):
+        if user_id not in self._refreshing:
+            task = asyncio.create_task(self.refresh(user_id))
+            # Failures are logged; the next use retries the refresh
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _refresh(self, user_id: int) -> CachedToken:
+        token = self._tokens[user_id]
+        with metrics.TOKEN_REFRESH_SECONDS.time():
+            response = await google_api.post(settings.GOOGLE_TOKEN_URI, data={
+                "grant_type": "refresh_token",
+                "refresh_token": token.refresh_token,
+                "client_id": settings.GOOGLE_CLIENT_ID,
+                "client_secret": settings.GOOGLE_CLIENT_SECRET,
+            })
+        if response.status_code != 200:
+            self._counters["failed"] += 1
+            if response.status_code in (400, 401):
+                # Revoked or invalid refresh token: forget it, so the DB row is read again
+                # once the user has re-authenticated
+                self._tokens.pop(user_id, None)
+            print(f"Token refresh for user {user_id} failed with status {response.status_code}.")
+            raise TokenRefreshError(response.text)
+
+        payload = response.json()
+        refreshed = CachedToken(
+            access_token=payload["access_token"],
+            # Google usually keeps the refresh token, but may send a new one
+            refresh_token=payload.get("refresh_token", token.refresh_token),
+            expiry=dt.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=payload.get("expires_in", 3600))
+        )
+        self._tokens[user_id] = refreshed
+        self._dirty[user_id] = refreshed
+        self._counters["refreshed"] += 1
+        print(f"Successfully refreshed token for user {user_id}")
+
+        # A rotated refresh token is written right away; it cannot be recovered if lost
+        if refreshed.refresh_token != token.refresh_token or len(self._dirty) >= self.flush_batch_size or self._loop_task is None:
+            await self.flush()
+        return refreshed
+
+    # --- Write-back ---
+    async def flush(self):
+        """Writes all refreshed tokens to the users table in one batch."""
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        users = models.User.__table__
+        statement = update(users).where(users.c.id == bindparam("b_id")).values(
+            access_token=bindparam("b_access_token"),
+            refresh_token=bindparam("b_refresh_token"),
+            token_expiry=bindparam("b_token_expiry"),
+        )
+        rows = [
+            {"b_id": user_id, "b_access_token": token.access_token, "b_refresh_token": token.refresh_token, "b_token_expiry": token.expiry}
+            for user_id, token in batch.items()
+        ]
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(statement, rows)
+                await db.commit()
+        except Exception as e:
+            print(f"Error writing back refreshed tokens: {e}")
+            # Keep them for the next flush, unless a newer token arrived meanwhile
+            self._dirty = {**batch, **self._dirty}
+            return
+        self._counters["flushed"] += len(rows)
+
+    async def _maintenance_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            try:
+                now = dt.now(timezone.utc).replace(tzinfo=None)
+                for user_id, token in list(self._tokens.items()):
+                    if self._last_used.get(user_id, now) < now - self.keep_warm:
+                        continue
+                    if token.refresh_token and token.expiry is not None and token.expiry - self.proactive <= now:
+                        self._refresh_in_background(user_id)
+                await self.flush()
+            except Exception as e:
+                print(f"Credential cache maintenance failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "cached_users": len(self._tokens),
+            "refreshing": len(self._refreshing),
+            "pending_writes": len(self._dirty),
+            **self._counters,
+        }
+
+credential_cache = CredentialCache(
+    margin_seconds=settings.TOKEN_EXPIRY_MARGIN_SECONDS,
+    proactive_seconds=settings.TOKEN_PROACTIVE_REFRESH_SECONDS,
+    keep_warm_minutes=settings.TOKEN_KEEP_WARM_MINUTES,
+    flush_interval_seconds=settings.TOKEN_FLUSH_INTERVAL_SECONDS,
+    flush_batch_size=settings.TOKEN_FLUSH_BATCH_SIZE
+)
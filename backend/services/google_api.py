@@ -0,0 +1,158 @@
+"""
+Shared, long-lived client for all requests to Google APIs (OAuth, userinfo, Fitness).
+
+- one pooled httpx client with keep-alive, over HTTP/2 when the 'h2' package is installed
+- a token bucket shared by all syncs keeps the process under the project's quota;
+  a 429 pauses it for everyone for the Retry-After time
+- 429, 5xx and connection errors are retried with jittered exponential backoff,
+  honouring Retry-After
+"""
+import asyncio
+import importlib.util
+import random
+import time
+from datetime import datetime as dt, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from core import metrics
+from core.config import settings
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Allows 'rate' requests per second on average, with bursts of up to 'burst'."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue on the lock, so they are served in order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stops handing out tokens for the given time (after a 429)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait according to a Retry-After header (delay in seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - dt.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def endpoint_label(url: str) -> str:
+    """Low-cardinality name of a Google API endpoint, for metrics."""
+    url = str(url)
+    for marker, label in (("dataset:aggregate", "fitness_aggregate"), ("/datasets/", "fitness_datasets"), ("/sessions", "fitness_sessions"), ("token", "oauth_token"), ("userinfo", "userinfo")):
+        if marker in url:
+            return label
+    return "other"
+
+class GoogleApiClient:
+    """
+    Wraps one httpx.AsyncClient per event loop (the app has one; CLIs and benchmarks may
+    run several). get/post have the signatures of httpx's, with rate limiting and retries.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport | None = None):
+        self.transport = transport
+        self.limiter: TokenBucket | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._counters = {"requests": 0, "retries": 0, "throttled": 0}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            http2 = settings.GOOGLE_API_HTTP2 and importlib.util.find_spec("h2") is not None
+            self._client = httpx.AsyncClient(
+                http2=http2,
+                transport=self.transport,
+                limits=httpx.Limits(
+                    max_connections=settings.GOOGLE_API_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.GOOGLE_API_MAX_CONNECTIONS
+                ),
+                timeout=settings.GOOGLE_API_TIMEOUT_SECONDS
+            )
+            self._loop = loop
+            self.limiter = TokenBucket(settings.GOOGLE_API_RATE_PER_SECOND, settings.GOOGLE_API_BURST)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": a random delay up to the exponential backoff
+        ceiling = min(settings.GOOGLE_API_BACKOFF_MAX_SECONDS, settings.GOOGLE_API_BACKOFF_BASE_SECONDS * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Sends a request, retrying 429/5xx responses and connection errors up to
+        GOOGLE_API_MAX_RETRIES times. Returns the last response (or raises the last error).
+        """
+        client = self._get_client()
+        endpoint = endpoint_label(url)
+        for attempt in range(settings.GOOGLE_API_MAX_RETRIES + 1):
+            await self.limiter.acquire()
+            self._counters["requests"] += 1
+            try:
+                with metrics.GOOGLE_API_REQUEST_SECONDS.labels(endpoint=endpoint).time():
+                    response = await client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                metrics.GOOGLE_API_RESPONSES.labels(endpoint=endpoint, status="error").inc()
+                if attempt == settings.GOOGLE_API_MAX_RETRIES:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                metrics.GOOGLE_API_RESPONSES.labels(endpoint=endpoint, status=response.status_code).inc()
+                if response.status_code not in RETRY_STATUS_CODES or attempt == settings.GOOGLE_API_MAX_RETRIES:
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None and retry_after > settings.GOOGLE_API_BACKOFF_MAX_SECONDS:
+                    # Not worth waiting for within a sync; the next sync picks it up
+                    return response
+                if response.status_code == 429:
+                    self._counters["throttled"] += 1
+                    # The quota is shared: everyone waits, not just this request
+                    self.limiter.pause(retry_after if retry_after is not None else self._backoff(attempt))
+                delay = max(retry_after or 0.0, self._backoff(attempt))
+            self._counters["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        return dict(self._counters)
+
+google_api = GoogleApiClient()
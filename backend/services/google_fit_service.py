@@ -1,76 +1,62 @@
-from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from sqlalchemy.orm import Session
+from typing import TYPE_CHECKING
+
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from core.config import settings
 from db import models
+from services.credential_cache import credential_cache
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import Flow
+
+def build_flow(**kwargs) -> "Flow":
+    """
+    A new OAuth flow for one request: a flow holds a PKCE code verifier and, after the
+    exchange, a user's tokens, so it is never shared. google-auth-oauthlib is imported
+    here, as it is slow to import and only the login and callback need it.
+    """
+    from google_auth_oauthlib.flow import Flow
 
-flow = Flow.from_client_config(
-    client_config={
-        "web": {
-            "client_id": settings.GOOGLE_CLIENT_ID,
-            "client_secret": settings.GOOGLE_CLIENT_SECRET,
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": settings.GOOGLE_TOKEN_URI,
-            "redirect_uris": [settings.REDIRECT_URI],
-        }
-    },
-    scopes=settings.SCOPES,
-    redirect_uri=settings.REDIRECT_URI
-)
+    return Flow.from_client_config(
+        client_config={
+            "web": {
+                "client_id": settings.GOOGLE_CLIENT_ID,
+                "client_secret": settings.GOOGLE_CLIENT_SECRET,
+                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+                "token_uri": settings.GOOGLE_TOKEN_URI,
+                "redirect_uris": [settings.REDIRECT_URI],
+            }
+        },
+        scopes=settings.SCOPES,
+        redirect_uri=settings.REDIRECT_URI,
+        **kwargs
+    )
 
-def get_google_auth_url():
-    """Returns the Google authorization URL."""
-    return flow.authorization_url(
+def get_google_auth_url() -> tuple[str, str, str]:
+    """Returns the Google authorization URL, its state and the PKCE code verifier of the token exchange."""
+    flow = build_flow()
+    authorization_url, state = flow.authorization_url(
         access_type="offline",
         include_granted_scopes="true",
         prompt="consent"
     )
+    return authorization_url, state, flow.code_verifier
 
-def fetch_google_token(authorization_response: str) -> Credentials:
-    """Exchanges the authorization code for tokens."""
+def fetch_google_token(authorization_response: str, state: str, code_verifier: str) -> "Credentials":
+    """
+    Exchanges the authorization code for tokens, with the state and code verifier of the
+    login that started the flow (a response with another state is rejected).
+    """
+    flow = build_flow(state=state, code_verifier=code_verifier)
     flow.fetch_token(authorization_response=authorization_response)
     return flow.credentials
 
-def get_and_refresh_credentials(db: Session, user: models.User) -> Credentials | None:
+async def get_and_refresh_credentials(db: AsyncSession, user: models.User) -> "Credentials | None":
     """
-    Reconstructs the Credentials object from the database and refreshes the token if necessary.
-    Saves the new token back to the database.
+    Returns valid credentials for the user from the credential cache, refreshing the
+    token over async HTTP if it is (about to be) expired. Refreshed tokens are written
+    back to the database in batches by the cache, not on this session.
+    Returns None if the user needs to re-authenticate.
     """
-    credentials = Credentials(
-        token=user.access_token,
-        refresh_token=user.refresh_token,
-        token_uri=settings.GOOGLE_TOKEN_URI,
-        client_id=settings.GOOGLE_CLIENT_ID,
-        client_secret=settings.GOOGLE_CLIENT_SECRET,
-        scopes=settings.SCOPES
-    )
-
-    # Check if the token is valid. If not or expired, refresh it.
-    if not credentials.valid:
-        if credentials.expired and credentials.refresh_token:
-            print(f"Token for user {user.id} has expired. Refreshing...")
-            try:
-                # This is the moment when a request is sent to Google for a new token
-                credentials.refresh(Request())
-            except Exception as e:
-                print(f"Error refreshing token for user {user.id}: {e}")
-                # In production, you might mark the user as requiring re-authorization here.
-                return None
-            
-            # After refreshing, save the NEW access_token to the database.
-            # The refresh token usually stays the same, but update it just in case.
-            user.access_token = credentials.token
-            user.refresh_token = credentials.refresh_token
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-            print(f"Successfully refreshed token for user {user.id}")
-        else:
-            # No refresh token or token is not expired but invalid.
-            # This indicates a problem, e.g., user revoked access in Google.
-            print(f"Cannot refresh token for user {user.id}. Re-authentication needed.")
-            return None
-
-    return credentials
+    return await credential_cache.get_credentials(user)
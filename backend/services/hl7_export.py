@@ -0,0 +1,170 @@
+"""
+HL7 v2 ORU^R01 export of a user's recent observations: as JSON segments, or encoded
+as pipe-delimited ER7 text. Every query is bounded in SQL (latest N rows, optional
+date range), so an export costs a few index lookups whatever the size of the history.
+"""
+import json
+import uuid
+from datetime import datetime as dt, time, timezone
+from typing import AsyncIterator
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import crud, models
+from db.database import AsyncReadSessionLocal
+
+# Number of observations of each kind in a message
+STEPS_DAYS = 7
+HEART_RATE_READINGS = 10
+# Users loaded per query by the bulk export
+BULK_USER_BATCH_SIZE = 500
+
+# --- HL7/JSON segments ---
+def create_msh_segment():
+    return {"segment": "MSH", "sending_application": "HealthSyncApp", "sending_facility": "HealthSyncFacility", "datetime_of_message": dt.now(timezone.utc).strftime('%Y%m%d%H%M%S'), "message_type": "ORU^R01", "message_control_id": str(uuid.uuid4()), "processing_id": "P", "version_id": "2.3"}
+
+def create_pid_segment(user: models.User):
+    return {"segment": "PID", "patient_id": user.id, "external_patient_id": user.google_id, "patient_name": "User^Anonymized", "patient_email": user.email}
+
+def create_obr_segment():
+    # ORU^R01 requires an observation request before the observations
+    return {"segment": "OBR", "set_id": 1, "universal_service_id": "HEALTHSYNC^Health data export", "observation_datetime": dt.now(timezone.utc).strftime('%Y%m%d%H%M%S')}
+
+def create_obx_segment(seq_id: int, obs_id: str, obs_text: str, value: any, unit: str, timestamp: dt):
+    return {"segment": "OBX", "set_id": seq_id, "value_type": "NM", "observation_identifier": f"{obs_id}^{obs_text}", "observation_value": str(value), "units": unit, "observation_result_status": "F", "observation_datetime": timestamp.strftime('%Y%m%d%H%M%S')}
+
+def _in_range(query, column, start: dt | None, end: dt | None):
+    if start:
+        query = query.where(column >= crud.to_utc_naive(start))
+    if end:
+        query = query.where(column < crud.to_utc_naive(end))
+    return query
+
+async def build_hl7_message(db: AsyncSession, user: models.User, start: dt | None = None, end: dt | None = None) -> list[dict]:
+    """
+    Builds the segments of the user's ORU^R01 message: the latest daily step totals, heart
+    rate readings and sleep session, optionally limited to observations in [start, end).
+    """
+    hl7_message = [create_msh_segment(), create_pid_segment(user), create_obr_segment()]
+    obx_sequence_id = 1
+
+    # Steps: daily totals come from the rollups, whatever the bucket size of the stored steps
+    steps_query = select(models.DailyRollup.day, models.DailyRollup.sum).where(
+        models.DailyRollup.user_id == user.id, models.DailyRollup.metric == "steps"
+    )
+    # Days of [start, end) by UTC date, end excluded: consecutive windows export every day once
+    if start:
+        steps_query = steps_query.where(models.DailyRollup.day >= crud.to_utc_naive(start).date())
+    if end:
+        steps_query = steps_query.where(models.DailyRollup.day < crud.to_utc_naive(end).date())
+    daily_steps = await db.execute(steps_query.order_by(models.DailyRollup.day.desc()).limit(STEPS_DAYS))
+    for day, total in reversed(daily_steps.all()):
+        hl7_message.append(create_obx_segment(obx_sequence_id, "88942-2", "Number of steps in 24 hour Measured", int(total), "steps", dt.combine(day, time.min)))
+        obx_sequence_id += 1
+
+    # Heart rate: the latest readings, read backwards along the (user_id, timestamp) index
+    heart_rate_query = _in_range(
+        select(models.HeartRate.timestamp, models.HeartRate.value).where(models.HeartRate.user_id == user.id),
+        models.HeartRate.timestamp, start, end
+    )
+    heart_rates = await db.execute(heart_rate_query.order_by(models.HeartRate.timestamp.desc()).limit(HEART_RATE_READINGS))
+    for timestamp, value in reversed(heart_rates.all()):
+        hl7_message.append(create_obx_segment(obx_sequence_id, "8867-4", "Heart rate", value, "bpm", timestamp))
+        obx_sequence_id += 1
+
+    # Sleep
+    sleep_session = await crud.get_last_sleep_session(db, user.id, start=start, end=end)
+    if sleep_session and sleep_session.total_sleep_minutes > 0:
+        hl7_message.append(create_obx_segment(obx_sequence_id, "2482-2", "Sleep duration", int(round(sleep_session.total_sleep_minutes, 6)), "min", sleep_session.end_time))
+        obx_sequence_id += 1
+
+    return hl7_message
+
+# --- ER7 (pipe-delimited) encoding ---
+ER7_MEDIA_TYPE = "x-application/hl7-v2+er7"
+ENCODING_CHARACTERS = "^~\\&"
+
+# Field positions of the JSON keys in each segment (MSH-1 is the field separator itself)
+SEGMENT_FIELDS = {
+    "MSH": {3: "sending_application", 4: "sending_facility", 7: "datetime_of_message", 9: "message_type", 10: "message_control_id", 11: "processing_id", 12: "version_id"},
+    "PID": {2: "external_patient_id", 3: "patient_id", 5: "patient_name", 13: "patient_email"},
+    "OBR": {1: "set_id", 4: "universal_service_id", 7: "observation_datetime"},
+    "OBX": {1: "set_id", 2: "value_type", 3: "observation_identifier", 5: "observation_value", 6: "units", 11: "observation_result_status", 14: "observation_datetime"},
+}
+# Fields whose JSON value holds several components separated by '^'
+COMPOSITE_FIELDS = {"message_type", "patient_name", "universal_service_id", "observation_identifier"}
+
+def escape_er7(value) -> str:
+    """Escapes the HL7 delimiters in a value (the escape character first)."""
+    text = str(value)
+    for character, escaped in (("\\", "\\E\\"), ("|", "\\F\\"), ("^", "\\S\\"), ("&", "\\T\\"), ("~", "\\R\\")):
+        text = text.replace(character, escaped)
+    return text
+
+def _encode_field(key: str, value) -> str:
+    if value is None:
+        return ""
+    if key == "observation_identifier":
+        # LOINC codes: identifier^text^coding system
+        return "^".join([*(escape_er7(part) for part in str(value).split("^")), "LN"])
+    if key == "patient_email":
+        # XTN: ^use code^equipment type^email address
+        return f"^NET^Internet^{escape_er7(value)}"
+    if key in COMPOSITE_FIELDS:
+        return "^".join(escape_er7(part) for part in str(value).split("^"))
+    return escape_er7(value)
+
+def encode_segment(segment: dict) -> str:
+    name = segment["segment"]
+    positions = SEGMENT_FIELDS[name]
+    fields = [""] * (max(positions) + 1)
+    fields[0] = name
+    for position, key in positions.items():
+        fields[position] = _encode_field(key, segment.get(key))
+    if name == "MSH":
+        # MSH-1 is the field separator itself and MSH-2 the encoding characters
+        return "|".join([name, ENCODING_CHARACTERS, *fields[3:]])
+    return "|".join(fields)
+
+def encode_er7(hl7_message: list[dict]) -> str:
+    """Encodes the JSON segments of a message as ER7 text, each segment ended by a carriage return."""
+    return "".join(f"{encode_segment(segment)}\r" for segment in hl7_message)
+
+# --- Bulk export ---
+def _batch_segment(name: str, message_count: int | None = None) -> str:
+    if name == "BHS":
+        return f"BHS|{ENCODING_CHARACTERS}|HealthSyncApp|HealthSyncFacility|||{dt.now(timezone.utc).strftime('%Y%m%d%H%M%S')}\r"
+    return f"BTS|{message_count}\r"
+
+async def stream_bulk_export(user_ids: list[int] | None, fmt: str, start: dt | None = None, end: dt | None = None) -> AsyncIterator[str]:
+    """
+    Streams one ORU^R01 message per user (all users, or the given ones, by id): as an ER7
+    batch (BHS ... BTS) or as NDJSON with one message per line. Users are read in keyset
+    batches and each message is sent as soon as it is built, so memory does not grow
+    with the cohort. Uses its own session, since the response outlives the request.
+    """
+    message_count = 0
+    if fmt == "er7":
+        yield _batch_segment("BHS")
+    async with AsyncReadSessionLocal() as db:
+        last_id = 0
+        while True:
+            query = select(models.User).where(models.User.id > last_id)
+            if user_ids is not None:
+                query = query.where(models.User.id.in_(user_ids))
+            users = (await db.execute(query.order_by(models.User.id).limit(BULK_USER_BATCH_SIZE))).scalars().all()
+            if not users:
+                break
+            for user in users:
+                hl7_message = await build_hl7_message(db, user, start=start, end=end)
+                message_count += 1
+                if fmt == "er7":
+                    yield encode_er7(hl7_message)
+                else:
+                    yield json.dumps({"user_id": user.id, "hl7_message": hl7_message}) + "\n"
+            last_id = users[-1].id
+            # Users of the batch are not needed any more
+            db.expunge_all()
+    if fmt == "er7":
+        yield _batch_segment("BTS", message_count)
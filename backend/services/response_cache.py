@@ -0,0 +1,98 @@
+"""
+In-process cache of the per-user read endpoints (data router and HL7 export).
+
+Each user has a data version in the database (users.data_version), incremented in the
+transaction of every commit that changes their data. Entries and ETags are derived
+from (user, data version, UTC date, path, query), so a change invalidates everything
+cached for the user in every worker process, and ETags stay valid across processes.
+The date is part of the key because some responses are relative to today (the overview,
+the last 30 days of sleep): they are rebuilt after midnight UTC even without new data. A request
+reads the version (one primary-key lookup) before the cache is consulted; a client
+that sends back the ETag it holds gets a 304 without running the endpoint.
+
+The version is read from the same database as the data (the read replica, if any):
+a response is never older than the version it is cached under.
+"""
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+
+from core.config import settings
+
+@dataclass
+class CachedResponse:
+    status_code: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+class ResponseCache:
+    """LRU cache of rendered responses, bounded by the total size of their bodies."""
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        # Latest data version seen for each user
+        self._versions: dict[int, int] = {}
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self._user_keys: dict[int, set[tuple]] = {}
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def observe_version(self, user_id: int, data_version: int):
+        """Records the user's current data version; their entries of older versions are dropped."""
+        if data_version <= self._versions.get(user_id, -1):
+            return
+        self._versions[user_id] = data_version
+        for key in [key for key in self._user_keys.get(user_id, set()) if key[1] < data_version]:
+            self._user_keys[user_id].discard(key)
+            self._size -= len(self._entries.pop(key).body)
+
+    def key(self, user_id: int, data_version: int, day: date, path: str, query: str) -> tuple:
+        self.observe_version(user_id, data_version)
+        # Query parameters are sorted, so '?a=1&b=2' and '?b=2&a=1' share an entry
+        params = "&".join(sorted(query.split("&"))) if query else ""
+        return (user_id, data_version, day.isoformat(), path, params)
+
+    def etag(self, key: tuple) -> str:
+        return f'"{hashlib.sha1(repr(key).encode()).hexdigest()[:16]}"'
+
+    def get(self, key: tuple) -> CachedResponse | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: tuple, entry: CachedResponse):
+        user_id, data_version = key[0], key[1]
+        if len(entry.body) > self.max_entry_bytes or data_version < self._versions.get(user_id, -1):
+            # Too large, or the user's data changed while the response was being built
+            return
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key).body)
+        self._entries[key] = entry
+        self._user_keys.setdefault(user_id, set()).add(key)
+        self._size += len(entry.body)
+
+        while self._size > self.max_bytes:
+            old_key, old_entry = self._entries.popitem(last=False)
+            self._size -= len(old_entry.body)
+            self._user_keys[old_key[0]].discard(old_key)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+response_cache = ResponseCache(
+    max_bytes=settings.RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+    max_entry_bytes=settings.RESPONSE_CACHE_MAX_ENTRY_KB * 1024
+)
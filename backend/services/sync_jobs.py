@@ -0,0 +1,228 @@
+"""
+Sync jobs: POST /users/{user_id}/sync and the scheduler start a job and return at once;
+the job's progress and results are polled with GET /sync/jobs/{job_id}.
+
+Jobs are rows of the sync_jobs table, so any worker reports on any job. A user has at
+most one active (unfinished) job, enforced by a partial unique index: a request for a
+user whose job is queued or running, on whichever worker, joins that job. The worker
+running a job writes its status and progress every SYNC_JOB_HEARTBEAT_SECONDS; an
+active job without a heartbeat for SYNC_JOB_STALE_SECONDS was abandoned by a stopped
+worker and is replaced by the next request. On PostgreSQL, an advisory lock held for
+the whole job keeps the replacement from overlapping a sync that is still finishing.
+"""
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, replace
+from datetime import datetime as dt, timedelta, timezone
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from core.config import settings
+from db import crud, models
+from db.database import AsyncSessionLocal, async_engine
+from services.sync_service import run_user_sync
+
+# First key of the two-key advisory locks taken for syncs (the second is the user id)
+SYNC_LOCK_NAMESPACE = 0x5379
+
+@dataclass
+class SyncJob:
+    id: str
+    user_id: int
+    days: int
+    exclude: list[str]
+    status: str = "queued"  # queued, waiting (for another worker), running, completed, unauthorized, failed
+    message: str | None = None
+    created_at: dt = field(default_factory=lambda: dt.now(timezone.utc))
+    started_at: dt | None = None
+    finished_at: dt | None = None
+    progress: dict = field(default_factory=dict)
+    details: dict | None = None
+    heartbeat_at: dt = field(default_factory=lambda: dt.now(timezone.utc), repr=False)
+
+    @classmethod
+    def from_row(cls, row: models.SyncJob) -> "SyncJob":
+        def aware(timestamp: dt | None) -> dt | None:
+            return timestamp.replace(tzinfo=timezone.utc) if timestamp else None
+        return cls(
+            id=row.id, user_id=row.user_id, days=row.days, exclude=list(row.exclude), status=row.status,
+            message=row.message, created_at=aware(row.created_at), started_at=aware(row.started_at),
+            finished_at=aware(row.finished_at), progress=row.progress, details=row.details,
+            heartbeat_at=aware(row.heartbeat_at)
+        )
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "unauthorized", "failed")
+
+    @property
+    def stale(self) -> bool:
+        """Active, but not written by its worker for SYNC_JOB_STALE_SECONDS."""
+        return not self.finished and dt.now(timezone.utc) - self.heartbeat_at > timedelta(seconds=settings.SYNC_JOB_STALE_SECONDS)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "user_id": self.user_id,
+            "status": self.status,
+            "message": self.message,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+            "details": self.details,
+        }
+
+@asynccontextmanager
+async def user_sync_lock(user_id: int, job: SyncJob):
+    """
+    Holds the user's sync lock for the duration of the block. On PostgreSQL this is a
+    session-level advisory lock on a dedicated connection in autocommit mode (so it is
+    not left idle in a transaction while the job runs), waited for by polling and
+    released explicitly; other databases rely on the one active job per user of the
+    sync_jobs table.
+    """
+    if async_engine.dialect.name != "postgresql":
+        yield
+        return
+    async with async_engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        while not (await connection.execute(select(func.pg_try_advisory_lock(SYNC_LOCK_NAMESPACE, user_id)))).scalar():
+            job.status = "waiting"
+            await asyncio.sleep(settings.SYNC_JOB_LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            try:
+                await connection.execute(select(func.pg_advisory_unlock(SYNC_LOCK_NAMESPACE, user_id)))
+            except BaseException:
+                # The lock lives as long as the server session: close it rather than pool it
+                await connection.invalidate()
+                raise
+
+class SyncJobManager:
+
+    def __init__(self, retention_minutes: int):
+        self.retention = timedelta(minutes=retention_minutes)
+        # Jobs run by this process, until they are finished and written
+        self._jobs: dict[str, SyncJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    async def get(self, job_id: str) -> SyncJob | None:
+        """The job as this process runs it, or as last written by the worker running it."""
+        if job_id in self._jobs:
+            return self._jobs[job_id]
+        async with AsyncSessionLocal() as db:
+            row = await crud.get_sync_job(db, job_id)
+        return SyncJob.from_row(row) if row else None
+
+    async def submit(self, user_id: int, days: int = 30, exclude: list[str] | None = None) -> tuple[SyncJob, bool]:
+        """
+        Starts a sync job for the user, or returns the job already queued or running
+        for them on any worker. Returns the job and whether it was created by this call.
+        """
+        async with AsyncSessionLocal() as db:
+            while True:
+                active = await crud.get_active_sync_job(db, user_id)
+                if active is not None:
+                    job = self._jobs.get(active.id) or SyncJob.from_row(active)
+                    if not job.stale:
+                        return job, False
+                    print(f"Sync job {job.id} for user {user_id} has no heartbeat; replacing it.")
+                    await crud.update_sync_job(db, job.id, status="failed", message="Abandoned by its worker.", finished_at=dt.now(timezone.utc))
+
+                job = SyncJob(id=uuid.uuid4().hex, user_id=user_id, days=days, exclude=list(exclude or []))
+                crud.add_sync_job(
+                    db, id=job.id, user_id=user_id, days=days, exclude=job.exclude, status=job.status,
+                    progress=job.progress, created_at=job.created_at, heartbeat_at=job.heartbeat_at
+                )
+                try:
+                    await db.commit()
+                    break
+                except IntegrityError:
+                    # Another worker started a job for the user first: join it
+                    await db.rollback()
+
+            await crud.delete_finished_sync_jobs(db, dt.now(timezone.utc) - self.retention)
+            await db.commit()
+
+        self._jobs[job.id] = job
+        self._tasks[job.id] = asyncio.create_task(self._run(job))
+        return job, True
+
+    async def wait(self, job: SyncJob) -> SyncJob:
+        """Waits for the job to finish, on whichever worker it runs, and returns it."""
+        task = self._tasks.get(job.id)
+        if task is not None:
+            # Shielded: a waiter that gives up does not cancel the job for the others
+            await asyncio.shield(task)
+            return job
+        while not job.finished:
+            if job.stale:
+                return replace(job, status="failed", message="Abandoned by its worker.")
+            await asyncio.sleep(settings.SYNC_JOB_LOCK_POLL_SECONDS)
+            job = await self.get(job.id) or replace(job, status="failed", message="Sync job not found.")
+        return job
+
+    async def _save(self, job: SyncJob):
+        """Writes the job's state, which is also its heartbeat."""
+        job.heartbeat_at = dt.now(timezone.utc)
+        try:
+            async with AsyncSessionLocal() as db:
+                await crud.update_sync_job(
+                    db, job.id, status=job.status, message=job.message, started_at=job.started_at, finished_at=job.finished_at,
+                    progress={data_key: dict(report) for data_key, report in job.progress.items()}, details=job.details,
+                    heartbeat_at=job.heartbeat_at
+                )
+                await db.commit()
+        except SQLAlchemyError as e:
+            print(f"Could not save sync job {job.id}: {e}")
+
+    async def _heartbeat(self, job: SyncJob):
+        while True:
+            await asyncio.sleep(settings.SYNC_JOB_HEARTBEAT_SECONDS)
+            await self._save(job)
+
+    async def _run(self, job: SyncJob):
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            async with user_sync_lock(job.user_id, job):
+                job.status = "running"
+                job.started_at = dt.now(timezone.utc)
+                await self._save(job)
+                async with AsyncSessionLocal() as db:
+                    user = await crud.get_user(db, job.user_id)
+                    if not user:
+                        job.status, job.message = "failed", "User not found."
+                        return
+                    details = await run_user_sync(db, user, days=job.days, exclude=job.exclude, progress_report=job.progress)
+            if details is None:
+                job.status = "unauthorized"
+                job.message = "Failed to refresh token or token is invalid. Please re-authenticate."
+            else:
+                job.status, job.message, job.details = "completed", "Synchronization completed.", details
+        except asyncio.CancelledError:
+            job.status, job.message = "failed", "Cancelled."
+            raise
+        except Exception as e:
+            print(f"Sync job {job.id} for user {job.user_id} failed: {e}")
+            job.status, job.message = "failed", f"Synchronization failed: {e.__class__.__name__}"
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            job.finished_at = dt.now(timezone.utc)
+            await self._save(job)
+            del self._jobs[job.id], self._tasks[job.id]
+
+    def stats(self) -> dict:
+        return {"active": len(self._tasks)}
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+sync_jobs = SyncJobManager(retention_minutes=settings.SYNC_JOB_RETENTION_MINUTES)
@@ -0,0 +1,146 @@
+import asyncio
+import random
+import time
+from collections import deque
+from datetime import datetime as dt, timedelta, timezone
+
+from core.config import settings
+from db import crud
+from db.database import AsyncSessionLocal
+from services.sync_jobs import sync_jobs
+
+class SyncScheduler:
+    """
+    Keeps all users fresh in the background. A planner periodically picks the users whose
+    data is most stale and queues them for a bounded pool of workers, each of which runs
+    the same sync as POST /users/{user_id}/sync.
+    """
+
+    def __init__(self, interval_minutes: int, jitter: float, workers: int, poll_seconds: int, days: int):
+        self.interval = timedelta(minutes=interval_minutes)
+        self.jitter = jitter
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.days = days
+
+        self._queue: asyncio.Queue[int] | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._pending: set[int] = set()  # queued or in progress
+        self._retry_after: dict[int, float] = {}  # user id -> monotonic time
+        self._completed_at: deque[float] = deque(maxlen=10000)
+        self._durations: deque[float] = deque(maxlen=1000)
+        self._started_at: float | None = None
+        self._backlog = 0
+        self._counters = {"completed": 0, "failed": 0, "unauthorized": 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.workers * 2)
+        self._started_at = time.monotonic()
+        self._tasks = [asyncio.create_task(self._plan_loop())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"Sync scheduler started with {self.workers} workers.")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._pending.clear()
+
+    def _due_before(self) -> dt:
+        """Returns the watermark before which a user is due, with jitter to spread the load."""
+        jittered = self.interval * (1 - self.jitter * random.random())
+        return dt.now(timezone.utc) - jittered
+
+    async def _plan_loop(self):
+        while True:
+            try:
+                await self._enqueue_stale_users()
+            except Exception as e:
+                print(f"Sync scheduler failed to plan: {e}")
+            await asyncio.sleep(self.poll_seconds * (1 + self.jitter * (random.random() - 0.5)))
+
+    async def _enqueue_stale_users(self):
+        now = time.monotonic()
+        self._retry_after = {user_id: t for user_id, t in self._retry_after.items() if t > now}
+        free_slots = self._queue.maxsize - self._queue.qsize()
+
+        async with AsyncSessionLocal() as db:
+            stale_before = self._due_before()
+            self._backlog = await crud.count_stale_users(db, stale_before)
+            if free_slots <= 0:
+                return
+            user_ids = await crud.get_stale_user_ids(
+                db, stale_before, limit=free_slots, exclude_ids=self._pending | set(self._retry_after)
+            )
+
+        for user_id in user_ids:
+            self._pending.add(user_id)
+            self._queue.put_nowait(user_id)
+
+    async def _worker(self):
+        while True:
+            user_id = await self._queue.get()
+            try:
+                await self._sync_user(user_id)
+            finally:
+                self._pending.discard(user_id)
+                self._queue.task_done()
+
+    async def _sync_user(self, user_id: int):
+        started = time.monotonic()
+        # Goes through the job manager, so it joins a sync of the user started by the API
+        job, _ = await sync_jobs.submit(user_id, days=self.days)
+        job = await sync_jobs.wait(job)
+
+        if job.status == "failed":
+            print(f"Background sync for user {user_id} failed: {job.message}")
+            self._counters["failed"] += 1
+            self._retry_after[user_id] = time.monotonic() + self.interval.total_seconds()
+            return
+        if job.status == "unauthorized":
+            # Token cannot be refreshed; wait for the user to re-authenticate
+            self._counters["unauthorized"] += 1
+            self._retry_after[user_id] = time.monotonic() + self.interval.total_seconds()
+            return
+        if any(str(result).startswith("Error") for result in job.details.values()):
+            # Keep the user out of the queue until the next interval, even if some cursors lag
+            self._retry_after[user_id] = time.monotonic() + self.interval.total_seconds()
+
+        finished = time.monotonic()
+        self._counters["completed"] += 1
+        self._completed_at.append(finished)
+        self._durations.append(finished - started)
+
+    def stats(self) -> dict:
+        """Returns throughput and backlog statistics."""
+        now = time.monotonic()
+        recent = sum(1 for t in self._completed_at if now - t <= 300)
+        durations = sorted(self._durations)
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "uptime_seconds": int(now - self._started_at) if self._started_at else 0,
+            "backlog": self._backlog,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "in_progress": len(self._pending) - (self._queue.qsize() if self._queue else 0),
+            "waiting_for_retry": len(self._retry_after),
+            **self._counters,
+            "syncs_per_minute": round(recent / 5, 2),
+            "avg_sync_seconds": round(sum(durations) / len(durations), 3) if durations else None,
+            "p95_sync_seconds": round(durations[int(len(durations) * 0.95)], 3) if durations else None,
+        }
+
+scheduler = SyncScheduler(
+    interval_minutes=settings.SYNC_SCHEDULER_INTERVAL_MINUTES,
+    jitter=settings.SYNC_SCHEDULER_JITTER,
+    workers=settings.SYNC_SCHEDULER_WORKERS,
+    poll_seconds=settings.SYNC_SCHEDULER_POLL_SECONDS,
+    days=settings.SYNC_SCHEDULER_DAYS
+)
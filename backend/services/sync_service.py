@@ -0,0 +1,482 @@
+import asyncio
+import time
+import httpx
+from typing import AsyncIterator, Awaitable, Callable, Iterator
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime as dt, timedelta, timezone
+
+from core import metrics
+from core.config import settings
+from db import models, crud, rollups
+from db.rollups import SLEEP_PHASE_COLUMNS
+from services.google_api import GoogleApiClient, google_api
+from services.google_fit_service import get_and_refresh_credentials
+
+DAY_MILLIS = 86400000
+
+def aggregate_bucket_millis(data_key: str) -> int:
+    """Bucket size of a data type's aggregate requests (SYNC_BUCKET_MINUTES, one day by default)."""
+    minutes = settings.SYNC_BUCKET_MINUTES.get(data_key, 1440)
+    if minutes <= 0 or 1440 % minutes:
+        raise ValueError(f"SYNC_BUCKET_MINUTES[{data_key!r}] must divide a day, got {minutes}.")
+    return minutes * 60000
+
+DATA_TYPE_CONFIG = {
+    "AGGREGATE": {
+        "steps": {
+            "dataTypeName": "com.google.step_count.delta",
+            "bucketMillis": aggregate_bucket_millis("steps"),
+            "model": models.Steps,
+            "crud_function": crud.add_steps_data,
+            "parser": lambda p: {"value": p["value"][0].get("intVal")}
+        },
+        "heart_rate": {
+            "dataTypeName": "com.google.heart_rate.bpm",
+            "bucketMillis": aggregate_bucket_millis("heart_rate"),
+            "model": models.HeartRate,
+            "crud_function": crud.add_heart_rate_data,
+            "parser": lambda p: {"value": p["value"][0].get("fpVal")}
+        },
+    },
+    "LIST": {
+        "oxygen_saturation": {
+            "dataTypeName": "com.google.oxygen_saturation",
+            "model": models.OxygenSaturation,
+            "crud_function": crud.add_oxygen_saturation_data,
+            "parser": lambda p: {
+                "timestamp": dt.fromtimestamp(int(p["startTimeNanos"]) / 1e9, tz=timezone.utc),
+                "value": p["value"][0].get("fpVal")
+            }
+        },
+        "blood_pressure": {
+            "dataTypeName": "com.google.blood_pressure",
+            "model": models.BloodPressure,
+            "crud_function": crud.add_blood_pressure_data,
+            "parser": lambda p: {
+                "timestamp": dt.fromtimestamp(int(p["startTimeNanos"]) / 1e9, tz=timezone.utc),
+                "systolic": p["value"][0].get("fpVal"),
+                "diastolic": p["value"][1].get("fpVal")
+            }
+        },
+    }
+}
+
+# --- Helper functions ---
+def iter_aggregate_points(response_json: dict, parser_func: callable) -> Iterator[dict]:
+    """
+    Universal function for parsing aggregated responses from Google Fit, point by point.
+    Points are stamped with the start of their bucket, so a day's bucket falls on that day.
+    """
+    for bucket in response_json.get("bucket", []):
+        timestamp = dt.fromtimestamp(int(bucket["startTimeMillis"]) / 1000, tz=timezone.utc)
+        for dataset in bucket.get("dataset", []):
+            for point in dataset.get("point", []):
+                if point.get("value"):
+                    parsed_point = parser_func(point)
+                    if all(v is not None for v in parsed_point.values()):
+                        yield {"timestamp": timestamp, **parsed_point}
+
+def align_to_bucket(timestamp: dt, bucket_millis: int, ceil: bool = False) -> dt:
+    """
+    Aligns a timestamp to a bucket boundary (counted from the UNIX epoch), so that
+    repeated aggregate requests produce the same bucket timestamps and can be merged.
+    """
+    millis = int(timestamp.timestamp() * 1000)
+    aligned = (millis // bucket_millis) * bucket_millis
+    if ceil and aligned < millis:
+        aligned += bucket_millis
+    return dt.fromtimestamp(aligned / 1000, tz=timezone.utc)
+
+async def get_fetch_start(db: AsyncSession, user_id: int, data_key: str, window_start: dt) -> dt:
+    """
+    Returns the start of the window to fetch for the given data type: the last watermark
+    minus a small overlap, but never earlier than the requested window.
+    """
+    watermark = await crud.get_sync_watermark(db, user_id, data_key)
+    if watermark is None:
+        return window_start
+    return max(window_start, watermark - timedelta(hours=settings.SYNC_OVERLAP_HOURS))
+
+def split_window(start: dt, end: dt, window: timedelta, aligned: bool = False) -> list[tuple[dt, dt]]:
+    """
+    Splits [start, end) into consecutive windows of at most 'window'.
+    With 'aligned', the boundaries between windows fall on UTC midnights.
+    """
+    origin = align_to_bucket(start, DAY_MILLIS) if aligned else start
+    windows = []
+    window_start = start
+    while window_start < end:
+        window_end = min(origin + window * (len(windows) + 1), end)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows or [(start, end)]
+
+def window_size(category: str, config: dict | None) -> timedelta:
+    """Fetch window of a data type; aggregate windows are also bounded by their number of buckets."""
+    days = settings.SYNC_WINDOW_DAYS
+    if category == "AGGREGATE":
+        days = min(days, max(1, settings.SYNC_MAX_BUCKETS_PER_REQUEST * config["bucketMillis"] // DAY_MILLIS))
+    return timedelta(days=days)
+
+def aggregate_range(item: dict) -> tuple[dt, dt]:
+    """The whole days an aggregate window requests, and replaces."""
+    return align_to_bucket(item["start"], DAY_MILLIS), align_to_bucket(item["end"], DAY_MILLIS, ceil=True)
+
+async def build_fetch_plan(db: AsyncSession, user_id: int, start_time: dt, end_time: dt, exclude: list[str]) -> list[dict]:
+    """
+    Decides what to fetch for every data type that is not excluded (in DATA_TYPE_CONFIG order,
+    sleep last). Reads the sync cursors up front so the fetch stage does not touch the DB.
+    Long ranges (e.g. the backfill of a new user's history) are split into windows that are
+    fetched in parallel; the items of a data type are in window order.
+    """
+    data_types = [
+        (data_key, data_category, config)
+        for data_category, data_configs in DATA_TYPE_CONFIG.items()
+        for data_key, config in data_configs.items()
+    ]
+    data_types.append(("sleep", "SESSION", None))
+
+    plan = []
+    for data_key, data_category, config in data_types:
+        if data_key in exclude:
+            continue
+        fetch_start = await get_fetch_start(db, user_id, data_key, start_time)
+        windows = split_window(fetch_start, end_time, window_size(data_category, config), aligned=data_category == "AGGREGATE")
+        for window_start, window_end in windows:
+            plan.append({"data_key": data_key, "category": data_category, "config": config, "start": window_start, "end": window_end})
+    return plan
+
+class FetchError(Exception):
+    """Google Fit answered a request of the sync with an error status."""
+
+async def iter_pages(client: GoogleApiClient, item: dict, headers: dict) -> AsyncIterator[dict]:
+    """
+    Yields the response pages of one data type of the plan, following nextPageToken.
+    Only one page is held in memory at a time.
+    """
+    config = item["config"]
+    if item["category"] == "AGGREGATE":
+        # Whole days, so a re-fetched day replaces the same rows. (The aggregate endpoint
+        # is not paged; the window size bounds the number of buckets instead.)
+        fetch_start, fetch_end = aggregate_range(item)
+        endpoint = "https://www.googleapis.com/fitness/v1/users/me/dataset:aggregate"
+        body = {"aggregateBy": [{"dataTypeName": config["dataTypeName"]}], "bucketByTime": {"durationMillis": config["bucketMillis"]}, "startTimeMillis": int(fetch_start.timestamp() * 1000), "endTimeMillis": int(fetch_end.timestamp() * 1000)}
+        with metrics.SYNC_STAGE_SECONDS.labels(stage="google_request").time():
+            response = await client.post(endpoint, json=body, headers=headers)
+        if response.status_code != 200:
+            raise FetchError(f"Error: {response.status_code}")
+        with metrics.SYNC_STAGE_SECONDS.labels(stage="decode").time():
+            page = response.json()
+        yield page
+        return
+
+    if item["category"] == "LIST":
+        source = f"derived:{config['dataTypeName']}:com.google.android.gms:merged"
+        endpoint = f"https://www.googleapis.com/fitness/v1/users/me/dataSources/{source}/datasets/{int(item['start'].timestamp() * 1e9)}-{int(item['end'].timestamp() * 1e9)}"
+        params = {"limit": settings.GOOGLE_FIT_PAGE_SIZE}
+    else: # SESSION (sleep)
+        endpoint = "https://www.googleapis.com/fitness/v1/users/me/sessions"
+        params = {"startTime": item["start"].strftime('%Y-%m-%dT%H:%M:%SZ'), "endTime": item["end"].strftime('%Y-%m-%dT%H:%M:%SZ'), "activityType": 72}
+
+    page_token = None
+    while True:
+        page_params = {**params, "pageToken": page_token} if page_token else params
+        with metrics.SYNC_STAGE_SECONDS.labels(stage="google_request").time():
+            response = await client.get(endpoint, headers=headers, params=page_params)
+        if response.status_code != 200:
+            details = f", Details: {response.text}" if item["category"] == "SESSION" else ""
+            raise FetchError(f"Error: {response.status_code}{details}")
+        with metrics.SYNC_STAGE_SECONDS.labels(stage="decode").time():
+            page = response.json()
+        next_token = page.pop("nextPageToken", None)
+        yield page
+        # (A repeated token would loop forever, so it ends the paging too)
+        if not next_token or next_token == page_token:
+            return
+        page_token = next_token
+
+def parse_page(item: dict, page: dict) -> Iterator[tuple[str, dict]]:
+    """
+    Parses one response page point by point, yielding ("data", row) for every data point
+    and, for sleep, ("sessions", summary) for every session.
+    """
+    if item["category"] == "AGGREGATE":
+        for row in iter_aggregate_points(page, item["config"]["parser"]):
+            yield "data", row
+    elif item["category"] == "LIST":
+        parser = item["config"]["parser"]
+        for point in page.get("point", []):
+            if point.get("value"):
+                yield "data", parser(point)
+    else:
+        for session in page.get("session", []):
+            segments = list(iter_sleep_segments(session))
+            for segment in segments:
+                yield "data", segment
+            summary = summarize_sleep_session(session, segments)
+            if summary:
+                yield "sessions", summary
+
+async def fetch_data_type(client: GoogleApiClient, item: dict, headers: dict, emit: Callable[[str, list[dict]], Awaitable[None]]):
+    """
+    Fetches and parses one data type of the plan, handing the rows to 'emit' in batches
+    of SYNC_FLUSH_BATCH_SIZE as they are parsed. Raises FetchError on an error response.
+    """
+    batches: dict[str, list[dict]] = {"data": [], "sessions": []}
+    async for page in iter_pages(client, item, headers):
+        # Parsing is timed per page, without the time spent waiting in 'emit'
+        parse_seconds = 0.0
+        started = time.perf_counter()
+        for kind, row in parse_page(item, page):
+            batch = batches[kind]
+            batch.append(row)
+            if len(batch) >= settings.SYNC_FLUSH_BATCH_SIZE:
+                batches[kind] = []
+                parse_seconds += time.perf_counter() - started
+                await emit(kind, batch)
+                started = time.perf_counter()
+        metrics.SYNC_STAGE_SECONDS.labels(stage="parse").observe(parse_seconds + time.perf_counter() - started)
+    for kind, batch in batches.items():
+        if batch:
+            await emit(kind, batch)
+
+def parse_sleep_segment(point: dict) -> dict:
+    return {"start_time": dt.fromtimestamp(int(point["startTimeNanos"]) / 1e9, tz=timezone.utc), "end_time": dt.fromtimestamp(int(point["endTimeNanos"]) / 1e9, tz=timezone.utc), "value": point["value"][0]["intVal"]}
+
+def iter_sleep_segments(session: dict) -> Iterator[dict]:
+    """Yields the sleep segments of a session returned by Google Fit."""
+    for dataset in session.get("dataset", []):
+        if "sleep.segment" in dataset.get("dataSourceId", ""):
+            for point in dataset.get("point", []):
+                if point.get("value") and point["value"][0].get("intVal"):
+                    yield parse_sleep_segment(point)
+
+def summarize_sleep_session(session: dict, segments: list[dict]) -> dict | None:
+    """Computes the per-phase totals of a session once, at ingest."""
+    if "startTimeMillis" in session and "endTimeMillis" in session:
+        start_time = dt.fromtimestamp(int(session["startTimeMillis"]) / 1000, tz=timezone.utc)
+        end_time = dt.fromtimestamp(int(session["endTimeMillis"]) / 1000, tz=timezone.utc)
+    elif segments:
+        start_time = min(segment["start_time"] for segment in segments)
+        end_time = max(segment["end_time"] for segment in segments)
+    else:
+        return None
+
+    summary = {
+        "session_id": session.get("id"),
+        "name": session.get("name"),
+        "start_time": start_time,
+        "end_time": end_time,
+        **{column: 0.0 for column in SLEEP_PHASE_COLUMNS.values()},
+    }
+    for segment in segments:
+        column = SLEEP_PHASE_COLUMNS.get(segment["value"])
+        if column:
+            summary[column] += (segment["end_time"] - segment["start_time"]).total_seconds() / 60
+    if segments:
+        summary["total_sleep_minutes"] = summary["light_minutes"] + summary["deep_minutes"] + summary["rem_minutes"]
+    else:
+        # A session without segments is sleep as a whole
+        summary["total_sleep_minutes"] = (end_time - start_time).total_seconds() / 60
+    return summary
+
+async def fetch_all(
+    client: GoogleApiClient,
+    plan: list[dict],
+    headers: dict,
+    max_concurrency: int,
+    emit: Callable[[int, str, list[dict]], Awaitable[None]],
+    done: Callable[[int, str | None], Awaitable[None]] | None = None
+) -> list[str | None]:
+    """
+    Runs the fetch/parse stage of every planned item concurrently, at most 'max_concurrency'
+    at a time; batches are passed to 'emit', and the end of every item to 'done', with the
+    item's plan index. Returns the error of every item (None if it was fetched completely),
+    in plan order.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(index: int, item: dict) -> str | None:
+        async with semaphore:
+            try:
+                await fetch_data_type(client, item, headers, lambda kind, rows: emit(index, kind, rows))
+                error = None
+            except FetchError as e:
+                error = str(e)
+            except httpx.HTTPError as e:
+                error = f"Error: {e.__class__.__name__}"
+        if done:
+            await done(index, error)
+        return error
+
+    return await asyncio.gather(*(run(index, item) for index, item in enumerate(plan)))
+
+async def store_batch(db: AsyncSession, user_id: int, item: dict, kind: str, rows: list[dict], progress: dict):
+    """Writes one batch of a window and records the rows and days it covered."""
+    data_key = item["data_key"]
+    if kind == "sessions":
+        with metrics.SYNC_STAGE_SECONDS.labels(stage="insert").time():
+            await crud.add_sleep_sessions(db=db, user_id=user_id, data=rows)
+        progress["sessions"] += len(rows)
+        return
+
+    if data_key == "sleep":
+        with metrics.SYNC_STAGE_SECONDS.labels(stage="insert").time():
+            await crud.add_sleep_data(db=db, user_id=user_id, data=rows)
+    else:
+        if item["category"] == "AGGREGATE" and not progress["rows"]:
+            # The buckets of an aggregate window replace the rows of its days, so rows of
+            # another bucket size (after SYNC_BUCKET_MINUTES changed) are not counted twice
+            fetch_start, fetch_end = aggregate_range(item)
+            with metrics.SYNC_STAGE_SECONDS.labels(stage="delete").time():
+                await crud.delete_series_window(db, item["config"]["model"], user_id, fetch_start, fetch_end)
+            progress["first_day"], progress["last_day"] = fetch_start.date(), (fetch_end - timedelta(days=1)).date()
+        with metrics.SYNC_STAGE_SECONDS.labels(stage="insert").time():
+            await item["config"]["crud_function"](db=db, user_id=user_id, data=rows)
+    metrics.SYNC_ROWS.labels(data_type=data_key).inc(len(rows))
+    time_field = "end_time" if data_key == "sleep" else "timestamp"
+    first_day = min(row[time_field] for row in rows).date()
+    last_day = max(row[time_field] for row in rows).date()
+    progress["rows"] += len(rows)
+    progress["first_day"] = min(progress["first_day"] or first_day, first_day)
+    progress["last_day"] = max(progress["last_day"] or last_day, last_day)
+
+async def ingest_plan(db: AsyncSession, client: GoogleApiClient, user_id: int, plan: list[dict], headers: dict, progress_report: dict | None = None) -> dict:
+    """
+    Streams the plan from Google Fit into the database: the windows are fetched and parsed
+    concurrently, and their batches are written one at a time on this session as they
+    arrive. A bounded queue between the two stages keeps the memory of a sync flat,
+    whatever the size of the range.
+
+    When a window is done, the daily rollups and derived metrics of its days are refreshed
+    and the work so far is committed. The sync cursor of a data type only moves over its
+    complete windows in order, so an interrupted or partly failed backfill resumes at its
+    first missing window.
+    'progress_report', if given, is kept up to date with the progress of every data type.
+    """
+    queue: asyncio.Queue[tuple | None] = asyncio.Queue(maxsize=settings.SYNC_MAX_CONCURRENCY * 2)
+
+    async def emit(index: int, kind: str, rows: list[dict]):
+        await queue.put((index, kind, rows))
+
+    async def done(index: int, error: str | None):
+        await queue.put((index, "done", error))
+
+    async def produce():
+        try:
+            await fetch_all(client, plan, headers, settings.SYNC_MAX_CONCURRENCY, emit, done)
+        finally:
+            await queue.put(None)
+
+    progress = [{"rows": 0, "sessions": 0, "first_day": None, "last_day": None} for _ in plan]
+    windows: dict[str, list[int]] = {}  # data key -> plan indexes, in window order
+    for index, item in enumerate(plan):
+        windows.setdefault(item["data_key"], []).append(index)
+    completed = {data_key: 0 for data_key in windows}  # complete windows at the start of each list
+    outcomes: dict[int, str | None] = {}
+    errors: dict[str, list[str]] = {}
+    report = progress_report if progress_report is not None else {}
+    for data_key, indexes in windows.items():
+        report[data_key] = {"status": "running", "windows": len(indexes), "windows_done": 0, "rows": 0}
+
+    async def finish_window(index: int, error: str | None):
+        item = plan[index]
+        data_key = item["data_key"]
+        if progress[index]["rows"]:
+            # Also after an error: the batches written before it are kept
+            with metrics.SYNC_STAGE_SECONDS.labels(stage="rollups").time():
+                await rollups.refresh_rollups_for_ingest(db, user_id, data_key, progress[index]["first_day"], progress[index]["last_day"])
+            # NumPy is imported with the first sync, not with the app
+            from db import derived_metrics
+            with metrics.SYNC_STAGE_SECONDS.labels(stage="derived_metrics").time():
+                await derived_metrics.refresh_derived_metrics_for_ingest(db, user_id, data_key, progress[index]["first_day"], progress[index]["last_day"])
+        outcomes[index] = error
+        if error:
+            errors.setdefault(data_key, []).append(error)
+        report[data_key]["windows_done"] += 1
+        if report[data_key]["windows_done"] == report[data_key]["windows"]:
+            report[data_key]["status"] = "failed" if data_key in errors else "completed"
+
+        indexes = windows[data_key]
+        moved = False
+        while completed[data_key] < len(indexes) and indexes[completed[data_key]] in outcomes and outcomes[indexes[completed[data_key]]] is None:
+            completed[data_key] += 1
+            moved = True
+        if moved:
+            await crud.set_sync_watermark(db, user_id, data_key, plan[indexes[completed[data_key] - 1]]["end"])
+        if progress[index]["rows"] or progress[index]["sessions"]:
+            # Committed with the data, so cached responses of every worker go stale with it
+            await crud.bump_data_version(db, user_id)
+        with metrics.SYNC_STAGE_SECONDS.labels(stage="commit").time():
+            await db.commit()
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (message := await queue.get()) is not None:
+            index, kind, payload = message
+            if kind == "done":
+                await finish_window(index, payload)
+            else:
+                await store_batch(db, user_id, plan[index], kind, payload, progress[index])
+                if kind == "data":
+                    report[plan[index]["data_key"]]["rows"] += len(payload)
+    except BaseException:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+        raise
+    await producer
+
+    sync_results = {}
+    for data_key, indexes in windows.items():
+        if data_key in errors:
+            failed = errors[data_key]
+            sync_results[data_key] = failed[0] if len(indexes) == 1 else f"{failed[0]} ({len(failed)} of {len(indexes)} windows failed)"
+            continue
+        rows = sum(progress[index]["rows"] for index in indexes)
+        in_windows = f" in {len(indexes)} windows" if len(indexes) > 1 else ""
+        if data_key == "sleep":
+            sessions = sum(progress[index]["sessions"] for index in indexes)
+            sync_results[data_key] = f"Processed {rows} sleep segments from {sessions} sessions{in_windows}."
+        else:
+            sync_results[data_key] = f"Processed {rows} entries{in_windows}."
+    return sync_results
+
+async def run_user_sync(db: AsyncSession, user: models.User, days: int = 30, exclude: list[str] | None = None, progress_report: dict | None = None) -> dict | None:
+    """
+    Synchronizes the given user's data with Google Fit and commits it.
+    Returns the per-data-type results, or None if the user's token cannot be used.
+    Run by sync jobs (see services.sync_jobs), for the sync endpoint and the scheduler.
+    """
+    started = time.perf_counter()
+    result = "failed"
+    try:
+        sync_results = await _run_user_sync(db, user, days, exclude or [], progress_report)
+        result = "completed" if sync_results is not None else "unauthorized"
+        return sync_results
+    finally:
+        metrics.SYNC_SECONDS.labels(result=result).observe(time.perf_counter() - started)
+
+async def _run_user_sync(db: AsyncSession, user: models.User, days: int, exclude: list[str], progress_report: dict | None) -> dict | None:
+    # STEP 1: Obtain a valid token (refreshed if necessary)
+    with metrics.SYNC_STAGE_SECONDS.labels(stage="token").time():
+        credentials = await get_and_refresh_credentials(db=db, user=user)
+    if not credentials or not credentials.token:
+        return None
+
+    headers = {"Authorization": f"Bearer {credentials.token}"}
+    end_time = dt.now(timezone.utc)
+    start_time = end_time - timedelta(days=days)
+    with metrics.SYNC_STAGE_SECONDS.labels(stage="plan").time():
+        plan = await build_fetch_plan(db, user.id, start_time, end_time, exclude)
+
+    # STEP 2: Fetch all data types concurrently over the shared Google API client,
+    # storing their batches as they are parsed
+    stored = await ingest_plan(db, google_api, user.id, plan, headers, progress_report)
+
+    # STEP 3: Report every data type
+    data_keys = [*DATA_TYPE_CONFIG["AGGREGATE"], *DATA_TYPE_CONFIG["LIST"], "sleep"]
+    sync_results = {data_key: stored.get(data_key, "Skipped on request.") for data_key in data_keys}
+
+    with metrics.SYNC_STAGE_SECONDS.labels(stage="commit").time():
+        await db.commit()
+    return sync_results
@@ -0,0 +1,68 @@
+"""
+Tests run against a throwaway SQLite database, migrated by the app's lifespan, with the
+Google Fit API answered by the benchmark stub. Run from backend/ with:
+
+    python -m pytest
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# The settings are read at import, so the environment is set up before the app is imported
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='healthsync-tests-')}/healthsync.db"
+for name in ("ASYNC_DATABASE_URL", "READ_DATABASE_URL", "ASYNC_READ_DATABASE_URL"):
+    os.environ.pop(name, None)
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+os.environ.setdefault("REDIRECT_URI", "http://localhost:8000/auth/google/callback")
+
+from fastapi.testclient import TestClient
+
+from benchmarks.google_fit_stub import create_transport
+from db import database, models
+from main import app
+from services.google_api import google_api
+
+@pytest.fixture(scope="session")
+def client():
+    google_api.transport = create_transport()
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture(scope="session")
+def run(client):
+    """Runs a coroutine function on the app's event loop, where its engines live."""
+    return client.portal.call
+
+@pytest.fixture
+def create_user(run, request):
+    """Creates a new user with a valid token (so syncs never refresh it) and returns its id."""
+    async def create() -> int:
+        async with database.AsyncSessionLocal() as db:
+            name = f"{request.node.name}-{datetime.now(timezone.utc).timestamp()}"
+            user = models.User(
+                google_id=name, email=f"{name}@example.com", access_token="test-token", refresh_token="test-refresh",
+                token_expiry=datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=2)
+            )
+            db.add(user)
+            await db.commit()
+            return user.id
+    return lambda: run(create)
+
+@pytest.fixture
+def user_id(create_user) -> int:
+    return create_user()
+
+@pytest.fixture
+def sync(client):
+    """Syncs the user's last 'days' days from the stub and returns the finished job."""
+    def sync(user_id: int, days: int = 3) -> dict:
+        job_url = client.post(f"/users/{user_id}/sync", params={"days": days}).headers["Location"]
+        while (job := client.get(job_url).json())["status"] not in ("completed", "unauthorized", "failed"):
+            time.sleep(0.05)
+        assert job["status"] == "completed", job
+        return job
+    return sync
@@ -0,0 +1,60 @@
+import asyncio
+
+import httpx
+from sqlalchemy import select
+
+from db import database, models
+from services import credential_cache as credential_cache_module
+from services.credential_cache import CredentialCache
+
+def new_cache() -> CredentialCache:
+    return CredentialCache(margin_seconds=60, proactive_seconds=300, keep_warm_minutes=60, flush_interval_seconds=60, flush_batch_size=100)
+
+def fake_token_endpoint(monkeypatch, status_code: int = 200) -> list:
+    """Answers token refreshes after a short delay, so concurrent callers overlap; returns the list of requests."""
+    requests = []
+
+    async def post(url, data=None, **kwargs):
+        requests.append(data)
+        await asyncio.sleep(0.05)
+        if status_code != 200:
+            return httpx.Response(status_code, json={"error": "invalid_grant"})
+        return httpx.Response(200, json={"access_token": f"refreshed-{len(requests)}", "expires_in": 3600})
+
+    monkeypatch.setattr(credential_cache_module.google_api, "post", post)
+    return requests
+
+def expired_user(user_id: int) -> models.User:
+    return models.User(id=user_id, access_token="expired", refresh_token="refresh", token_expiry=None)
+
+def test_concurrent_lookups_share_one_refresh(run, user_id, monkeypatch):
+    requests = fake_token_endpoint(monkeypatch)
+    cache = new_cache()
+
+    async def lookups():
+        user = expired_user(user_id)
+        return await asyncio.gather(*(cache.get_credentials(user) for _ in range(10)))
+
+    credentials = run(lookups)
+    assert len(requests) == 1
+    assert {credential.token for credential in credentials} == {"refreshed-1"}
+
+    # The refreshed token is served from the cache afterwards, and written back
+    assert run(cache.get_credentials, expired_user(user_id)).token == "refreshed-1"
+    assert len(requests) == 1
+
+    async def stored_token():
+        async with database.AsyncSessionLocal() as db:
+            return await db.scalar(select(models.User.access_token).where(models.User.id == user_id))
+    assert run(stored_token) == "refreshed-1"
+
+def test_refused_refresh_asks_every_caller_to_reauthenticate(run, user_id, monkeypatch):
+    requests = fake_token_endpoint(monkeypatch, status_code=400)
+    cache = new_cache()
+
+    async def lookups():
+        user = expired_user(user_id)
+        return await asyncio.gather(*(cache.get_credentials(user) for _ in range(5)))
+
+    assert run(lookups) == [None] * 5
+    assert len(requests) == 1
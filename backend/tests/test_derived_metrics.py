@@ -0,0 +1,117 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import delete, select, update
+
+from db import database, derived_metrics, models
+from db.derived_metrics import daily_percentile, rolling_means, rolling_slopes
+
+def series_with_gaps(length: int = 120, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    values = rng.normal(120, 10, length)
+    values[rng.random(length) < 0.3] = np.nan
+    # A gap longer than the windows
+    values[40:75] = np.nan
+    return values
+
+def windows(values: np.ndarray, window: int):
+    for end in range(len(values)):
+        yield end, np.arange(max(end - window + 1, 0), end + 1)
+
+@pytest.mark.parametrize("window", [7, 30])
+def test_rolling_means_match_nanmean(window):
+    values = series_with_gaps()
+    means = rolling_means(values, window)
+    for end, days in windows(values, window):
+        window_values = values[days]
+        if np.isnan(window_values).all():
+            assert np.isnan(means[end])
+        else:
+            assert means[end] == pytest.approx(np.nanmean(window_values))
+
+def test_rolling_slopes_match_polyfit():
+    values = series_with_gaps()
+    slopes = rolling_slopes(values, 30, 3)
+    for end, days in windows(values, 30):
+        present = ~np.isnan(values[days])
+        if present.sum() < 3:
+            assert np.isnan(slopes[end])
+        else:
+            assert slopes[end] == pytest.approx(np.polyfit(days[present], values[days][present], 1)[0], abs=1e-9)
+
+def test_daily_percentile_matches_lower_percentile():
+    rng = np.random.default_rng(2)
+    days = rng.integers(0, 10, 500)
+    values = rng.normal(60, 8, 500)
+    result_days, percentiles = daily_percentile(days, values, 10, min_count=40)
+    expected = {day: np.percentile(values[days == day], 10, method="lower") for day in range(10) if (days == day).sum() >= 40}
+    assert dict(zip(result_days.tolist(), percentiles.tolist())) == pytest.approx(expected)
+
+# --- Refresh ---
+FIRST_DAY = date(2026, 1, 1)
+
+def store_daily_steps(run, user_id: int, values: np.ndarray):
+    async def store():
+        async with database.AsyncSessionLocal() as db:
+            db.add_all([
+                models.DailyRollup(user_id=user_id, metric="steps", day=FIRST_DAY + timedelta(days=offset), count=1, sum=float(value), min=float(value), max=float(value), mean=float(value))
+                for offset, value in enumerate(values) if not np.isnan(value)
+            ])
+            await db.commit()
+    run(store)
+
+def stored_metrics(run, user_id: int) -> dict[tuple[str, date], float]:
+    async def read():
+        async with database.AsyncSessionLocal() as db:
+            rows = await db.execute(select(models.DerivedMetric.metric, models.DerivedMetric.day, models.DerivedMetric.value).where(models.DerivedMetric.user_id == user_id))
+            return {(metric, day): value for metric, day, value in rows}
+    return run(read)
+
+def refresh(run, user_id: int, first_day: date | None = None, last_day: date | None = None):
+    async def refresh():
+        async with database.AsyncSessionLocal() as db:
+            if first_day is None:
+                await derived_metrics.refresh_rolling_metrics(db, user_id, ["steps"])
+            else:
+                await derived_metrics.refresh_derived_metrics_for_ingest(db, user_id, "steps", first_day, last_day)
+            await db.commit()
+    run(refresh)
+
+def test_refresh_stores_the_windows_of_the_days_with_data(run, user_id):
+    values = series_with_gaps(60)
+    store_daily_steps(run, user_id, values)
+    refresh(run, user_id)
+    stored = stored_metrics(run, user_id)
+
+    for label, window in derived_metrics.ROLLING_WINDOWS.items():
+        means = rolling_means(values, window)
+        expected = {FIRST_DAY + timedelta(days=int(offset)): means[offset] for offset in np.flatnonzero(~np.isnan(values))}
+        actual = {day: value for (metric, day), value in stored.items() if metric == f"steps_avg_{label}"}
+        assert actual == pytest.approx(expected), label
+
+def test_refresh_of_changed_days_matches_a_full_recompute(run, user_id, create_user):
+    values = series_with_gaps(60)
+    changed, removed = 10, 12
+    values[[changed, removed]] = [9000.0, 11000.0]
+    store_daily_steps(run, user_id, values)
+    refresh(run, user_id)
+
+    # A sync changes one day and removes another: only the windows reaching over them are recomputed
+    async def change():
+        async with database.AsyncSessionLocal() as db:
+            steps = (models.DailyRollup.user_id == user_id, models.DailyRollup.metric == "steps")
+            await db.execute(update(models.DailyRollup).where(*steps, models.DailyRollup.day == FIRST_DAY + timedelta(days=changed)).values(sum=5000.0, mean=5000.0))
+            await db.execute(delete(models.DailyRollup).where(*steps, models.DailyRollup.day == FIRST_DAY + timedelta(days=removed)))
+            await db.commit()
+    run(change)
+    refresh(run, user_id, FIRST_DAY + timedelta(days=changed), FIRST_DAY + timedelta(days=removed))
+    incremental = stored_metrics(run, user_id)
+    assert not any(day == FIRST_DAY + timedelta(days=removed) for _, day in incremental)
+
+    # The same data, derived from scratch for another user
+    values[[changed, removed]] = [5000.0, np.nan]
+    other_user = create_user()
+    store_daily_steps(run, other_user, values)
+    refresh(run, other_user)
+    assert incremental == pytest.approx(stored_metrics(run, other_user))
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+
+from core.config import settings
+from services.google_api import GoogleApiClient, parse_retry_after
+
+URL = "https://www.googleapis.com/fitness/v1/users/me/dataset:aggregate"
+
+def throttling_client(responses: list[httpx.Response]) -> tuple[GoogleApiClient, list[float]]:
+    """A client answered by the given responses in turn; returns it and the (monotonic) times of the requests."""
+    times = []
+
+    def handler(request):
+        times.append(time.monotonic())
+        return responses[min(len(times), len(responses)) - 1]
+
+    return GoogleApiClient(transport=httpx.MockTransport(handler)), times
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 55 < parse_retry_after(in_a_minute) <= 60
+
+def test_retry_after_is_honoured(monkeypatch):
+    monkeypatch.setattr(settings, "GOOGLE_API_BACKOFF_BASE_SECONDS", 0.01)
+    client, times = throttling_client([httpx.Response(429, headers={"Retry-After": "0.3"}), httpx.Response(200, json={})])
+
+    async def request():
+        try:
+            return await client.get(URL)
+        finally:
+            await client.aclose()
+
+    response = asyncio.run(request())
+    assert response.status_code == 200
+    assert len(times) == 2
+    assert times[1] - times[0] >= 0.3
+    assert client.stats() == {"requests": 2, "retries": 1, "throttled": 1}
+
+def test_throttling_pauses_every_request(monkeypatch):
+    monkeypatch.setattr(settings, "GOOGLE_API_BACKOFF_BASE_SECONDS", 0.01)
+    client, times = throttling_client([httpx.Response(429, headers={"Retry-After": "0.3"}), httpx.Response(200, json={})])
+
+    async def requests():
+        try:
+            first = asyncio.create_task(client.get(URL))
+            # Sent after the 429, before its retry
+            await asyncio.sleep(0.1)
+            second = await client.get(URL)
+            return await first, second
+        finally:
+            await client.aclose()
+
+    first, second = asyncio.run(requests())
+    assert (first.status_code, second.status_code) == (200, 200)
+    # The second request waited for the end of the pause too
+    assert min(times[1:]) - times[0] >= 0.3
+    assert client.stats()["requests"] == 3
+
+def test_long_retry_after_is_not_waited_for():
+    client, times = throttling_client([httpx.Response(429, headers={"Retry-After": str(settings.GOOGLE_API_BACKOFF_MAX_SECONDS + 60)})])
+
+    async def request():
+        try:
+            return await client.get(URL)
+        finally:
+            await client.aclose()
+
+    started = time.monotonic()
+    response = asyncio.run(request())
+    assert response.status_code == 429
+    assert len(times) == 1
+    assert time.monotonic() - started < 1
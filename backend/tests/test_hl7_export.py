@@ -0,0 +1,48 @@
+from datetime import date, datetime, timedelta, timezone
+
+from services import hl7_export
+
+def test_er7_escaping_escapes_the_escape_character_first():
+    assert hl7_export.escape_er7("a|b^c&d~e\\f") == "a\\F\\b\\S\\c\\T\\d\\R\\e\\E\\f"
+    assert hl7_export.escape_er7(72.5) == "72.5"
+
+def test_segments_place_fields_at_their_positions():
+    msh = hl7_export.encode_segment(hl7_export.create_msh_segment()).split("|")
+    # MSH-1 is the separator itself, so MSH-n is at index n - 1
+    assert msh[:3] == ["MSH", "^~\\&", "HealthSyncApp"]
+    assert (msh[8], msh[11]) == ("ORU^R01", "2.3")
+
+    obx = hl7_export.encode_segment(hl7_export.create_obx_segment(2, "8867-4", "Heart rate", 61.5, "b|pm", datetime(2026, 1, 2, 3, 4, 5))).split("|")
+    assert obx[:7] == ["OBX", "2", "NM", "8867-4^Heart rate^LN", "", "61.5", "b\\F\\pm"]
+    assert (obx[11], obx[14]) == ("F", "20260102030405")
+
+def test_component_values_are_escaped_within_their_components():
+    pid = hl7_export.encode_segment({"segment": "PID", "patient_id": 7, "external_patient_id": "g|1", "patient_name": "User^A&B", "patient_email": "a^b@example.com"})
+    assert pid.split("|") == ["PID", "", "g\\F\\1", "7", "", "User^A\\T\\B", "", "", "", "", "", "", "", "^NET^Internet^a\\S\\b@example.com"]
+
+def test_er7_export_of_a_synced_user(client, user_id, sync):
+    sync(user_id, days=3)
+    response = client.get(f"/users/{user_id}/export/hl7", params={"format": "er7"})
+    assert response.headers["content-type"].startswith(hl7_export.ER7_MEDIA_TYPE)
+
+    segments = response.text.split("\r")
+    # Every segment ends with a carriage return
+    assert segments.pop() == ""
+    names = [segment.split("|", 1)[0] for segment in segments]
+    assert names[:3] == ["MSH", "PID", "OBR"]
+    assert set(names[3:]) == {"OBX"}
+    assert [segment.split("|")[1] for segment in segments[3:]] == [str(set_id) for set_id in range(1, len(segments) - 2)]
+
+def test_consecutive_export_windows_share_no_step_day(client, user_id, sync):
+    sync(user_id, days=3)
+    today = datetime.now(timezone.utc).date()
+
+    def step_days(start: date, end: date) -> list[str]:
+        segments = client.get(f"/users/{user_id}/export/hl7", params={"start": start.isoformat(), "end": end.isoformat()}).json()["hl7_message"]
+        return [segment["observation_datetime"][:8] for segment in segments if segment.get("observation_identifier", "").startswith("88942-2")]
+
+    middle = today - timedelta(days=1)
+    first, second = step_days(today - timedelta(days=3), middle), step_days(middle, today + timedelta(days=1))
+    assert first and second
+    assert not set(first) & set(second)
+    assert sorted(first + second) == step_days(today - timedelta(days=3), today + timedelta(days=1))
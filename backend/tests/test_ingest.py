@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from sqlalchemy import select
+
+from db import crud, database, models
+
+def test_repeated_upsert_keeps_one_row_per_key(run, user_id):
+    points = [{"timestamp": datetime(2026, 1, 1, hour), "value": 100 * hour} for hour in range(3)]
+    updated = [{"timestamp": datetime(2026, 1, 1, hour), "value": 100 * hour + 1} for hour in range(3)]
+
+    async def ingest_twice():
+        async with database.AsyncSessionLocal() as db:
+            await crud.add_steps_data(db, user_id, points)
+            await crud.add_steps_data(db, user_id, points)
+            await crud.add_steps_data(db, user_id, updated)
+            await db.commit()
+            rows = await db.execute(
+                select(models.Steps.timestamp, models.Steps.value).where(models.Steps.user_id == user_id).order_by(models.Steps.timestamp)
+            )
+            return rows.all()
+
+    assert run(ingest_twice) == [(point["timestamp"], point["value"]) for point in updated]
+
+def test_repeated_sleep_upsert_matches_on_start_time(run, user_id):
+    segment = {"start_time": datetime(2026, 1, 1, 23), "end_time": datetime(2026, 1, 2, 1), "value": 4}
+
+    async def ingest_twice():
+        async with database.AsyncSessionLocal() as db:
+            await crud.add_sleep_data(db, user_id, [segment])
+            await crud.add_sleep_data(db, user_id, [{**segment, "end_time": datetime(2026, 1, 2, 2), "value": 5}])
+            await db.commit()
+            rows = await db.execute(select(models.Sleep.end_time, models.Sleep.value).where(models.Sleep.user_id == user_id))
+            return rows.all()
+
+    assert run(ingest_twice) == [(datetime(2026, 1, 2, 2), 5)]
+
+def test_duplicate_keys_in_one_batch_keep_the_last_value(run, user_id):
+    timestamp = datetime(2026, 1, 1, 12)
+
+    async def ingest_duplicates():
+        async with database.AsyncSessionLocal() as db:
+            await crud.add_heart_rate_data(db, user_id, [{"timestamp": timestamp, "value": 60.0}, {"timestamp": timestamp, "value": 62.0}])
+            await db.commit()
+            rows = await db.execute(select(models.HeartRate.timestamp, models.HeartRate.value).where(models.HeartRate.user_id == user_id))
+            return rows.all()
+
+    assert run(ingest_duplicates) == [(timestamp, 62.0)]
@@ -0,0 +1,15 @@
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client.parser import text_string_to_metric_families
+
+def test_metrics_are_exposed_in_the_prometheus_text_format(client, user_id):
+    client.get(f"/users/{user_id}/overview")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == CONTENT_TYPE_LATEST
+
+    families = {family.name: family for family in text_string_to_metric_families(response.text)}
+    assert families["healthsync_http_request_seconds"].type == "histogram"
+    routes = {sample.labels.get("route") for sample in families["healthsync_http_request_seconds"].samples}
+    assert "/users/{user_id}/overview" in routes
+    assert families["healthsync_response_cache_lookups"].type == "counter"
+    assert {sample.labels["state"] for sample in families["healthsync_scheduler_users"].samples} == {"backlog", "queued", "in_progress", "waiting_for_retry"}
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import UniqueConstraint, create_engine, inspect, text
+
+from db import models, provisioning
+
+def build_legacy_database(url: str):
+    """A database as create_all built it before migrations existed: the baseline schema, without alembic_version."""
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        config = Config(str(provisioning.ALEMBIC_INI))
+        config.attributes["connection"] = conn
+        config.attributes["configure_logging"] = False
+        command.upgrade(config, provisioning.BASELINE_REVISION)
+        conn.execute(text("DROP TABLE alembic_version"))
+    return engine
+
+def test_legacy_database_is_upgraded_to_the_models(tmp_path):
+    engine = build_legacy_database(f"sqlite:///{tmp_path}/legacy.db")
+    timestamp = datetime(2026, 1, 1, 12)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (google_id, email, access_token) VALUES ('legacy', 'legacy@example.com', 'token')"))
+        user_id = conn.execute(text("SELECT id FROM users")).scalar()
+        # Duplicates the missing unique constraints let in; the latest (highest id) one is kept
+        for value in (1, 2, 3):
+            conn.execute(text("INSERT INTO steps (user_id, timestamp, value) VALUES (:user_id, :timestamp, :value)"),
+                         {"user_id": user_id, "timestamp": timestamp, "value": value})
+            conn.execute(text("INSERT INTO sleep (user_id, start_time, end_time, value) VALUES (:user_id, :timestamp, :timestamp, :value)"),
+                         {"user_id": user_id, "timestamp": timestamp, "value": value})
+        # The next day's bucket: moved back a day onto the key the one above leaves
+        conn.execute(text("INSERT INTO steps (user_id, timestamp, value) VALUES (:user_id, :timestamp, 4)"),
+                     {"user_id": user_id, "timestamp": timestamp + timedelta(days=1)})
+
+    provisioning.migrate(engine)
+    # Idempotent: a second run has nothing to do
+    provisioning.migrate(engine)
+
+    with engine.connect() as conn:
+        # Steps were stamped with the end of their one-day bucket: moved to its start, keeping their ids
+        steps = conn.execute(text("SELECT id, timestamp, value FROM steps ORDER BY timestamp")).all()
+        assert steps == [(3, str(timestamp - timedelta(days=1)) + ".000000", 3), (4, str(timestamp) + ".000000", 4)]
+        assert conn.execute(text("SELECT value FROM sleep")).scalars().all() == [3]
+        assert conn.execute(text("SELECT data_version FROM users")).scalars().all() == [0]
+
+        inspector = inspect(conn)
+        for table in models.Base.metadata.sorted_tables:
+            assert {column["name"] for column in inspector.get_columns(table.name)} == set(table.c.keys()), table.name
+            assert {index.name for index in table.indexes} <= {index["name"] for index in inspector.get_indexes(table.name)}, table.name
+            unique_constraints = {constraint.name for constraint in table.constraints if isinstance(constraint, UniqueConstraint)}
+            assert unique_constraints <= {constraint["name"] for constraint in inspector.get_unique_constraints(table.name)}, table.name
+    engine.dispose()
+
+def test_new_database_is_migrated_to_head(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/new.db")
+    provisioning.migrate(engine)
+    with engine.connect() as conn:
+        assert set(models.Base.metadata.tables) <= set(inspect(conn).get_table_names())
+        revision = conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+    engine.dispose()
+
+    head = ScriptDirectory.from_config(Config(str(provisioning.ALEMBIC_INI))).get_current_head()
+    assert revision == head
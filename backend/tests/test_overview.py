@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta, timezone
+
+from api import caching
+
+def test_overview_shows_today_after_a_sync(client, user_id, sync):
+    # Read before the sync too, so a cached empty overview must be replaced
+    empty = client.get(f"/users/{user_id}/overview").json()
+    assert all(series["latest"] is None and not series["today"] for series in empty["series"].values())
+
+    sync(user_id, days=3)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    overview = client.get(f"/users/{user_id}/overview").json()
+    today = now.date().isoformat()
+    assert overview["day"] == today
+
+    today_steps = {rollup["day"]: rollup["sum"] for rollup in client.get(f"/users/{user_id}/data/steps/daily").json()}[today]
+    steps = overview["series"]["steps"]
+    assert steps["today"] == {"value": today_steps}
+    assert steps["trend"][-1] == {"day": today, "values": steps["today"]}
+    assert overview["series"]["heart_rate"]["today"]
+
+    for series in overview["series"].values():
+        if series["latest"] is not None:
+            assert datetime.fromisoformat(series["latest"]["time"]) <= now
+        assert len(series["trend"]) <= 7
+
+def test_cached_overview_expires_at_midnight(client, user_id, sync, monkeypatch):
+    sync(user_id, days=3)
+    etag = client.get(f"/users/{user_id}/overview").headers["ETag"]
+    assert client.get(f"/users/{user_id}/overview", headers={"If-None-Match": etag}).status_code == 304
+
+    class Tomorrow(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(days=1)
+
+    monkeypatch.setattr(caching, "datetime", Tomorrow)
+    response = client.get(f"/users/{user_id}/overview", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+from db import crud, database
+
+def ingest_steps(run, user_id: int, timestamps: list[datetime]):
+    async def ingest():
+        async with database.AsyncSessionLocal() as db:
+            await crud.add_steps_data(db, user_id, [{"timestamp": timestamp, "value": index} for index, timestamp in enumerate(timestamps)])
+            await crud.bump_data_version(db, user_id)
+            await db.commit()
+    run(ingest)
+
+def read_pages(client, user_id: int, limit: int) -> list[list[dict]]:
+    pages, params = [], {"limit": limit}
+    while True:
+        response = client.get(f"/users/{user_id}/data/steps", params=params)
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+        params = {"limit": limit, "after": cursor}
+
+def test_keyset_pages_have_no_gaps_or_duplicates(client, run, user_id, create_user):
+    start = datetime(2026, 1, 1, 12)
+    # Microsecond-apart points around second boundaries, and another user with the same timestamps
+    timestamps = [start + timedelta(seconds=second, microseconds=micro) for second in range(4) for micro in (0, 1, 999999)]
+    ingest_steps(run, user_id, timestamps)
+    ingest_steps(run, create_user(), timestamps)
+
+    everything = client.get(f"/users/{user_id}/data/steps").json()
+    assert len(everything) == len(timestamps)
+    for limit in (1, 4, 5, len(timestamps), len(timestamps) + 1):
+        pages = read_pages(client, user_id, limit)
+        assert all(len(page) == limit for page in pages[:-1])
+        assert [row for page in pages for row in page] == everything, limit
@@ -0,0 +1,45 @@
+from datetime import date
+
+from services.response_cache import CachedResponse, ResponseCache
+
+def test_etag_revalidates_until_the_data_changes(client, user_id, sync):
+    url = f"/users/{user_id}/data/steps"
+    first = client.get(url)
+    etag = first.headers["ETag"]
+    assert (first.status_code, first.json()) == (200, [])
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={"If-None-Match": f'W/{etag}, "other"'}).status_code == 304
+
+    sync(user_id)
+    after = client.get(url, headers={"If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.json()
+    assert after.headers["ETag"] != etag
+    assert client.get(url, headers={"If-None-Match": after.headers["ETag"]}).status_code == 304
+
+def test_unknown_user_is_not_cached(client):
+    response = client.get("/users/999999999/data/steps")
+    assert "ETag" not in response.headers
+
+def test_newer_data_version_drops_older_entries():
+    cache = ResponseCache(max_bytes=1024, max_entry_bytes=1024)
+    today = date(2026, 1, 1)
+    old_key = cache.key(1, 1, today, "/users/1/data/steps", "")
+    cache.put(old_key, CachedResponse(200, [], b"old"))
+    other_user_key = cache.key(2, 1, today, "/users/2/data/steps", "")
+    cache.put(other_user_key, CachedResponse(200, [], b"other"))
+
+    new_key = cache.key(1, 2, today, "/users/1/data/steps", "")
+    assert cache.get(old_key) is None
+    assert cache.get(other_user_key).body == b"other"
+
+    # A response built from the old version while the data changed is not stored
+    cache.put(old_key, CachedResponse(200, [], b"late"))
+    assert cache.get(old_key) is None
+    assert cache.etag(new_key) != cache.etag(old_key)
+
+def test_query_parameter_order_shares_an_entry():
+    cache = ResponseCache(max_bytes=1024, max_entry_bytes=1024)
+    today = date(2026, 1, 1)
+    assert cache.key(1, 1, today, "/p", "a=1&b=2") == cache.key(1, 1, today, "/p", "b=2&a=1")
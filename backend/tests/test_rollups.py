@@ -0,0 +1,49 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import pytest
+
+from services import sync_service
+
+def daily_rollups(client, user_id: int, series: str) -> dict[str, dict]:
+    return {rollup["day"]: rollup for rollup in client.get(f"/users/{user_id}/data/{series}/daily").json()}
+
+def raw_by_day(client, user_id: int, series: str) -> dict[str, list[float]]:
+    values = defaultdict(list)
+    for point in client.get(f"/users/{user_id}/data/{series}").json():
+        values[point["timestamp"][:10]].append(point["value"])
+    return values
+
+def test_aggregate_points_count_towards_the_day_of_their_bucket(client, user_id, sync):
+    sync(user_id, days=3)
+    today = datetime.now(timezone.utc).date().isoformat()
+
+    # Daily buckets (the default) are stamped at their start, midnight UTC of the day they cover
+    for series in ("steps", "heart_rate"):
+        points = client.get(f"/users/{user_id}/data/{series}").json()
+        assert points and all(point["timestamp"].endswith("T00:00:00") for point in points), series
+        assert max(point["timestamp"][:10] for point in points) == today, series
+
+    for series in ("steps", "heart_rate"):
+        rollups, raw = daily_rollups(client, user_id, series), raw_by_day(client, user_id, series)
+        assert set(rollups) == set(raw), series
+        assert max(rollups) == today, series
+        for day, values in raw.items():
+            assert rollups[day]["count"] == len(values), (series, day)
+            assert rollups[day]["sum"] == pytest.approx(sum(values)), (series, day)
+
+def test_finer_buckets_count_towards_the_day_they_start_in(client, user_id, sync, monkeypatch):
+    # SYNC_BUCKET_MINUTES={"heart_rate": 15}, as read at import
+    monkeypatch.setitem(sync_service.DATA_TYPE_CONFIG["AGGREGATE"]["heart_rate"], "bucketMillis", 15 * 60000)
+    sync(user_id, days=3)
+
+    # Every complete day has 96 buckets, none spilling into the next day
+    counts = [rollup["count"] for rollup in daily_rollups(client, user_id, "heart_rate").values()]
+    assert all(count <= 96 for count in counts)
+    assert 96 in counts
+
+def test_resync_rebuilds_rollups_without_double_counting(client, user_id, sync):
+    sync(user_id, days=3)
+    before = daily_rollups(client, user_id, "steps")
+    sync(user_id, days=3)
+    assert daily_rollups(client, user_id, "steps") == before
@@ -0,0 +1,47 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from db import crud, database
+
+def add_foreign_job(run, user_id: int, heartbeat_age: timedelta = timedelta()) -> str:
+    """An active job as written by another worker, that last wrote it 'heartbeat_age' ago."""
+    job_id = uuid.uuid4().hex
+    now = datetime.now(timezone.utc)
+
+    async def add():
+        async with database.AsyncSessionLocal() as db:
+            crud.add_sync_job(
+                db, id=job_id, user_id=user_id, days=3, exclude=[], status="running", progress={"steps": {"status": "running"}},
+                created_at=now - heartbeat_age, started_at=now - heartbeat_age, heartbeat_at=now - heartbeat_age
+            )
+            await db.commit()
+    run(add)
+    return job_id
+
+def test_job_of_another_worker_is_reported_and_joined(client, run, user_id):
+    job_id = add_foreign_job(run, user_id)
+
+    job = client.get(f"/sync/jobs/{job_id}").json()
+    assert (job["user_id"], job["status"], job["progress"]) == (user_id, "running", {"steps": {"status": "running"}})
+
+    response = client.post(f"/users/{user_id}/sync")
+    assert response.status_code == 202
+    assert (response.json()["job_id"], response.json()["message"]) == (job_id, "Synchronization already in progress.")
+
+def test_abandoned_job_is_replaced(client, run, user_id, sync):
+    job_id = add_foreign_job(run, user_id, heartbeat_age=timedelta(minutes=5))
+
+    job = sync(user_id)
+    assert job["job_id"] != job_id
+    abandoned = client.get(f"/sync/jobs/{job_id}").json()
+    assert (abandoned["status"], abandoned["message"]) == ("failed", "Abandoned by its worker.")
+
+def test_finished_job_is_stored(client, run, user_id, sync):
+    job = sync(user_id)
+
+    async def stored_job():
+        async with database.AsyncSessionLocal() as db:
+            return await crud.get_sync_job(db, job["job_id"])
+    row = run(stored_job)
+    assert (row.status, row.details, row.finished_at is not None) == ("completed", job["details"], True)
+    assert row.progress == job["progress"]